@@ -0,0 +1,9 @@
+"""
+Module Name: benchmarks
+
+Description:
+Benchmarks of the PlatDB write and export hot paths, run with `python -m benchmarks` or `make benchmark`.
+
+License:
+SPDX-License-Identifier: Apache-2.0
+"""
@@ -0,0 +1,110 @@
+"""
+Module Name: __main__
+
+Description:
+Command line of the benchmarks, see `python -m benchmarks --help`.
+
+License:
+SPDX-License-Identifier: Apache-2.0
+"""
+import argparse
+import json
+import sys
+
+from benchmarks import graphs, suite
+from corelib.platdb import Neo4jConnection, PlatDBSerializer
+
+
+def _fanout(value: str) -> tuple[tuple[str, str], int]:
+    """`Label.attribute=N`"""
+    key, _, count = value.partition('=')
+    label, _, attr = key.partition('.')
+    if not (label and attr and count.isdigit()):
+        raise argparse.ArgumentTypeError(f'expected Label.relationship=N, got {value}')
+    return (label, attr), int(count)
+
+
+def _count(value: str) -> tuple[str, int]:
+    """`Label=N`"""
+    label, _, count = value.partition('=')
+    if not (label in PlatDBSerializer.labels() and count.isdigit()):
+        raise argparse.ArgumentTypeError(f'expected Label=N with a PlatDB label, got {value}')
+    return label, int(count)
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks',
+                                     description='Benchmarks of the PlatDB write and export operations.')
+    parser.add_argument('--backend', choices=['neo4j', 'memory'], default='neo4j',
+                        help='memory only measures corelib itself, without any query (default: %(default)s)')
+    parser.add_argument('--uri', default='bolt://localhost:7687', help='neo4j backend only')
+    parser.add_argument('--user', default='neo4j', help='neo4j backend only')
+    parser.add_argument('--password', default='guruai11', help='neo4j backend only')
+    parser.add_argument('--wipe-database', action='store_true',
+                        help='required by the neo4j backend, which deletes every node of the database')
+    parser.add_argument('--scales', default='1000,10000',
+                        help='comma separated node counts, ie. 1000,10000,100000 (default: %(default)s)')
+    parser.add_argument('--count', type=_count, action='append',
+                        help='nodes of a label at every scale, ie. TrafficController=500, instead of its share')
+    parser.add_argument('--fanout', type=_fanout, action='append',
+                        help='relationships per source node, ie. Application.resources=3, replacing the defaults')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each benchmark, the best is kept')
+    parser.add_argument('--only', help=f'comma separated benchmarks among {", ".join(suite.BENCHMARKS)}')
+    parser.add_argument('--output', help='write the JSON results there instead of stdout')
+    parser.add_argument('--baseline', help='JSON results to compare with, exits 1 on a regression')
+    parser.add_argument('--tolerance', type=float, default=suite.DEFAULT_TOLERANCE,
+                        help='slowdown allowed against the baseline (default: %(default)s)')
+    return parser
+
+
+def main(argv=None) -> int:
+    args = _parser().parse_args(argv)
+    fanout = dict(args.fanout) if args.fanout else None
+    counts = dict(args.count) if args.count else None
+    only = args.only.split(',') if args.only else None
+
+    connection = None
+    if args.backend == 'neo4j':
+        if not args.wipe_database:
+            print('the neo4j backend deletes the whole database, pass --wipe-database', file=sys.stderr)
+            return 2
+        connection = Neo4jConnection(uri=args.uri, auth=(args.user, args.password))
+        connection.open()
+        backend = suite.Neo4jBackend(connection)
+    else:
+        backend = suite.MemoryBackend()
+
+    results = []
+    try:
+        for scale in (int(scale) for scale in args.scales.split(',')):
+            graph = graphs.generate(graphs.GraphSpec.at_scale(scale, fanout, args.seed, counts))
+            results.extend(suite.run(backend, graph, scale, args.repeat, only))
+    finally:
+        if connection is not None:
+            connection.close()
+
+    document = json.dumps(suite.report(backend.name, results, args.repeat), indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as fp:
+            fp.write(document + '\n')
+    else:
+        print(document)
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as fp:
+        baseline = json.load(fp)
+    rows, regressions = suite.compare(results, baseline['results'], args.tolerance)
+    for row in rows:
+        print(f"{row['name']:32} {row['scale']:>8} {row['seconds']:10.4f}s {row['ratio'] or 0:6.2f}x "
+              f"{row['round_trips']:>6} round trips ({row['baseline_round_trips']} before)", file=sys.stderr)
+    for regression in regressions:
+        print(f'REGRESSION {regression}', file=sys.stderr)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Module Name: graphs
+
+Description:
+Synthetic PlatDB graphs for the benchmarks, with configurable node counts per class and fan-out per
+relationship.
+
+License:
+SPDX-License-Identifier: Apache-2.0
+"""
+import random
+
+from typing import NamedTuple
+
+from corelib.platdb import PlatDBNode, PlatDBSerializer
+
+# share of the nodes of a graph that are of each class, see GraphSpec.at_scale()
+DEFAULT_MIX = {
+    'Application': 0.2,
+    'Compute': 0.35,
+    'Deployment': 0.1,
+    'Resource': 0.25,
+    'TrafficController': 0.1,
+}
+
+# relationships created from each node of the source class, keyed by (source class, relationship attribute)
+DEFAULT_FANOUT = {
+    ('Application', 'application_to'): 2,
+    ('Application', 'resources'): 2,
+    ('Application', 'traffic_controllers'): 1,
+    ('Compute', 'applications'): 1,
+    ('Deployment', 'computes'): 4,
+}
+
+
+class GraphSpec(NamedTuple):
+    """The shape of a synthetic graph: `counts` nodes of each label and, for each `(label, relationship
+       attribute)` of `fanout`, that many relationships from each node of the label to random nodes"""
+    counts: dict[str, int]
+    fanout: dict[tuple[str, str], int]
+    seed: int = 0
+
+    @classmethod
+    def at_scale(cls, nodes: int, fanout: dict[tuple[str, str], int] = None, seed: int = 0,
+                 counts: dict[str, int] = None) -> "GraphSpec":
+        """About `nodes` nodes in the DEFAULT_MIX proportions, the labels of `counts` having that many nodes
+           whatever the scale"""
+        return cls(dict({label: max(1, round(nodes * share)) for label, share in DEFAULT_MIX.items()}, **counts or {}),
+                   DEFAULT_FANOUT if fanout is None else fanout, seed)
+
+
+class Graph(NamedTuple):
+    """A generated graph: the records to upsert per node class, and the bulk_connect() edges per source class.
+       Edges identify their nodes by merge key, so they don't depend on the element ids of any backend."""
+    records: dict[type[PlatDBNode], list[dict]]
+    edges: dict[type[PlatDBNode], list[tuple]]
+
+    @property
+    def node_count(self) -> int:
+        return sum(len(records) for records in self.records.values())
+
+    @property
+    def edge_count(self) -> int:
+        return sum(len(edges) for edges in self.edges.values())
+
+
+def _address(number: int, prefix: int) -> str:
+    return f"{prefix}.{number >> 16 & 255}.{number >> 8 & 255}.{number & 255}"
+
+
+def _record(label: str, number: int) -> dict:
+    if label == 'Compute':
+        return {"address": _address(number, 10), "name": f"compute-{number}", "platform": "k8s",
+                "protocol": "HTTP", "protocol_multiplexor": "80"}
+    if label == 'Deployment':
+        return {"name": f"deployment-{number}", "address": _address(number, 11), "protocol": "TCP",
+                "protocol_multiplexor": "443", "deployment_type": "k8s_deployment"}
+    if label in ('Resource', 'TrafficController'):
+        # a third of them are only known by address, a third only by dns name, the others by both
+        record = {"name": f"{label.lower()}-{number}", "protocol": "TCP", "protocol_multiplexor": "5432"}
+        if number % 3 != 1:
+            record["address"] = _address(number, 172 if label == 'Resource' else 173)
+        if number % 3 != 0:
+            record["dns_names"] = [f"{label.lower()}-{number}.internal", f"{label.lower()}-{number}.example.com"]
+        return record
+
+    return {"name": f"{label.lower()}-{number}", "provider": "aws"}
+
+
+def _key(record: dict) -> dict:
+    """A bulk_connect() key of the node of `record`"""
+    if "address" in record:
+        return {"address": record["address"]}
+    if "dns_names" in record:
+        return {"dns_names": record["dns_names"]}
+    return {"name": record["name"]}
+
+
+def generate(spec: GraphSpec) -> Graph:
+    """The graph of `spec`, the same for the same spec"""
+    rng = random.Random(spec.seed)
+    records = {}
+    for label, count in spec.counts.items():
+        platdb_cls = PlatDBSerializer.for_label(label).platdb_cls
+        records[platdb_cls] = [_record(label, number) for number in range(count)]
+
+    edges = {}
+    for (label, attr), fanout in spec.fanout.items():
+        platdb_cls = PlatDBSerializer.for_label(label).platdb_cls
+        relationship = dict(platdb_cls.__all_relationships__)[attr]
+        relationship.lookup_node_class()
+        targets = records.get(relationship.definition['node_class'], [])
+        if not targets:
+            continue
+
+        for record in records.get(platdb_cls, []):
+            for target in rng.sample(targets, min(fanout, len(targets))):
+                if target is not record:
+                    edges.setdefault(platdb_cls, []).append((_key(record), _key(target), attr, None))
+
+    return Graph(records, edges)
@@ -0,0 +1,209 @@
+"""
+Module Name: suite
+
+Description:
+The benchmarks of the PlatDB write and export operations, the backends they run against, and the comparison
+of their results with a baseline.
+
+License:
+SPDX-License-Identifier: Apache-2.0
+"""
+import datetime
+import platform
+import time
+
+from typing import Callable, Iterator, Optional
+
+from neomodel import db, install_labels
+
+from benchmarks.graphs import Graph
+from corelib.instrumentation import count_round_trips
+from corelib.memory import InMemoryPlatDB
+from corelib.platdb import (Neo4jConnection,
+                            PlatDBDNSNode,
+                            PlatDBDnsName,
+                            PlatDBNode,
+                            PlatDBSerializer,
+                            PlatDBTombstone)
+
+# create_or_update() calls timed by the dns_upsert benchmarks, they are one query each
+DNS_UPSERT_SAMPLE = 1000
+
+# a benchmark is slower than its baseline when it takes that much longer
+DEFAULT_TOLERANCE = 0.25
+
+
+class MemoryBackend:
+    """Runs the operations on an InMemoryPlatDB, which measures corelib's own overhead.  No query is sent,
+       so round trips are always 0 and the timings say nothing of the queries: use Neo4jBackend for those."""
+    name = 'memory'
+
+    def __init__(self):
+        self.platdb = InMemoryPlatDB()
+
+    def reset(self):
+        self.platdb = InMemoryPlatDB()
+
+    def call(self, operation: str, platdb_cls: type[PlatDBNode], *args, **kwargs):
+        return getattr(self.platdb, operation)(platdb_cls, *args, **kwargs)
+
+    def export(self) -> tuple[dict, list]:
+        return self.platdb.get_full_graph_as_json()
+
+
+class Neo4jBackend:
+    """Runs the PlatDBNode classmethods against an open Neo4jConnection, once the indexes and constraints of
+       every PlatDB class are installed, as in production.  reset() deletes the whole database, don't point it
+       at a database you care about."""
+    name = 'neo4j'
+
+    def __init__(self, connection: Neo4jConnection):
+        self.connection = connection
+        for label in PlatDBSerializer.labels():
+            install_labels(PlatDBSerializer.for_label(label).platdb_cls)
+        install_labels(PlatDBDnsName)
+        install_labels(PlatDBTombstone)
+
+    def reset(self):
+        db.cypher_query("MATCH (n) CALL { WITH n DETACH DELETE n } IN TRANSACTIONS OF 10000 ROWS")
+
+    def call(self, operation: str, platdb_cls: type[PlatDBNode], *args, **kwargs):
+        return getattr(platdb_cls, operation)(*args, **kwargs)
+
+    def export(self) -> tuple[dict, list]:
+        return self.connection.get_full_graph_as_json(use_cache=False)
+
+
+Operation = tuple[str, int, Callable[[], object]]
+
+
+def _load(backend, graph: Graph, edges: bool = True):
+    backend.reset()
+    for platdb_cls, records in graph.records.items():
+        backend.call('bulk_upsert', platdb_cls, records)
+    if edges:
+        for platdb_cls, class_edges in graph.edges.items():
+            backend.call('bulk_connect', platdb_cls, class_edges)
+
+
+def upsert(backend, graph: Graph) -> Iterator[Operation]:
+    """bulk_upsert() of every node of a class into an empty database"""
+    for platdb_cls, records in graph.records.items():
+        backend.reset()
+        yield (f'upsert.{platdb_cls.__label__}', len(records),
+               lambda platdb_cls=platdb_cls, records=records: backend.call('bulk_upsert', platdb_cls, records))
+
+
+def dns_upsert(backend, graph: Graph) -> Iterator[Operation]:
+    """create_or_update() of existing DNS nodes one at a time, each found through the address index or the
+       PlatDBDnsName index, so its latency shouldn't grow with the number of nodes of the class"""
+    _load(backend, graph, edges=False)
+    for platdb_cls, records in graph.records.items():
+        if issubclass(platdb_cls, PlatDBDNSNode):
+            sample = records[:DNS_UPSERT_SAMPLE]
+
+            def operation(platdb_cls=platdb_cls, sample=sample):
+                for record in sample:
+                    backend.call('create_or_update', platdb_cls, record)
+
+            yield f'dns_upsert.{platdb_cls.__label__}', len(sample), operation
+
+
+def connect(backend, graph: Graph) -> Iterator[Operation]:
+    """bulk_connect() of every relationship"""
+    _load(backend, graph, edges=False)
+
+    def operation():
+        for platdb_cls, edges in graph.edges.items():
+            backend.call('bulk_connect', platdb_cls, edges)
+
+    yield 'connect', graph.edge_count, operation
+
+
+def delete(backend, graph: Graph) -> Iterator[Operation]:
+    """delete_many_by_attributes() of half the nodes of each class, relationships included"""
+    _load(backend, graph)
+    for platdb_cls, records in graph.records.items():
+        keys = [{"address": record["address"]} if "address" in record else {"name": record["name"]}
+                for record in records[::2]]
+        yield (f'delete.{platdb_cls.__label__}', len(keys),
+               lambda platdb_cls=platdb_cls, keys=keys: backend.call('delete_many_by_attributes', platdb_cls, keys))
+
+
+def export(backend, graph: Graph) -> Iterator[Operation]:
+    """get_full_graph_as_json() of the whole graph, items counting vertices and edges"""
+    _load(backend, graph)
+    yield 'export', graph.node_count + graph.edge_count, backend.export
+
+
+BENCHMARKS = {
+    'upsert': upsert,
+    'dns_upsert': dns_upsert,
+    'connect': connect,
+    'delete': delete,
+    'export': export,
+}
+
+
+def run(backend, graph: Graph, scale: int, repeat: int = 3, only: Optional[list[str]] = None) -> list[dict]:
+    """The best of `repeat` runs of each benchmark, `only` naming the BENCHMARKS to run"""
+    results = {}
+    for _ in range(repeat):
+        for name, benchmark in BENCHMARKS.items():
+            if only and name not in only:
+                continue
+
+            for operation_name, items, operation in benchmark(backend, graph):
+                with count_round_trips() as round_trips:
+                    start = time.perf_counter()
+                    operation()
+                    seconds = time.perf_counter() - start
+
+                best = results.get(operation_name)
+                if best is None or seconds < best['seconds']:
+                    results[operation_name] = {
+                        "name": operation_name,
+                        "scale": scale,
+                        "items": items,
+                        "seconds": seconds,
+                        "items_per_second": items / seconds if seconds else None,
+                        "round_trips": round_trips.count,
+                    }
+
+    return list(results.values())
+
+
+def report(backend_name: str, results: list[dict], repeat: int) -> dict:
+    """The JSON document of a run"""
+    return {
+        "backend": backend_name,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "repeat": repeat,
+        "results": results,
+    }
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float = DEFAULT_TOLERANCE
+            ) -> tuple[list[dict], list[str]]:
+    """Each result next to the baseline result of the same name and scale, and a message for each
+       regression: `tolerance` slower than the baseline, or more round trips"""
+    baseline_by_key = {(result['name'], result['scale']): result for result in baseline}
+    rows = []
+    regressions = []
+    for result in results:
+        base = baseline_by_key.get((result['name'], result['scale']))
+        if base is None:
+            continue
+
+        ratio = result['seconds'] / base['seconds'] if base['seconds'] else None
+        rows.append(dict(result, baseline_seconds=base['seconds'], baseline_round_trips=base['round_trips'],
+                         ratio=ratio))
+        label = f"{result['name']} @ {result['scale']}"
+        if ratio is not None and ratio > 1 + tolerance:
+            regressions.append(f"{label}: {ratio:.2f}x the baseline time")
+        if result['round_trips'] > base['round_trips']:
+            regressions.append(f"{label}: {result['round_trips']} round trips, {base['round_trips']} in the baseline")
+
+    return rows, regressions
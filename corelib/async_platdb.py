@@ -0,0 +1,235 @@
+"""
+Module Name: async_platdb
+
+Description:
+Neo4jConnection for asyncio, running the PlatDB operations on the neo4j async driver.
+
+License:
+SPDX-License-Identifier: Apache-2.0
+"""
+import datetime
+
+from typing import Any, AsyncIterator, Awaitable, Iterable, Optional
+
+import neo4j
+
+from neo4j import AsyncGraphDatabase
+from neomodel.util import EITHER
+
+from corelib import instrumentation
+from corelib.platdb import (DEFAULT_BATCH_SIZE,
+                            DEFAULT_PAGE_SIZE,
+                            FULL_GRAPH_EDGES_QUERY,
+                            FULL_GRAPH_VERTICES_QUERY,
+                            GRAPH_EDGE,
+                            GRAPH_VERTEX,
+                            WATERMARK_LAG,
+                            GraphDelta,
+                            Lease,
+                            Neo4jConnection,
+                            PlatDBDNSNode,
+                            PlatDBNode,
+                            QueryPlan,
+                            driver_config,
+                            edge_ht,
+                            graph_delta_plan,
+                            graph_page_plan,
+                            label_scan,
+                            notify_write,
+                            subgraph_plan,
+                            vertex_ht)
+
+
+class AsyncNeo4jConnection:
+    """Neo4jConnection for asyncio, built on the neo4j async driver.
+
+    Every coroutine using the connection shares the driver's connection pool, so concurrent tasks don't
+    each need a thread.  The PlatDB operations take the node class as their first argument, ie.
+    `await connection.bulk_upsert(Compute, records)`, and run the same queries as the classmethods of the
+    same name.  The async connection is not registered with neomodel, `Compute.nodes`, save() and
+    friends still need a Neo4jConnection."""
+    # pylint: disable=protected-access
+    DEFAULT_FETCH_SIZE = Neo4jConnection.DEFAULT_FETCH_SIZE
+
+    def __init__(self,
+                 uri: str,
+                 auth: tuple[str, str],
+                 database: Optional[str] = None,
+                 fetch_size: int = DEFAULT_FETCH_SIZE,
+                 max_connection_pool_size: Optional[int] = None,
+                 connection_acquisition_timeout: Optional[float] = None,
+                 keep_alive: Optional[bool] = None,
+                 max_connection_lifetime: Optional[float] = None):
+        """See Neo4jConnection for the settings"""
+        self._uri = uri
+        self._auth = auth
+        self._database = database
+        self._fetch_size = fetch_size
+        self._driver_config = driver_config(
+            max_connection_pool_size=max_connection_pool_size,
+            connection_acquisition_timeout=connection_acquisition_timeout,
+            keep_alive=keep_alive,
+            max_connection_lifetime=max_connection_lifetime)
+
+        self._driver = None
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def open(self):
+        self._driver = AsyncGraphDatabase.driver(self._uri, auth=self._auth, **self._driver_config)
+
+        # Clear sensitive information
+        self._auth = None
+
+        return self
+
+    async def close(self):
+        await self._driver.close()
+
+    async def get_full_graph_as_json(self) -> tuple[dict, list]:
+        vertices = {}
+        edges = []
+
+        async for kind, key, data in self.iter_full_graph():
+            if kind == GRAPH_VERTEX:
+                vertices[key] = data
+            else:
+                edges.append(data)
+
+        return vertices, edges
+
+    async def iter_full_graph(self, fetch_size: Optional[int] = None
+                              ) -> AsyncIterator[tuple[str, str, dict]]:
+        """See Neo4jConnection.iter_full_graph()"""
+        async with self._driver.session(database=self._database,
+                                        fetch_size=fetch_size or self._fetch_size,
+                                        default_access_mode=neo4j.READ_ACCESS) as session:
+            async with await session.begin_transaction() as tx:
+                vertices_query = FULL_GRAPH_VERTICES_QUERY.format(label_scan=label_scan())
+                async for vertex, vertex_type, outgoing, incoming in instrumentation.stream_async(
+                        vertices_query, lambda: tx.run(vertices_query), 'AsyncNeo4jConnection.iter_full_graph'):
+                    yield GRAPH_VERTEX, vertex.element_id, vertex_ht(vertex_type[0], vertex, outgoing, incoming)
+
+                async for edge_id, start_node, end_node, edge_type, properties in instrumentation.stream_async(
+                        FULL_GRAPH_EDGES_QUERY, lambda: tx.run(FULL_GRAPH_EDGES_QUERY),
+                        'AsyncNeo4jConnection.iter_full_graph'):
+                    yield GRAPH_EDGE, edge_id, edge_ht(start_node, end_node, edge_type, properties)
+
+    async def get_graph_page(self, cursor: Optional[str] = None, page_size: int = DEFAULT_PAGE_SIZE
+                             ) -> tuple[dict, list, Optional[str]]:
+        """See Neo4jConnection.get_graph_page()"""
+        return await self._run_read_plan('get_graph_page', graph_page_plan(cursor, page_size))
+
+    async def get_graph_delta(self, since: Optional[datetime.datetime], lag: float = WATERMARK_LAG) -> GraphDelta:
+        """See Neo4jConnection.get_graph_delta()"""
+        return await self._run_read_plan('get_graph_delta', graph_delta_plan(since, lag))
+
+    async def get_subgraph_as_json(self, platdb_cls: type[PlatDBNode], key: Any, max_depth: int = 1,
+                                   relationship_types: Optional[Iterable[str]] = None, direction: int = EITHER
+                                   ) -> tuple[dict, list]:
+        """See Neo4jConnection.get_subgraph_as_json()"""
+        return await self._run_read_plan(
+            'get_subgraph_as_json', subgraph_plan(platdb_cls, key, max_depth, relationship_types, direction))
+
+    async def create_or_update(self, platdb_cls: type[PlatDBNode], *props: dict) -> list[PlatDBNode]:
+        return await self._run_write_plan(
+            platdb_cls, 'create_or_update', platdb_cls._create_or_update_plan(props))
+
+    async def bulk_upsert(self, platdb_cls: type[PlatDBNode], records: Iterable[dict],
+                          batch_size: int = DEFAULT_BATCH_SIZE) -> list[str]:
+        return await self._run_write_plan(
+            platdb_cls, 'bulk_upsert', platdb_cls._bulk_upsert_plan(records, batch_size))
+
+    async def bulk_connect(self, platdb_cls: type[PlatDBNode], edges: Iterable[tuple],
+                           batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        return await self._run_write_plan(
+            platdb_cls, 'bulk_connect', platdb_cls._bulk_connect_plan(edges, batch_size))
+
+    async def delete_by_attributes(self, platdb_cls: type[PlatDBNode], attributes: dict) -> bool:
+        return await self.delete_many_by_attributes(platdb_cls, [attributes]) > 0
+
+    async def delete_many_by_attributes(self, platdb_cls: type[PlatDBNode], attributes_list: Iterable[dict],
+                                        batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        return await self._run_write_plan(
+            platdb_cls, 'delete_many_by_attributes',
+            platdb_cls._delete_many_by_attributes_plan(attributes_list, batch_size))
+
+    async def update(self, platdb_cls: type[PlatDBNode], attributes: dict, new_attributes: dict
+                     ) -> Optional[PlatDBNode]:
+        return await self._run_write_plan(
+            platdb_cls, 'update', platdb_cls._update_plan(attributes, new_attributes))
+
+    async def update_many(self, platdb_cls: type[PlatDBNode], updates: Iterable[tuple[dict, dict]],
+                          batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        return await self._run_write_plan(
+            platdb_cls, 'update_many', platdb_cls._update_many_plan(updates, batch_size))
+
+    async def claim_stale(self, platdb_cls: type[PlatDBNode], older_than: datetime.timedelta,
+                          lease: datetime.timedelta, limit: int) -> Lease:
+        return await self._run_write_plan(
+            platdb_cls, 'claim_stale', platdb_cls._claim_stale_plan(older_than, lease, limit))
+
+    async def renew_leases(self, platdb_cls: type[PlatDBNode], token: str,
+                           element_ids: Optional[Iterable[str]] = None) -> int:
+        return await self._run_write_plan(
+            platdb_cls, 'renew_leases', platdb_cls._renew_leases_plan(token, element_ids))
+
+    async def release_leases(self, platdb_cls: type[PlatDBNode], token: str,
+                             element_ids: Optional[Iterable[str]] = None, profiled: bool = False) -> int:
+        return await self._run_write_plan(
+            platdb_cls, 'release_leases', platdb_cls._release_leases_plan(token, element_ids, profiled))
+
+    async def find_by_dns_names(self, platdb_cls: type[PlatDBDNSNode], dns_names: list[str]
+                                ) -> Optional[PlatDBDNSNode]:
+        with instrumentation.operation(f'{platdb_cls.__name__}.find_by_dns_names'):
+            return await self._run_plan(platdb_cls._find_by_dns_names_plan(dns_names))
+
+    async def reconcile_duplicates(self, platdb_cls: type[PlatDBDNSNode],
+                                   batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        return await self._run_write_plan(
+            platdb_cls, 'reconcile_duplicates', platdb_cls._reconcile_duplicates_plan(batch_size))
+
+    async def _run_plan(self, plan: QueryPlan) -> Any:
+        """_run_plan() on the async driver"""
+        try:
+            query, params = next(plan)
+            while True:
+                query, params = plan.send(await self._query(query, params))
+        except StopIteration as stop:
+            return stop.value
+
+    async def _run_write_plan(self, platdb_cls: type[PlatDBNode], operation: str, plan: QueryPlan) -> Any:
+        try:
+            with instrumentation.operation(f'{platdb_cls.__name__}.{operation}'):
+                return await self._run_plan(plan)
+        finally:
+            notify_write(platdb_cls, operation)
+
+    async def _run_read_plan(self, operation: str, plan: QueryPlan) -> Any:
+        """_run_plan() in a read transaction, its queries reported as sent by the connection's `operation`"""
+        async with self._driver.session(database=self._database,
+                                        default_access_mode=neo4j.READ_ACCESS) as session:
+            async with await session.begin_transaction() as tx:
+                with instrumentation.operation(f'AsyncNeo4jConnection.{operation}'):
+                    try:
+                        query, params = next(plan)
+                        while True:
+                            query, params = plan.send(await instrumentation.measure_async(
+                                query, lambda: self._records(tx.run(query, params))))
+                    except StopIteration as stop:
+                        return stop.value
+
+    async def _query(self, query: str, params: dict) -> list[list]:
+        async with self._driver.session(database=self._database) as session:
+            return await instrumentation.measure_async(
+                query, lambda: self._records(session.run(query, params), as_lists=True))
+
+    @staticmethod
+    async def _records(run: Awaitable[neo4j.AsyncResult], as_lists: bool = False) -> list:
+        result = await run
+        return [list(record) if as_lists else record async for record in result]
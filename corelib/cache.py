@@ -0,0 +1,97 @@
+"""
+Module Name: cache
+
+Description:
+An in-memory copy of the exported PlatDB graph, refreshed from graph deltas, see Neo4jConnection.
+
+License:
+SPDX-License-Identifier: Apache-2.0
+"""
+import datetime
+import threading
+import time
+
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from corelib.platdb import GraphDelta, Neo4jConnection
+
+
+class GraphCache:
+    """The exported graph of a Neo4jConnection, kept in memory and refreshed from deltas.
+
+    The graph is loaded on first use.  It is refreshed, with get_graph_delta() rather than re-exported, when a
+    write is made through corelib or when it is older than `ttl` seconds, which bounds how stale it can get
+    from writes made by other processes.  A graph with more than `max_items` vertices and edges isn't kept,
+    every read then goes to the database."""
+
+    def __init__(self, connection: "Neo4jConnection", ttl: float, max_items: Optional[int] = None):
+        self._connection = connection
+        self.ttl = ttl
+        self.max_items = max_items
+
+        self._lock = threading.Lock()
+        self._vertices: Optional[dict] = None
+        self._edges: dict[int, dict] = {}
+        self._edges_by_vertex: dict[str, set[int]] = {}
+        self._next_edge = 0
+        self._watermark: Optional[datetime.datetime] = None
+        self._refreshed_at = 0.0
+        self._stale = False
+
+    def get(self) -> tuple[dict, list]:
+        """The graph as get_full_graph_as_json() returns it.  The vertex and edge dicts are shared with the
+           cache and must not be modified."""
+        with self._lock:
+            if self._vertices is not None and (self._stale or time.monotonic() - self._refreshed_at >= self.ttl):
+                self._stale = False
+                self._apply(self._connection.get_graph_delta(self._watermark))
+
+            if self._vertices is None:
+                self._stale = False
+                delta = self._connection.get_graph_delta(None)
+                self._load(delta)
+                if self._vertices is None:  # too large to keep
+                    return delta.vertices, delta.edges
+
+            return dict(self._vertices), list(self._edges.values())
+
+    def invalidate(self, *_):
+        """Refresh the graph on the next read, a WriteListener"""
+        self._stale = True
+
+    def clear(self):
+        with self._lock:
+            self._vertices = None
+            self._edges, self._edges_by_vertex = {}, {}
+
+    def _load(self, delta: "GraphDelta"):
+        self._vertices = {}
+        self._edges, self._edges_by_vertex = {}, {}
+        self._apply(delta)
+
+    def _apply(self, delta: "GraphDelta"):
+        self._refreshed_at = time.monotonic()
+        self._watermark = delta.watermark
+
+        # A delta has every edge of the vertices it reports, replacing the cached edges of those vertices, so a
+        # vertex reported again by the next delta, see WATERMARK_LAG, is replaced rather than duplicated
+        for element_id in list(delta.vertices) + delta.deleted:
+            for key in list(self._edges_by_vertex.get(element_id, ())):
+                edge = self._edges.pop(key)
+                for endpoint in (edge['start_node'], edge['end_node']):
+                    self._edges_by_vertex[endpoint].discard(key)
+        for element_id in delta.deleted:
+            self._edges_by_vertex.pop(element_id, None)
+            self._vertices.pop(element_id, None)
+
+        self._vertices.update(delta.vertices)
+        for edge in delta.edges:
+            key, self._next_edge = self._next_edge, self._next_edge + 1
+            self._edges[key] = edge
+            self._edges_by_vertex.setdefault(edge['start_node'], set()).add(key)
+            self._edges_by_vertex.setdefault(edge['end_node'], set()).add(key)
+
+        if self.max_items is not None and len(self._vertices) + len(self._edges) > self.max_items:
+            self._vertices = None
+            self._edges, self._edges_by_vertex = {}, {}
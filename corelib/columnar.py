@@ -0,0 +1,270 @@
+"""
+Module Name: columnar
+
+Description:
+A compact, column oriented form of the exported PlatDB graph: integer indexed vertex tables with a column per
+property, and compressed sparse row (CSR) adjacency arrays per relationship type.
+
+License:
+SPDX-License-Identifier: Apache-2.0
+"""
+import sys
+
+from array import array
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from neomodel.util import OUTGOING
+
+from corelib.platdb import GRAPH_EDGE, GRAPH_VERTEX, Neo4jConnection, PlatDBSerializer
+
+
+def _index_typecode(count: int) -> str:
+    """The smallest array typecode that holds indexes up to `count`"""
+    return 'i' if count < 2 ** 31 else 'q'
+
+
+class CSR(NamedTuple):
+    """The edges of one relationship type: the edges leaving vertex `i` go to `targets[offsets[i]:offsets[i + 1]]`,
+       with `properties` holding the properties of each edge in the same order, or None when no edge has any"""
+    offsets: array
+    targets: array
+    properties: Optional[list[Optional[dict]]]
+
+    def neighbours(self, index: int) -> array:
+        return self.targets[self.offsets[index]:self.offsets[index + 1]]
+
+    def edge_range(self, index: int) -> range:
+        return range(self.offsets[index], self.offsets[index + 1])
+
+    def transpose(self) -> "CSR":
+        """The same edges, indexed by their target"""
+        count = len(self.offsets) - 1
+        sources = array(self.targets.typecode, bytes(self.targets.itemsize * len(self.targets)))
+        for index in range(count):
+            for position in self.edge_range(index):
+                sources[position] = index
+
+        return _build_csr(count, sources, self.targets, self.properties, by_target=True)
+
+
+class LabelTable(NamedTuple):
+    """The vertices of one label: `rows[i]` is the vertex index of row `i`, and `columns[name][i]` its value of the
+       property `name`"""
+    label: str
+    rows: array
+    columns: dict[str, list]
+
+
+def _build_csr(count: int, sources: array, targets: array, properties: Optional[list],
+               by_target: bool = False) -> CSR:
+    """A CSR of the edges `sources[i] -> targets[i]`, indexed by source, or by target when `by_target`"""
+    keys, values = (targets, sources) if by_target else (sources, targets)
+    typecode = _index_typecode(len(keys))
+
+    offsets = array(typecode, bytes(array(typecode).itemsize * (count + 1)))
+    for key in keys:
+        offsets[key + 1] += 1
+    for index in range(count):
+        offsets[index + 1] += offsets[index]
+
+    positions = array(typecode, offsets[:count])
+    ordered = array(values.typecode, bytes(values.itemsize * len(values)))
+    ordered_properties = None if properties is None else [None] * len(values)
+    for edge, key in enumerate(keys):
+        position = positions[key]
+        positions[key] += 1
+        ordered[position] = values[edge]
+        if properties is not None:
+            ordered_properties[position] = properties[edge]
+
+    return CSR(offsets, ordered, ordered_properties)
+
+
+class ColumnarGraph:
+    """The exported PlatDB graph in columns, see ColumnarGraph.from_records().
+
+    Vertices are numbered in the order they were exported.  `element_ids[i]` is the element id of vertex `i`,
+    and `labels[label_codes[i]]` its label.  Edge endpoints that aren't exported vertices get an index too,
+    with the label code -1.  `tables` holds a LabelTable per label and `adjacency` a CSR per relationship type.
+
+    Repeated property values, like platforms and providers, are interned so each is stored once.  The
+    relationship attributes of the vertices aren't stored, to_json() and vertex() rebuild them from the
+    adjacency arrays."""
+
+    def __init__(self, element_ids: list[str], labels: list[str], label_codes: array,
+                 tables: dict[str, LabelTable], adjacency: dict[str, CSR]):
+        self.element_ids = element_ids
+        self.labels = labels
+        self.label_codes = label_codes
+        self.tables = tables
+        self.adjacency = adjacency
+
+        self._index: Optional[dict[str, int]] = None
+        self._row_of: Optional[array] = None
+        self._reverse: dict[str, CSR] = {}
+
+    @classmethod
+    def from_connection(cls, connection: Neo4jConnection, fetch_size: Optional[int] = None) -> "ColumnarGraph":
+        """Export the graph straight into columns, without holding the whole JSON export in memory"""
+        return cls.from_records(connection.iter_full_graph(fetch_size=fetch_size))
+
+    @classmethod
+    def from_json(cls, vertices: dict, edges: list) -> "ColumnarGraph":
+        """The graph get_full_graph_as_json() returned"""
+        return cls.from_records(_json_records(vertices, edges))
+
+    @classmethod
+    def from_records(cls, records: Iterable[tuple[str, str, dict]]) -> "ColumnarGraph":
+        """The graph from `(kind, element_id, data)` records, as Neo4jConnection.iter_full_graph() yields them"""
+        element_ids = []
+        index = {}
+        labels = []
+        label_index = {}
+        label_codes = []
+        rows = {}
+        columns = {}
+        edges = {}
+
+        def vertex_index(element_id: str, label_code: int) -> int:
+            if element_id not in index:
+                index[element_id] = len(element_ids)
+                element_ids.append(element_id)
+                label_codes.append(label_code)
+            elif label_code >= 0:
+                label_codes[index[element_id]] = label_code
+            return index[element_id]
+
+        for kind, element_id, data in records:
+            if kind == GRAPH_VERTEX:
+                label = data['type']
+                if label not in label_index:
+                    label_index[label] = len(labels)
+                    labels.append(label)
+                    rows[label] = []
+                    columns[label] = {name: [] for name, _, _ in PlatDBSerializer.for_label(label).properties}
+
+                rows[label].append(vertex_index(element_id, label_index[label]))
+                for name, values in columns[label].items():
+                    value = data.get(name)
+                    values.append(sys.intern(value) if isinstance(value, str) else value)
+            elif kind == GRAPH_EDGE:
+                sources, targets, properties = edges.setdefault(data['type'], ([], [], []))
+                sources.append(vertex_index(data['start_node'], -1))
+                targets.append(vertex_index(data['end_node'], -1))
+                properties.append(data['properties'] or None)
+
+        count = len(element_ids)
+        typecode = _index_typecode(count)
+        adjacency = {}
+        for relation_type, (sources, targets, properties) in edges.items():
+            adjacency[relation_type] = _build_csr(
+                count, array(typecode, sources), array(typecode, targets),
+                properties if any(properties) else None)
+
+        tables = {label: LabelTable(label, array(typecode, rows[label]), columns[label]) for label in labels}
+        return cls(element_ids, labels, array('i', label_codes), tables, adjacency)
+
+    def __len__(self) -> int:
+        return len(self.element_ids)
+
+    @property
+    def index(self) -> dict[str, int]:
+        """The vertex index of each element id, built on first use"""
+        if self._index is None:
+            self._index = {element_id: index for index, element_id in enumerate(self.element_ids)}
+
+        return self._index
+
+    @property
+    def edge_count(self) -> int:
+        return sum(len(csr.targets) for csr in self.adjacency.values())
+
+    def label_of(self, index: int) -> Optional[str]:
+        code = self.label_codes[index]
+        return None if code < 0 else self.labels[code]
+
+    def out_neighbours(self, relation_type: str, index: int) -> array:
+        """The indexes of the vertices `index` has a `relation_type` relationship to"""
+        csr = self.adjacency.get(relation_type)
+        return array(_index_typecode(len(self))) if csr is None else csr.neighbours(index)
+
+    def in_neighbours(self, relation_type: str, index: int) -> array:
+        """The indexes of the vertices with a `relation_type` relationship to `index`"""
+        csr = self.reverse_adjacency(relation_type)
+        return array(_index_typecode(len(self))) if csr is None else csr.neighbours(index)
+
+    def reverse_adjacency(self, relation_type: str) -> Optional[CSR]:
+        """The CSR of `relation_type` indexed by target, built on first use"""
+        if relation_type not in self._reverse and relation_type in self.adjacency:
+            self._reverse[relation_type] = self.adjacency[relation_type].transpose()
+
+        return self._reverse.get(relation_type)
+
+    def vertex(self, index: int) -> dict:
+        """Vertex `index` shaped like get_full_graph_as_json()'s vertices.  Relationship attributes list the
+           same element ids, not necessarily in the same order."""
+        label = self.label_of(index)
+        if label is None:
+            raise KeyError(f'{self.element_ids[index]} is not an exported vertex')
+
+        return self._vertex_ht(index, label, self._properties(index, label))
+
+    def to_json(self) -> tuple[dict, list]:
+        """The graph shaped like get_full_graph_as_json() returns it, the relationship attributes and edges
+           not necessarily in the same order"""
+        vertices = {self.element_ids[index]: self._vertex_ht(index, label, properties)
+                    for index, label, properties in self.iter_vertices()}
+
+        return vertices, list(self._iter_edges())
+
+    def _properties(self, index: int, label: str) -> dict:
+        if self._row_of is None:
+            self._row_of = array('q', [-1]) * len(self)
+            for table in self.tables.values():
+                for row, vertex_index in enumerate(table.rows):
+                    self._row_of[vertex_index] = row
+
+        row = self._row_of[index]
+        return {name: values[row] for name, values in self.tables[label].columns.items()}
+
+    def iter_vertices(self) -> Iterator[tuple[int, str, dict]]:
+        """(index, label, properties) of each exported vertex"""
+        for label, table in self.tables.items():
+            for row, index in enumerate(table.rows):
+                yield index, label, {name: values[row] for name, values in table.columns.items()}
+
+    def _vertex_ht(self, index: int, label: str, data: dict) -> dict:
+        """Vertex `index` as exported, from its `data` properties and the adjacency arrays"""
+        serializer = PlatDBSerializer.for_label(label)
+        data.update({attr: [] for attr in serializer.relationship_attrs})
+        for (direction, relation_type, other_label), attrs in serializer.relationships.items():
+            if direction == OUTGOING:
+                neighbours = self.out_neighbours(relation_type, index)
+            else:
+                neighbours = self.in_neighbours(relation_type, index)
+
+            ids = [self.element_ids[other] for other in neighbours if self.label_of(other) == other_label]
+            for attr in attrs:
+                data[attr].extend(ids)
+
+        platdb_ht = {key: data[key] for key in sorted(data)}
+        platdb_ht['type'] = label
+        return platdb_ht
+
+    def _iter_edges(self) -> Iterator[dict]:
+        for relation_type, csr in self.adjacency.items():
+            for index in range(len(self)):
+                for position in csr.edge_range(index):
+                    yield {
+                        "start_node": self.element_ids[index],
+                        "end_node": self.element_ids[csr.targets[position]],
+                        "type": relation_type,
+                        "properties": dict(csr.properties[position] or {}) if csr.properties else {}
+                    }
+
+
+def _json_records(vertices: dict, edges: list) -> Iterator[tuple[str, str, dict]]:
+    for element_id, data in vertices.items():
+        yield GRAPH_VERTEX, element_id, data
+    for data in edges:
+        yield GRAPH_EDGE, None, data
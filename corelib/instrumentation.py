@@ -0,0 +1,243 @@
+"""
+Module Name: instrumentation
+
+Description:
+Reports each query corelib sends to Neo4j, with the PlatDB operation that sent it, its latency and the number of
+rows it returned, to the registered query listeners.
+
+License:
+SPDX-License-Identifier: Apache-2.0
+"""
+import contextlib
+import contextvars
+import functools
+import hashlib
+import threading
+import time
+
+from typing import Any, AsyncIterator, Awaitable, Callable, Iterable, Iterator, NamedTuple, Optional
+
+
+class QueryEvent(NamedTuple):
+    """One query: `operation` is the PlatDB operation that sent it, ie. 'Compute.bulk_upsert', or None for
+       queries neomodel sends outside of one (NodeSet lookups, relationship managers).  `fingerprint` identifies
+       the query text whatever its whitespace.  `seconds` runs from sending the query to reading its last row, for
+       streamed exports the time the caller spends between rows included.  `rows` is None when the query failed
+       with `error`."""
+    operation: Optional[str]
+    fingerprint: str
+    query: str
+    seconds: float
+    rows: Optional[int]
+    error: Optional[BaseException] = None
+
+
+# Called with each QueryEvent, from the thread that ran the query, see add_query_listener()
+QueryListener = Callable[[QueryEvent], None]
+
+_query_listeners: list[QueryListener] = []
+
+_operation: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar('platdb_operation', default=None)
+
+
+def add_query_listener(listener: QueryListener):
+    """Call `listener(event)` after each query corelib or neomodel sends.  Listeners run on the thread of the
+       query, so they should be quick and thread safe.  Nothing is measured while there are no listeners."""
+    _query_listeners.append(listener)
+
+
+def remove_query_listener(listener: QueryListener):
+    _query_listeners.remove(listener)
+
+
+@contextlib.contextmanager
+def operation(name: str) -> Iterator[None]:
+    """Report the queries of the block as sent by the operation `name`, unless an operation within names them"""
+    token = _operation.set(name)
+    try:
+        yield
+    finally:
+        _operation.reset(token)
+
+
+@functools.lru_cache(maxsize=1024)
+def fingerprint(query: str) -> str:
+    """A short hash of `query`, the same for queries differing only in whitespace"""
+    return hashlib.blake2b(' '.join(query.split()).encode(), digest_size=8).hexdigest()
+
+
+def _emit(query: str, operation_name: Optional[str], start: float, rows: Optional[int],
+          error: Optional[BaseException]):
+    event = QueryEvent(operation_name or _operation.get(), fingerprint(query), query,
+                       time.perf_counter() - start, rows, error)
+    for listener in list(_query_listeners):
+        listener(event)
+
+
+def measure(query: str, run: Callable[[], Any], operation_name: Optional[str] = None,
+            count: Callable[[Any], int] = len) -> Any:
+    """`run()`, which sends `query` and returns its rows, reported to the query listeners"""
+    if not _query_listeners:
+        return run()
+
+    start = time.perf_counter()
+    try:
+        result = run()
+    except BaseException as error:
+        _emit(query, operation_name, start, None, error)
+        raise
+
+    _emit(query, operation_name, start, count(result), None)
+    return result
+
+
+async def measure_async(query: str, run: Callable[[], Awaitable[Any]], operation_name: Optional[str] = None,
+                        count: Callable[[Any], int] = len) -> Any:
+    """measure() for a coroutine"""
+    if not _query_listeners:
+        return await run()
+
+    start = time.perf_counter()
+    try:
+        result = await run()
+    except BaseException as error:
+        _emit(query, operation_name, start, None, error)
+        raise
+
+    _emit(query, operation_name, start, count(result), None)
+    return result
+
+
+def stream(query: str, run: Callable[[], Iterable], operation_name: Optional[str] = None) -> Iterable:
+    """The rows of `run()`, which sends `query`, reported to the query listeners once they have all been read
+       or the caller stopped reading"""
+    if not _query_listeners:
+        return run()
+
+    return _counted(query, run, operation_name)
+
+
+def _counted(query: str, run: Callable[[], Iterable], operation_name: Optional[str]) -> Iterator:
+    start = time.perf_counter()
+    rows = 0
+    error = None
+    try:
+        for row in run():
+            rows += 1
+            yield row
+    except GeneratorExit:
+        raise
+    except BaseException as exc:
+        error = exc
+        raise
+    finally:
+        _emit(query, operation_name, start, None if error else rows, error)
+
+
+def stream_async(query: str, run: Callable[[], Awaitable[Any]], operation_name: Optional[str] = None
+                 ) -> AsyncIterator:
+    """stream() for a coroutine returning an async result"""
+    if not _query_listeners:
+        return _unmeasured_async(run)
+
+    return _counted_async(query, run, operation_name)
+
+
+async def _unmeasured_async(run: Callable[[], Awaitable[Any]]) -> AsyncIterator:
+    async for row in await run():
+        yield row
+
+
+async def _counted_async(query: str, run: Callable[[], Awaitable[Any]], operation_name: Optional[str]
+                         ) -> AsyncIterator:
+    start = time.perf_counter()
+    rows = 0
+    error = None
+    try:
+        async for row in await run():
+            rows += 1
+            yield row
+    except GeneratorExit:
+        raise
+    except BaseException as exc:
+        error = exc
+        raise
+    finally:
+        _emit(query, operation_name, start, None if error else rows, error)
+
+
+def instrument_database(database):
+    """Report the queries of the neomodel Database `database`, which covers neomodel's own queries: save(),
+       NodeSet lookups, cypher()..."""
+    if 'cypher_query' in vars(database):
+        return
+
+    def cypher_query(query, *args, **kwargs):
+        return measure(query, lambda: type(database).cypher_query(database, query, *args, **kwargs),
+                       count=lambda result: len(result[0]))
+
+    database.cypher_query = cypher_query
+
+
+class RoundTrips:
+    """The queries sent while a count_round_trips() block runs"""
+
+    def __init__(self):
+        self.events: list[QueryEvent] = []
+
+    def __call__(self, event: QueryEvent):
+        self.events.append(event)
+
+    @property
+    def count(self) -> int:
+        return len(self.events)
+
+
+@contextlib.contextmanager
+def count_round_trips() -> Iterator[RoundTrips]:
+    """Count the queries sent by any thread while the block runs, ie.
+
+        with count_round_trips() as round_trips:
+            Compute.bulk_upsert(records)
+        assert round_trips.count == 1"""
+    round_trips = RoundTrips()
+    add_query_listener(round_trips)
+    try:
+        yield round_trips
+    finally:
+        remove_query_listener(round_trips)
+
+
+class QueryStats:
+    """A query listener totalling the queries per (operation, fingerprint), to find the hot spots of a
+       running process:
+
+        stats = QueryStats()
+        add_query_listener(stats)
+        ...
+        for (operation, fingerprint), (count, seconds, rows) in stats.top(10): ..."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: dict[tuple[Optional[str], str], list] = {}
+        self.queries: dict[str, str] = {}
+
+    def __call__(self, event: QueryEvent):
+        with self._lock:
+            totals = self._totals.setdefault((event.operation, event.fingerprint), [0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += event.seconds
+            totals[2] += event.rows or 0
+            self.queries.setdefault(event.fingerprint, event.query)
+
+    def top(self, limit: Optional[int] = None) -> list[tuple[tuple[Optional[str], str], tuple[int, float, int]]]:
+        """`((operation, fingerprint), (queries, seconds, rows))`, the most time consuming first"""
+        with self._lock:
+            totals = sorted(((key, tuple(values)) for key, values in self._totals.items()),
+                            key=lambda item: item[1][1], reverse=True)
+        return totals[:limit]
+
+    def clear(self):
+        with self._lock:
+            self._totals.clear()
+            self.queries.clear()
@@ -0,0 +1,482 @@
+"""
+Module Name: memory
+
+Description:
+An in-memory PlatDB backend, for tests, benchmarks and offline use without a Neo4j server.
+
+License:
+SPDX-License-Identifier: Apache-2.0
+"""
+import itertools
+import time
+import uuid
+
+from typing import Any, Iterable, Iterator, Optional
+
+from neo4j.graph import Graph, Node
+from neomodel.util import EITHER, INCOMING, OUTGOING
+
+from corelib.platdb import (DEFAULT_BATCH_SIZE,
+                            GRAPH_EDGE,
+                            GRAPH_VERTEX,
+                            PlatDBDNSNode,
+                            PlatDBNode,
+                            PlatDBSerializer,
+                            chunks,
+                            subgraph_types)
+
+
+class _Vertex:
+    __slots__ = ('element_id', 'label', 'properties', 'outgoing', 'incoming')
+
+    def __init__(self, element_id: str, label: str, properties: dict):
+        self.element_id = element_id
+        self.label = label
+        self.properties = properties
+        self.outgoing: dict[str, None] = {}  # edge ids, as an ordered set
+        self.incoming: dict[str, None] = {}
+
+
+class _Edge:
+    __slots__ = ('element_id', 'start', 'end', 'type', 'properties')
+
+    def __init__(self, element_id: str, start: str, end: str, relation_type: str, properties: dict):
+        self.element_id = element_id
+        self.start = start
+        self.end = end
+        self.type = relation_type
+        self.properties = properties
+
+
+class InMemoryPlatDB:
+    """The PlatDB operations on a graph held in memory.
+
+    The operations have the same names and arguments as AsyncNeo4jConnection's, without the await, and the
+    same semantics as the PlatDBNode classmethods: merges on the required and unique properties, the
+    address / dns_names matching of PlatDBDNSNode, None removing a property, modified_timestamp stamping,
+    MultipleNodesReturned for the filters matching several nodes...  Filters and keys are validated by the same
+    PlatDBNode helpers, so invalid arguments raise the same errors.  tests/platdb_contract.py runs the same tests
+    against both backends.
+
+    The merge keys and the unique properties of each label are kept in hash indexes, a dns_name indexing
+    each of the nodes' dns_names, so lookups by them don't scan the label.  Lookups by other properties do.
+    Exports return what Neo4jConnection would for the same graph, vertices and edges in insertion order."""
+
+    def __init__(self):
+        self._vertices: dict[str, _Vertex] = {}
+        self._edges: dict[str, _Edge] = {}
+        self._by_label: dict[str, dict[str, None]] = {}
+        self._merge_index: dict[str, dict[tuple, str]] = {}
+        self._property_index: dict[tuple[str, str], dict[Any, dict[str, None]]] = {}
+        self._schemas: dict[str, tuple[tuple[str, ...], frozenset[str]]] = {}
+        self._ids = itertools.count()
+        self._graph = Graph()
+
+    def __len__(self) -> int:
+        return len(self._vertices)
+
+    # Writes
+
+    def create_or_update(self, platdb_cls: type[PlatDBNode], *props: dict) -> list[PlatDBNode]:
+        if issubclass(platdb_cls, PlatDBDNSNode):
+            [data] = props
+            platdb_cls.check_natural_key(data)
+            element_ids = self._dns_upsert(platdb_cls, [data])
+        else:
+            element_ids = [self._merge(platdb_cls, platdb_cls.merge_params(prop)) for prop in props]
+
+        return [self._inflate(platdb_cls, self._vertices[element_id]) for element_id in element_ids]
+
+    def bulk_upsert(self, platdb_cls: type[PlatDBNode], records: Iterable[dict],
+                    batch_size: int = DEFAULT_BATCH_SIZE) -> list[str]:
+        element_ids = []
+        for batch in chunks(records, batch_size):
+            if issubclass(platdb_cls, PlatDBDNSNode):
+                groups, group_of_record = platdb_cls.combine_batch(batch)
+                group_ids = self._dns_upsert(platdb_cls, groups)
+                element_ids.extend(group_ids[group] for group in group_of_record)
+            else:
+                element_ids.extend(self._merge(platdb_cls, platdb_cls.merge_params(record)) for record in batch)
+
+        return element_ids
+
+    def bulk_connect(self, platdb_cls: type[PlatDBNode], edges: Iterable[tuple],
+                     batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        relationships = dict(platdb_cls.__all_relationships__)
+        resolved = []
+        for source, target, name, properties in edges:
+            if name not in relationships:
+                raise ValueError(f'{platdb_cls.__name__} has no relationship {name}!')
+
+            relationship = relationships[name]
+            relationship.lookup_node_class()
+            definition = relationship.definition
+            model = definition['model']
+            if model and properties:
+                properties = model.deflate(properties)
+            resolved.append((
+                self._find_key(platdb_cls, platdb_cls.node_key(source)),
+                self._find_key(definition['node_class'], definition['node_class'].node_key(target)),
+                definition, properties or {}))
+
+        count = 0
+        for batch in chunks(resolved, batch_size):
+            now = time.time()
+            for source, target, definition, properties in batch:
+                if source is None or target is None:
+                    continue
+
+                start, end = (source, target) if definition['direction'] == OUTGOING else (target, source)
+                edge = self._find_edge(start, end, definition['relation_type'])
+                if edge is None:
+                    edge = self._create_edge(start, end, definition['relation_type'])
+                edge.properties.update(properties)
+                for vertex in (source, target):
+                    self._set(vertex, {'modified_timestamp': now})
+                count += 1
+
+        return count
+
+    def delete_by_attributes(self, platdb_cls: type[PlatDBNode], attributes: dict) -> bool:
+        return self.delete_many_by_attributes(platdb_cls, [attributes]) > 0
+
+    def delete_many_by_attributes(self, platdb_cls: type[PlatDBNode], attributes_list: Iterable[dict],
+                                  batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        filters = [platdb_cls.deflate_filter(attributes) for attributes in attributes_list]
+        count = 0
+        ambiguous = []
+        for batch in chunks(filters, batch_size):
+            for params, shape in batch:
+                vertex = self._single(platdb_cls, params, shape, ambiguous)
+                if vertex is not None:
+                    self._delete(vertex)
+                    count += 1
+
+        platdb_cls.check_single_matches(ambiguous)
+        return count
+
+    def update(self, platdb_cls: type[PlatDBNode], attributes: dict, new_attributes: dict
+               ) -> Optional[PlatDBNode]:
+        params, shape = platdb_cls.deflate_filter(attributes)
+        ambiguous = []
+        vertex = self._single(platdb_cls, params, shape, ambiguous)
+        platdb_cls.check_single_matches(ambiguous)
+        if vertex is None:
+            return None
+
+        self._set(vertex, dict(platdb_cls.deflate_update(new_attributes),
+                               modified_timestamp=time.time()))
+        return self._inflate(platdb_cls, vertex)
+
+    def update_many(self, platdb_cls: type[PlatDBNode], updates: Iterable[tuple[dict, dict]],
+                    batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        rows = [(platdb_cls.deflate_filter(attributes), platdb_cls.deflate_update(new_attributes))
+                for attributes, new_attributes in updates]
+        count = 0
+        ambiguous = []
+        for batch in chunks(rows, batch_size):
+            for (params, shape), update in batch:
+                vertex = self._single(platdb_cls, params, shape, ambiguous)
+                if vertex is not None:
+                    self._set(vertex, dict(update, modified_timestamp=time.time()))
+                    count += 1
+
+        platdb_cls.check_single_matches(ambiguous)
+        return count
+
+    # Reads
+
+    def find_by_dns_names(self, platdb_cls: type[PlatDBDNSNode], dns_names: list[str]
+                          ) -> Optional[PlatDBDNSNode]:
+        vertex = self._find_by_dns_names(platdb_cls, dns_names)
+        return None if vertex is None else self._inflate(platdb_cls, vertex)
+
+    def get_full_graph_as_json(self) -> tuple[dict, list]:
+        vertices = {}
+        edges = []
+        for kind, key, data in self.iter_full_graph():
+            if kind == GRAPH_VERTEX:
+                vertices[key] = data
+            else:
+                edges.append(data)
+
+        return vertices, edges
+
+    def iter_full_graph(self) -> Iterator[tuple[str, str, dict]]:
+        """See Neo4jConnection.iter_full_graph()"""
+        for label in PlatDBSerializer.labels():
+            for element_id in self._by_label.get(label, ()):
+                yield GRAPH_VERTEX, element_id, self._vertex_ht(self._vertices[element_id])
+
+        for edge in self._edges.values():
+            yield GRAPH_EDGE, edge.element_id, self._edge_ht(edge)
+
+    def get_subgraph_as_json(self, platdb_cls: type[PlatDBNode], key: Any, max_depth: int = 1,
+                             relationship_types: Optional[Iterable[str]] = None, direction: int = EITHER
+                             ) -> tuple[dict, list]:
+        """See Neo4jConnection.get_subgraph_as_json(), a breadth first walk from the seed"""
+        relationship_types = subgraph_types(max_depth, relationship_types, direction)
+        seed = self._find_key(platdb_cls, platdb_cls.node_key(key))
+        if seed is None:
+            return {}, []
+
+        depths = {seed.element_id: 0}
+        walked: dict[str, None] = {}
+        frontier = [seed]
+        for depth in range(max_depth):
+            reached = []
+            for vertex in frontier:
+                for edge, other in self._walk(vertex, relationship_types, direction):
+                    walked[edge.element_id] = None
+                    if other not in depths:
+                        depths[other] = depth + 1
+                        reached.append(self._vertices[other])
+            frontier = reached
+
+        return ({element_id: self._vertex_ht(self._vertices[element_id]) for element_id in depths},
+                [self._edge_ht(self._edges[edge_id]) for edge_id in walked])
+
+    # Internals
+
+    def _schema(self, platdb_cls: type[PlatDBNode]) -> tuple[tuple[str, ...], frozenset[str]]:
+        """The db names of the merge keys of the class, and of the properties kept in a hash index"""
+        if platdb_cls.__label__ not in self._schemas:
+            merge_keys = tuple(getattr(platdb_cls, name).get_db_property_name(name)
+                               for name in platdb_cls.__required_properties__)
+            indexed = frozenset(prop.get_db_property_name(name) for name, prop in platdb_cls.__all_properties__
+                                if prop.unique_index or name in platdb_cls.__required_properties__)
+            self._schemas[platdb_cls.__label__] = merge_keys, indexed
+
+        return self._schemas[platdb_cls.__label__]
+
+    def _merge(self, platdb_cls: type[PlatDBNode], params: dict) -> str:
+        """PlatDBNode._merge_query() for one `{'create': ..., 'update': ...}` row, returns the element id"""
+        keys, _ = self._schema(platdb_cls)
+        values = tuple(params['create'].get(key) for key in keys)
+        if any(value is None for value in values):
+            raise ValueError(f'{platdb_cls.__name__} can not be merged on a null {keys}')
+
+        now = time.time()
+        element_id = self._merge_index.get(platdb_cls.__label__, {}).get(_hashable(values))
+        if element_id is None:
+            vertex = self._create(platdb_cls, dict(params['create'], modified_timestamp=now))
+        else:
+            vertex = self._vertices[element_id]
+            self._set(vertex, dict(params['update'], modified_timestamp=now))
+
+        return vertex.element_id
+
+    def _dns_upsert(self, platdb_cls: type[PlatDBDNSNode], records: list[dict]) -> list[str]:
+        """PlatDBDNSNode._upsert_query() for records that don't match each other, returns their element ids"""
+        element_ids = []
+        now = time.time()
+        for row in platdb_cls.upsert_params(records)['batch']:
+            existing = None
+            if row['address'] is not None:
+                existing = self._lookup(platdb_cls, 'address', row['address'])
+            if existing is None:
+                existing = self._find_by_dns_names(platdb_cls, row['dns_names'])
+
+            if existing is None:
+                existing = self._create(platdb_cls, dict(row['create'], modified_timestamp=now))
+            else:
+                self._set(existing, dict(row['update'], modified_timestamp=now))
+            element_ids.append(existing.element_id)
+
+        return element_ids
+
+    def _find_by_dns_names(self, platdb_cls: type[PlatDBDNSNode], dns_names: list[str]) -> Optional[_Vertex]:
+        for dns_name in dns_names:
+            vertex = self._lookup(platdb_cls, 'dns_names', dns_name)
+            if vertex is not None:
+                return vertex
+
+        return None
+
+    def _lookup(self, platdb_cls: type[PlatDBNode], db_name: str, value: Any) -> Optional[_Vertex]:
+        """The first node of the class with `value` for `db_name`, or with `value` in it for an array property"""
+        index = self._property_index.get((platdb_cls.__label__, db_name))
+        if index is not None:
+            for element_id in index.get(_hashable(value), ()):
+                return self._vertices[element_id]
+            return None
+
+        for element_id in self._by_label.get(platdb_cls.__label__, ()):
+            stored = self._vertices[element_id].properties.get(db_name)
+            if stored == value or (isinstance(stored, list) and value in stored):
+                return self._vertices[element_id]
+
+        return None
+
+    def _find(self, platdb_cls: type[PlatDBNode], params: dict, shape: tuple[tuple[str, bool], ...], limit: int = 1
+              ) -> list[_Vertex]:
+        """The first `limit` nodes of the class matching a PlatDBNode.deflate_filter() filter"""
+        candidates = self._by_label.get(platdb_cls.__label__, {})
+        _, indexed = self._schema(platdb_cls)
+        for db_name, is_null in shape:
+            if not is_null and db_name in indexed and params[db_name] != []:
+                # array properties are indexed per item, a node equal to the list holds its first item
+                value = params[db_name][0] if isinstance(params[db_name], list) else params[db_name]
+                candidates = self._property_index.get((platdb_cls.__label__, db_name), {}).get(
+                    _hashable(value), {})
+                break
+
+        matches = []
+        for element_id in candidates:
+            properties = self._vertices[element_id].properties
+            if all(properties.get(db_name) is None if is_null else properties.get(db_name) == params[db_name]
+                   for db_name, is_null in shape):
+                matches.append(self._vertices[element_id])
+                if len(matches) == limit:
+                    break
+
+        return matches
+
+    def _single(self, platdb_cls: type[PlatDBNode], params: dict, shape: tuple[tuple[str, bool], ...],
+                ambiguous: list[dict]) -> Optional[_Vertex]:
+        """The node matching a filter when it is the only one, like PlatDBNode._single_match_clauses(), the
+           filter added to `ambiguous` when it matches several"""
+        matches = self._find(platdb_cls, params, shape, limit=2)
+        if len(matches) > 1:
+            ambiguous.append(params)
+            return None
+
+        return matches[0] if matches else None
+
+    def _find_key(self, platdb_cls: type[PlatDBNode], key: tuple[Any, Optional[tuple[str, ...]]]
+                  ) -> Optional[_Vertex]:
+        """The node for a PlatDBNode.node_key() key"""
+        value, shape = key
+        if shape is None:
+            vertex = self._vertices.get(value)
+            return vertex if vertex is not None and vertex.label == platdb_cls.__label__ else None
+
+        matches = self._find(platdb_cls, value, tuple((db_name, False) for db_name in shape))
+        return matches[0] if matches else None
+
+    def _find_edge(self, start: _Vertex, end: _Vertex, relation_type: str) -> Optional[_Edge]:
+        for edge_id in start.outgoing:
+            edge = self._edges[edge_id]
+            if edge.end == end.element_id and edge.type == relation_type:
+                return edge
+
+        return None
+
+    def _walk(self, vertex: _Vertex, relationship_types: Optional[list[str]], direction: int
+              ) -> Iterator[tuple[_Edge, str]]:
+        """The relationships of `vertex` in `direction`, and the element id of the node at their other end"""
+        for edge_direction, edge_ids, end in ((OUTGOING, vertex.outgoing, 'end'), (INCOMING, vertex.incoming, 'start')):
+            if direction in (edge_direction, EITHER):
+                for edge_id in edge_ids:
+                    edge = self._edges[edge_id]
+                    if relationship_types is None or edge.type in relationship_types:
+                        yield edge, getattr(edge, end)
+
+    def _vertex_ht(self, vertex: _Vertex) -> dict:
+        outgoing = [self._neighbour(edge_id, 'end') for edge_id in vertex.outgoing]
+        incoming = [self._neighbour(edge_id, 'start') for edge_id in vertex.incoming]
+        platdb_ht = PlatDBSerializer.for_label(vertex.label).node_to_dict(vertex.properties, outgoing, incoming)
+        platdb_ht['type'] = vertex.label
+        return platdb_ht
+
+    @staticmethod
+    def _edge_ht(edge: _Edge) -> dict:
+        return {
+            "start_node": edge.start,
+            "end_node": edge.end,
+            "type": edge.type,
+            "properties": dict(edge.properties)
+        }
+
+    def _neighbour(self, edge_id: str, end: str) -> list:
+        edge = self._edges[edge_id]
+        other = self._vertices[getattr(edge, end)]
+        return [edge.type, [other.label], other.element_id]
+
+    def _create(self, platdb_cls: type[PlatDBNode], properties: dict) -> _Vertex:
+        element_id = f'4:memory:{next(self._ids)}'
+        vertex = _Vertex(element_id, platdb_cls.__label__, {})
+        self._vertices[element_id] = vertex
+        self._by_label.setdefault(vertex.label, {})[element_id] = None
+        self._set(vertex, dict(properties, uid=str(uuid.uuid4())))
+        return vertex
+
+    def _create_edge(self, start: _Vertex, end: _Vertex, relation_type: str) -> _Edge:
+        edge = _Edge(f'5:memory:{next(self._ids)}', start.element_id, end.element_id, relation_type, {})
+        self._edges[edge.element_id] = edge
+        start.outgoing[edge.element_id] = None
+        end.incoming[edge.element_id] = None
+        return edge
+
+    def _set(self, vertex: _Vertex, properties: dict):
+        """`SET n += properties`, None removing the property, keeping the indexes up to date"""
+        platdb_cls = PlatDBSerializer.for_label(vertex.label).platdb_cls
+        self._unindex(vertex, platdb_cls)
+        for db_name, value in properties.items():
+            if value is None:
+                vertex.properties.pop(db_name, None)
+            else:
+                vertex.properties[db_name] = value
+        self._index(vertex, platdb_cls)
+
+    def _delete(self, vertex: _Vertex):
+        """DETACH DELETE, the neighbours counting as modified like PlatDBNode deletes"""
+        now = time.time()
+        for edge_id in list(vertex.outgoing) + list(vertex.incoming):
+            edge = self._edges.pop(edge_id, None)
+            if edge is None:  # a self-relationship, already removed
+                continue
+            for other_id in (edge.start, edge.end):
+                other = self._vertices[other_id]
+                other.outgoing.pop(edge_id, None)
+                other.incoming.pop(edge_id, None)
+                if other is not vertex:
+                    self._set(other, {'modified_timestamp': now})
+
+        self._unindex(vertex, PlatDBSerializer.for_label(vertex.label).platdb_cls)
+        del self._by_label[vertex.label][vertex.element_id]
+        del self._vertices[vertex.element_id]
+
+    def _merge_key(self, vertex: _Vertex, platdb_cls: type[PlatDBNode]) -> Optional[tuple]:
+        values = tuple(vertex.properties.get(key) for key in self._schema(platdb_cls)[0])
+        return None if any(value is None for value in values) else _hashable(values)
+
+    def _index_entries(self, vertex: _Vertex, platdb_cls: type[PlatDBNode]) -> Iterator[tuple[dict, Any]]:
+        """(property index, value) of each entry of `vertex` in the property indexes, an array property
+           having an entry per item"""
+        for db_name in self._schema(platdb_cls)[1]:
+            value = vertex.properties.get(db_name)
+            index = self._property_index.setdefault((vertex.label, db_name), {})
+            for item in (value if isinstance(value, list) else [value]):
+                if item is not None:
+                    yield index, _hashable(item)
+
+    def _index(self, vertex: _Vertex, platdb_cls: type[PlatDBNode]):
+        merge_key = self._merge_key(vertex, platdb_cls)
+        if merge_key is not None:
+            self._merge_index.setdefault(vertex.label, {}).setdefault(merge_key, vertex.element_id)
+        for index, value in self._index_entries(vertex, platdb_cls):
+            index.setdefault(value, {})[vertex.element_id] = None
+
+    def _unindex(self, vertex: _Vertex, platdb_cls: type[PlatDBNode]):
+        merge_key = self._merge_key(vertex, platdb_cls)
+        merge_index = self._merge_index.get(vertex.label, {})
+        if merge_key is not None and merge_index.get(merge_key) == vertex.element_id:
+            del merge_index[merge_key]
+        for index, value in self._index_entries(vertex, platdb_cls):
+            entries = index.get(value, {})
+            entries.pop(vertex.element_id, None)
+            if not entries:
+                index.pop(value, None)
+
+    def _inflate(self, platdb_cls: type[PlatDBNode], vertex: _Vertex) -> PlatDBNode:
+        number = int(vertex.element_id.rsplit(':', 1)[1])
+        return platdb_cls.inflate(Node(self._graph, vertex.element_id, number, [vertex.label], vertex.properties))
+
+
+def _hashable(value: Any) -> Any:
+    """`value` as a dict key, lists becoming tuples"""
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(item) for item in value)
+
+    return value
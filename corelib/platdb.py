@@ -7,37 +7,468 @@ Defines the PlatDB schema for a Neo4J neomodel database, as well as several acce
 License:
 SPDX-License-Identifier: Apache-2.0
 """
+import base64
+import binascii
+import concurrent.futures
+import contextlib
 import datetime
-import importlib
+import json
+import uuid
 
-from typing import Any, Optional
+from typing import TYPE_CHECKING, Any, Callable, Generator, Iterable, Iterator, NamedTuple, Optional, TextIO
 
 import neo4j
 
 from neo4j import GraphDatabase
 from neomodel import (
+    config,
     ArrayProperty,
-    DoesNotExist,
     DateTimeProperty,
     FloatProperty,
     JSONProperty,
     RelationshipFrom,
     RelationshipTo,
     StringProperty,
+    MultipleNodesReturned,
     StructuredNode,
-    db,
-    Q
+    db
 )
 
-from neomodel.properties import Property
+from neomodel.util import EITHER, INCOMING, OUTGOING
+
+from corelib import instrumentation
+from corelib.cache import GraphCache
+
+if TYPE_CHECKING:
+    from corelib.unit_of_work import UnitOfWork
+
+# neomodel's NodeMeta adds __label__, __all_properties__, __required_properties__, __all_relationships__ and the
+# nodes manager to each class it creates, so pylint can't see them on PlatDBNode and its subclasses
+# pylint: disable=no-member
+
+
+GRAPH_VERTEX = 'vertex'
+GRAPH_EDGE = 'edge'
+
+DEFAULT_BATCH_SIZE = 500
+
+# The writes a UnitOfWork holds before it flushes them
+DEFAULT_MAX_BUFFERED = 10000
+
+# Each vertex comes back once, together with the (type, neighbour labels, neighbour id) of all of its
+# relationships, so that the relationship attributes can be filled in without a query per vertex.  The vertices
+# are found by scanning each PlatDB label, see label_scan()
+FULL_GRAPH_VERTICES_QUERY = """
+    {label_scan}
+    RETURN
+        vertex, labels(vertex) AS vertex_type,
+        [(vertex)-[edge]->(other) | [type(edge), labels(other), elementId(other)]] AS outgoing,
+        [(vertex)<-[edge]-(other) | [type(edge), labels(other), elementId(other)]] AS incoming
+    """
+
+# Edges only carry the element ids of their vertices, which are sent once each by FULL_GRAPH_VERTICES_QUERY
+FULL_GRAPH_EDGES_QUERY = """
+    MATCH (parent)-[edge]->(child)
+    RETURN elementId(edge) AS edge_id, elementId(parent) AS start_node, elementId(child) AS end_node,
+           type(edge) AS edge_type, properties(edge) AS properties
+    """
+
+# The vertices of a label / the edges of a relationship type, for the exports split by label and type
+GRAPH_LABEL_VERTICES_QUERY = """
+    MATCH (vertex:`{label}`)
+    WHERE head(labels(vertex)) = $label
+    RETURN
+        vertex, labels(vertex) AS vertex_type,
+        [(vertex)-[edge]->(other) | [type(edge), labels(other), elementId(other)]] AS outgoing,
+        [(vertex)<-[edge]-(other) | [type(edge), labels(other), elementId(other)]] AS incoming
+    """
+
+GRAPH_TYPE_EDGES_QUERY = """
+    MATCH (parent)-[edge:`{relation_type}`]->(child)
+    RETURN elementId(edge) AS edge_id, elementId(parent) AS start_node, elementId(child) AS end_node,
+           type(edge) AS edge_type, properties(edge) AS properties
+    """
+
+# Every relationship type of the database, including those no PlatDBNode declares
+RELATIONSHIP_TYPES_QUERY = "CALL db.relationshipTypes() YIELD relationshipType RETURN relationshipType"
+
+# One page of the vertices of a label, ordered by the indexed PlatDBNode.uid so that an export can resume after the
+# last uid it saw with an index seek, see Neo4jConnection.get_graph_page().  Each vertex comes with the edges starting
+# at it, whatever their type.
+GRAPH_PAGE_VERTICES_QUERY = """
+    MATCH (vertex:`{label}`)
+    WHERE vertex.uid > $after AND head(labels(vertex)) = $label
+    WITH vertex
+    ORDER BY vertex.uid
+    LIMIT $limit
+    RETURN
+        vertex, labels(vertex) AS vertex_type,
+        [(vertex)-[edge]->(other) | [type(edge), labels(other), elementId(other)]] AS outgoing,
+        [(vertex)<-[edge]-(other) | [type(edge), labels(other), elementId(other)]] AS incoming,
+        [(vertex)-[edge]->(other) | [elementId(other), type(edge), properties(edge)]] AS edges
+    """
+
+DEFAULT_PAGE_SIZE = 1000
+
+# The database server's clock, as the epoch seconds DateTimeProperty stores.  Writes stamp the nodes they touch with
+# it, see PlatDBNode.modified_timestamp
+SERVER_NOW = "timestamp() / 1000.0"
+
+# neomodel's queries, save() and NodeSet lookups included, are reported to the query listeners
+instrumentation.instrument_database(db)
+
+
+# A write operation as a generator that yields `(query, params)` and is sent back the result rows of each query,
+# see PlatDBNode
+QueryPlan = Generator[tuple[str, dict], list, Any]
+
+
+def _run_plan(plan: QueryPlan) -> Any:
+    """Run a QueryPlan through neomodel's connection, returns what the plan returns"""
+    try:
+        query, params = next(plan)
+        while True:
+            results, _ = db.cypher_query(query, params)
+            query, params = plan.send(results)
+    except StopIteration as stop:
+        return stop.value
+
+
+# Called with (node class, operation name) after each write made through PlatDBNode, see add_write_listener()
+WriteListener = Callable[[type["PlatDBNode"], str], None]
+
+_write_listeners: list[WriteListener] = []
+
+
+def add_write_listener(listener: WriteListener):
+    """Call `listener(node class, operation)` after each write made through corelib, ie.
+       `listener(Compute, 'bulk_upsert')`, also when the write failed part way.  Writes made with cypher or
+       neomodel relationship managers directly aren't reported."""
+    _write_listeners.append(listener)
+
+
+def remove_write_listener(listener: WriteListener):
+    _write_listeners.remove(listener)
+
+
+def notify_write(platdb_cls: type["PlatDBNode"], operation: str):
+    """Report a write to the write listeners, see add_write_listener()"""
+    for listener in list(_write_listeners):
+        listener(platdb_cls, operation)
+
+
+def _run_write_plan(platdb_cls: type["PlatDBNode"], operation: str, plan: QueryPlan) -> Any:
+    """_run_plan() for a write, reported to the write listeners"""
+    try:
+        with instrumentation.operation(f'{platdb_cls.__name__}.{operation}'):
+            return _run_plan(plan)
+    finally:
+        notify_write(platdb_cls, operation)
+
+
+def chunks(items: Iterable, size: int) -> Iterator[list]:
+    """`items` in lists of `size` items, the last one possibly shorter"""
+    if size < 1:
+        raise ValueError(f'batch_size must be at least 1, got {size}')
+
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def _node_match(alias: str, label: str, shape: Optional[tuple[str, ...]], param: str) -> str:
+    """A MATCH pattern for a node identified by `param`, either an element_id (shape None) or a map
+       holding the properties in `shape`"""
+    if shape is None:
+        return f"({alias}:{label}) WHERE elementId({alias}) = {param}"
+
+    properties = ", ".join(f"{name}: {param}.{name}" for name in shape)
+    return f"({alias}:{label} {{{properties}}})"
+
+
+def _filter_where(alias: str, shape: tuple[tuple[str, bool], ...], param: str) -> str:
+    """A WHERE condition comparing `alias` to the properties of the map `param`, or to null, see
+       PlatDBNode.deflate_filter()"""
+    return " AND ".join(
+        f"{alias}.{name} IS NULL" if is_null else f"{alias}.{name} = {param}.{name}"
+        for name, is_null in shape)
+
+
+def driver_config(**settings) -> dict:
+    """The driver settings that aren't None, the driver's defaults apply to the others"""
+    return {name: value for name, value in settings.items() if value is not None}
+
+
+def vertex_ht(platdb_type: str, vertex: neo4j.graph.Node, outgoing: list, incoming: list) -> dict:
+    """A FULL_GRAPH_VERTICES_QUERY row as exported"""
+    platdb_ht = PlatDBSerializer.for_label(platdb_type).node_to_dict(vertex, outgoing, incoming)
+    platdb_ht['type'] = platdb_type
+
+    return platdb_ht
+
+
+def edge_ht(start_node: str, end_node: str, edge_type: str, properties: dict) -> dict:
+    """A FULL_GRAPH_EDGES_QUERY row as exported"""
+    return {
+        "start_node": start_node,
+        "end_node": end_node,
+        "type": edge_type,
+        "properties": properties
+    }
+
+
+def _graph_phases(relation_types: Iterable[str]) -> list[tuple[str, str]]:
+    """The (kind, label / relationship type) sections an export in parts reads, the vertices of each PlatDB label
+       and the edges of each of `relation_types`"""
+    return ([(GRAPH_VERTEX, label) for label in PlatDBSerializer.labels()] +
+            [(GRAPH_EDGE, relation_type) for relation_type in relation_types])
+
+
+def _encode_cursor(phase: tuple[str, str], after: str) -> str:
+    cursor = json.dumps({"phase": list(phase), "after": after}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(cursor.encode()).decode()
+
+
+def _decode_cursor(cursor: str, phases: list[tuple[str, str]]) -> tuple[int, str]:
+    """The index in `phases` and the last element id of a cursor made by _encode_cursor()"""
+    try:
+        decoded = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return phases.index(tuple(decoded["phase"])), str(decoded["after"])
+    except (binascii.Error, UnicodeDecodeError, ValueError, KeyError, TypeError):
+        raise ValueError(f'Invalid graph page cursor: {cursor!r}') from None
+
+
+def graph_page_plan(cursor: Optional[str], page_size: int) -> QueryPlan:
+    """Read up to `page_size` vertices after `cursor`, with the edges starting at them, returns (vertices, edges,
+    next cursor).
+
+    A page continues into the next label when the current one runs out, so only the last page can be short.
+    The next cursor is None once the whole graph has been read."""
+    if page_size < 1:
+        raise ValueError(f'page_size must be at least 1, got {page_size}')
+
+    phases = [(GRAPH_VERTEX, label) for label in PlatDBSerializer.labels()]
+    index, after = (0, '') if cursor is None else _decode_cursor(cursor, phases)
+
+    vertices = {}
+    edges = []
+    while index < len(phases):
+        limit = page_size - len(vertices)
+        if limit == 0:
+            return vertices, edges, _encode_cursor(phases[index], after)
+
+        _, label = phases[index]
+        rows = yield GRAPH_PAGE_VERTICES_QUERY.format(label=label), {"after": after, "label": label, "limit": limit}
+        for vertex, vertex_type, outgoing, incoming, vertex_edges in rows:
+            vertices[vertex.element_id] = vertex_ht(vertex_type[0], vertex, outgoing, incoming)
+            edges.extend(edge_ht(vertex.element_id, end_node, edge_type, properties)
+                         for end_node, edge_type, properties in vertex_edges)
+            after = vertex['uid']
+
+        if len(rows) < limit:
+            index, after = index + 1, ''
+
+    return vertices, edges, None
+
+
+# Seconds a write transaction may run for.  A write stamps the server's time when its statement starts but is only
+# visible once committed, so a delta's watermark is this far behind the time it was read at: the next delta
+# reports again what changed since, and doesn't miss the writes that were still running.
+WATERMARK_LAG = 60.0
+
+
+class GraphDelta(NamedTuple):
+    """What changed in the graph since a watermark, see Neo4jConnection.get_graph_delta()"""
+    vertices: dict
+    edges: list
+    deleted: list[str]
+    watermark: datetime.datetime
+
+
+def label_scan(since: Optional[datetime.datetime] = None) -> str:
+    """A CALL {} returning each `vertex` with a PlatDB label, one label at a time so the label indexes are used.
+       Only the vertices modified after `since` when given, with the modified_timestamp index of each label."""
+    where = "" if since is None else "WHERE vertex.modified_timestamp > $since"
+    union = "\n              UNION\n".join(
+        f"                MATCH (vertex:`{label}`) {where} RETURN vertex"
+        for label in PlatDBSerializer.labels())
+    return f"""CALL {{
+{union}
+            }}"""
+
+
+def graph_delta_plan(since: Optional[datetime.datetime], lag: float = WATERMARK_LAG) -> QueryPlan:
+    """Read the vertices and edges changed after `since`, and the element ids of the vertices deleted after it,
+       returns a GraphDelta with a watermark `lag` seconds before the server's time"""
+    if lag < 0:
+        raise ValueError(f'lag must not be negative, got {lag}')
+
+    results = yield f"RETURN {SERVER_NOW}", {}
+    watermark = datetime.datetime.fromtimestamp(results[0][0] - lag, tz=datetime.timezone.utc)
+
+    params = {"since": None if since is None else since.timestamp()}
+    changed_vertices = label_scan(since)
+
+    vertices = {}
+    results = yield f"""
+            {changed_vertices}
+            RETURN
+                vertex, labels(vertex) AS vertex_type,
+                [(vertex)-[edge]->(other) | [type(edge), labels(other), elementId(other)]] AS outgoing,
+                [(vertex)<-[edge]-(other) | [type(edge), labels(other), elementId(other)]] AS incoming
+            """, params
+    for vertex, vertex_type, outgoing, incoming in results:
+        vertices[vertex.element_id] = vertex_ht(vertex_type[0], vertex, outgoing, incoming)
+
+    results = yield f"""
+            {changed_vertices}
+            MATCH (vertex)-[edge]-()
+            WITH DISTINCT edge
+            RETURN elementId(edge) AS edge_id, elementId(startNode(edge)) AS start_node,
+                   elementId(endNode(edge)) AS end_node, type(edge) AS edge_type, properties(edge) AS properties
+            """, params
+    edges = [edge_ht(start_node, end_node, edge_type, properties)
+             for _, start_node, end_node, edge_type, properties in results]
+
+    deleted = []
+    if since is not None:
+        results = yield """
+            MATCH (tombstone:PlatDBTombstone)
+            WHERE tombstone.deleted_timestamp > $since
+            RETURN tombstone.deleted_element_id
+            """, params
+        deleted = [row[0] for row in results]
+
+    return GraphDelta(vertices, edges, deleted, watermark)
+
+
+def subgraph_types(max_depth: int, relationship_types: Optional[Iterable[str]], direction: int
+                   ) -> Optional[list[str]]:
+    """Check the arguments of get_subgraph_as_json(), returns the relationship types to walk, sorted, or None for
+       all of them"""
+    if isinstance(max_depth, bool) or not isinstance(max_depth, int) or max_depth < 0:
+        raise ValueError(f'Subgraph depth must be a non-negative integer, got {max_depth!r}!')
+    if direction not in (OUTGOING, INCOMING, EITHER):
+        raise ValueError(f'Unknown subgraph direction {direction!r}!')
+    if relationship_types is None:
+        return None
+
+    relationship_types = set(relationship_types)
+    if not relationship_types:
+        raise ValueError('Subgraph needs at least one relationship type, or None for all of them!')
+    unknown = relationship_types - set(PlatDBSerializer.relation_types())
+    if unknown:
+        raise ValueError(f'Unknown relationship types {sorted(unknown)}!')
+
+    return sorted(relationship_types)
+
+
+def subgraph_plan(platdb_cls: type["PlatDBNode"], key: Any, max_depth: int,
+                   relationship_types: Optional[Iterable[str]], direction: int) -> QueryPlan:
+    """Read the vertices within `max_depth` relationships of the node `key` and the relationships walked to reach
+       them, in one bounded variable length match, returns (vertices, edges)"""
+    relationship_types = subgraph_types(max_depth, relationship_types, direction)
+    types = "" if relationship_types is None else ":" + "|".join(f"`{name}`" for name in relationship_types)
+
+    seed, shape = platdb_cls.node_key(key)
+    traversal = "WITH seed, [] AS others, [] AS walked"
+    if max_depth:
+        relation = f"-[{types}*1..{max_depth}]-"
+        relation = {OUTGOING: f"{relation}>", INCOMING: f"<{relation}", EITHER: relation}[direction]
+        traversal = f"""
+            OPTIONAL MATCH path = (seed){relation}(other)
+            WITH seed, collect(DISTINCT other) AS others, collect(relationships(path)) AS walked
+            """
+
+    results = yield f"""
+            MATCH {_node_match('seed', platdb_cls.__label__, shape, '$seed')}
+            WITH seed LIMIT 1
+            {traversal}
+            CALL {{
+                WITH walked
+                UNWIND walked AS walk
+                UNWIND walk AS edge
+                RETURN collect(DISTINCT edge) AS edges
+            }}
+            RETURN
+                [vertex IN [seed] + [other IN others WHERE other <> seed] |
+                    [vertex, labels(vertex),
+                     [(vertex)-[edge]->(other) | [type(edge), labels(other), elementId(other)]],
+                     [(vertex)<-[edge]-(other) | [type(edge), labels(other), elementId(other)]]]] AS vertices,
+                [edge IN edges |
+                    [elementId(edge), elementId(startNode(edge)), elementId(endNode(edge)), type(edge),
+                     properties(edge)]] AS edges
+            """, {"seed": seed}
+    if not results:
+        return {}, []
+
+    vertex_rows, edge_rows = results[0]
+    vertices = {vertex.element_id: vertex_ht(vertex_type[0], vertex, outgoing, incoming)
+                for vertex, vertex_type, outgoing, incoming in vertex_rows}
+    edges = [edge_ht(start_node, end_node, edge_type, properties)
+             for _, start_node, end_node, edge_type, properties in edge_rows]
+    return vertices, edges
+
+
+def json_default(value: Any) -> Any:
+    """json.dumps() fallback for the property types neomodel inflates to"""
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
 
 
 class Neo4jConnection:
-    def __init__(self, uri: str, auth: tuple[str, str]):
+    """Connection to Neo4j, registered as neomodel's connection when opened.
+
+    `database` selects the Neo4j database, the server's default one when None.  `fetch_size` is the number of
+    records pulled per batch by streaming reads like iter_full_graph().  The driver settings are passed to the
+    driver, leaving the driver's defaults in place when None:
+      * max_connection_pool_size: connections kept per server
+      * connection_acquisition_timeout: seconds to wait for a connection from the pool
+      * keep_alive: TCP keep-alive on the driver's connections
+      * max_connection_lifetime: seconds before a pooled connection is replaced
+      * max_transaction_retry_time: seconds a UnitOfWork transaction is retried for after transient errors
+
+    With `cache_ttl` seconds, get_full_graph_as_json() is served from a GraphCache of at most `cache_max_items`
+    vertices and edges.
+
+    Read-only exports run in read transactions, which a cluster routes to its followers when connected with a
+    routing (`neo4j://`) uri, so they don't compete with profilers writing to the leader."""
+    DEFAULT_FETCH_SIZE = 1000
+
+    def __init__(self,
+                 uri: str,
+                 auth: tuple[str, str],
+                 database: Optional[str] = None,
+                 fetch_size: int = DEFAULT_FETCH_SIZE,
+                 max_connection_pool_size: Optional[int] = None,
+                 connection_acquisition_timeout: Optional[float] = None,
+                 keep_alive: Optional[bool] = None,
+                 max_connection_lifetime: Optional[float] = None,
+                 cache_ttl: Optional[float] = None,
+                 cache_max_items: Optional[int] = None,
+                 max_transaction_retry_time: Optional[float] = None):
         self._uri = uri
         self._auth = auth
+        self._database = database
+        self._fetch_size = fetch_size
+        self._driver_config = driver_config(
+            max_connection_pool_size=max_connection_pool_size,
+            connection_acquisition_timeout=connection_acquisition_timeout,
+            keep_alive=keep_alive,
+            max_connection_lifetime=max_connection_lifetime,
+            max_transaction_retry_time=max_transaction_retry_time)
+        self.cache = None if cache_ttl is None else GraphCache(self, cache_ttl, cache_max_items)
 
         self._driver = None
+        self._previous_database_name = None
 
     def __enter__(self):
         self.open()
@@ -47,76 +478,420 @@ class Neo4jConnection:
         self.close()
 
     def open(self):
-        self._driver = GraphDatabase.driver(self._uri, auth=self._auth)
+        self._driver = GraphDatabase.driver(self._uri, auth=self._auth, **self._driver_config)
+
+        # neomodel reads the database name when the driver is set; without one, whatever it is configured with
+        # stays in place.  close() puts the previous name back.
+        self._previous_database_name = config.DATABASE_NAME
+        if self._database is not None:
+            config.DATABASE_NAME = self._database
         db.set_connection(self._uri, self._driver)
 
+        if self.cache is not None:
+            add_write_listener(self.cache.invalidate)
+
         # Clear sensitive information
         self._auth = None
 
         return self
 
     def close(self):
+        if self.cache is not None:
+            remove_write_listener(self.cache.invalidate)
+            self.cache.clear()
+
         self._driver.close()
+        config.DATABASE_NAME = self._previous_database_name
+
+    def get_full_graph_as_json(self, use_cache: bool = True, workers: Optional[int] = None) -> tuple[dict, list]:
+        """All (vertices, edges) of the graph, from the connection's GraphCache when it has one unless
+           `use_cache` is False.
+
+           With `workers`, the graph is exported one PlatDB label and one relationship type at a time, by a
+           pool of `workers` threads each reading in its own session, see get_full_graph_in_parts().  The cache
+           is loaded with a single query, so `workers` needs `use_cache` False on a connection with a cache."""
+        if use_cache and self.cache is not None:
+            if workers is not None:
+                raise ValueError('workers does not apply to the cached graph, pass use_cache=False')
+
+            return self.cache.get()
+
+        if workers is not None:
+            return self.get_full_graph_in_parts(workers)
 
-    def get_full_graph_as_json(self) -> tuple[dict, list]:  
         vertices = {}
         edges = []
-        platdb_module = importlib.import_module('corelib.platdb')
 
-        results, _ = db.cypher_query(
-            """
-            MATCH (parent)-[edge]->(child) 
-            RETURN 
-                parent, labels(parent) AS parent_type, 
-                edge, type(edge) AS edge_type, 
-                child, labels(child) AS child_type
-            """
-        )
-
-        for row in results:
-            parent, parent_type, edge, edge_type, child, child_type = row
-            parent_type = parent_type[0]
-            child_type = child_type[0]
-
-            if parent.element_id not in vertices:
-                vertices[parent.element_id] = self._create_platdb_ht(
-                    platdb_module=platdb_module,
-                    platdb_type=parent_type,
-                    vertex=parent)
-
-            if child.element_id not in vertices:
-                vertices[child.element_id] = self._create_platdb_ht(
-                    platdb_module=platdb_module,
-                    platdb_type=child_type,
-                    vertex=child)
-
-            edges.append({
-                "start_node": parent.element_id,
-                "end_node": child.element_id,
-                "type": edge_type,
-                "properties": dict(edge)
-            })
+        for kind, key, data in self.iter_full_graph():
+            if kind == GRAPH_VERTEX:
+                vertices[key] = data
+            else:
+                edges.append(data)
+
+        return vertices, edges
+
+    def iter_full_graph(self, fetch_size: Optional[int] = None
+                        ) -> Iterator[tuple[str, str, dict]]:
+        """Stream the graph as `(kind, element_id, data)` records while the result cursor advances.
+
+        `kind` is GRAPH_VERTEX or GRAPH_EDGE and `data` has the same shape as the values returned by
+        get_full_graph_as_json().  All vertices are yielded, once each, before the first edge.
+        `fetch_size` is the number of records pulled from the server per batch, the connection's by default.
+
+        The export runs exactly two queries, in a single read transaction, no matter how large the graph is."""
+        vertices_query = FULL_GRAPH_VERTICES_QUERY.format(label_scan=label_scan())
+        with self._read_transaction(fetch_size) as tx:
+            for vertex, vertex_type, outgoing, incoming in instrumentation.stream(
+                    vertices_query, lambda: tx.run(vertices_query), 'Neo4jConnection.iter_full_graph'):
+                yield GRAPH_VERTEX, vertex.element_id, vertex_ht(vertex_type[0], vertex, outgoing, incoming)
+
+            for edge_id, start_node, end_node, edge_type, properties in instrumentation.stream(
+                    FULL_GRAPH_EDGES_QUERY, lambda: tx.run(FULL_GRAPH_EDGES_QUERY), 'Neo4jConnection.iter_full_graph'):
+                yield GRAPH_EDGE, edge_id, edge_ht(start_node, end_node, edge_type, properties)
+
+    def get_full_graph_in_parts(self, workers: int = 4, fetch_size: Optional[int] = None) -> tuple[dict, list]:
+        """get_full_graph_as_json(), split into a query per PlatDB label and per relationship type that are run
+        concurrently by `workers` threads, each with its own session and read transaction.
+
+        The server runs the parts in parallel, and the threads overlap their network waits and decoding.
+        Each part is read in its own transaction, so writes made during the export may show up in some parts
+        and not in others.  The relationship types are those of the database rather than those the PlatDB
+        classes declare, so that edges of any type are exported like get_full_graph_as_json() does.  Keep
+        `workers` within the connection's max_connection_pool_size."""
+        if workers < 1:
+            raise ValueError(f'workers must be at least 1, got {workers}')
+
+        with self._read_transaction() as tx:
+            relation_types = [row[0] for row in instrumentation.measure(
+                RELATIONSHIP_TYPES_QUERY, lambda: list(tx.run(RELATIONSHIP_TYPES_QUERY)),
+                'Neo4jConnection.get_full_graph_in_parts')]
+
+        vertices = {}
+        edges = []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            parts = executor.map(lambda phase: self._export_part(*phase, fetch_size), _graph_phases(relation_types))
+            for part_vertices, part_edges in parts:
+                vertices.update(part_vertices)
+                edges.extend(part_edges)
 
         return vertices, edges
 
-    def _create_platdb_ht(
-            self, 
-            platdb_module: Any, 
-            platdb_type: str, 
-            vertex: neo4j.graph.Node
-    ) -> dict:
-        platdb_cls = getattr(platdb_module, platdb_type)
-        platdb_obj = platdb_cls.inflate(vertex)
-        platdb_ht = platdb_obj.platdbnode_to_dict()
-        platdb_ht['type'] = platdb_type
+    def unit_of_work(self, chunk_size: int = DEFAULT_BATCH_SIZE,
+                     max_buffered: int = DEFAULT_MAX_BUFFERED) -> "UnitOfWork":
+        """Buffer writes and send them in a few retried transactions, rather than a transaction each:
+
+            with connection.unit_of_work() as work:
+                for compute in computes:
+                    work.upsert(Compute, compute)
+                    work.connect(Compute, {'address': compute['address']}, {'name': app}, 'applications')
+
+        See UnitOfWork."""
+        # unit_of_work imports this module for the node classes UnitOfWork writes
+        from corelib.unit_of_work import UnitOfWork  # pylint: disable=import-outside-toplevel
+
+        return UnitOfWork(self, chunk_size, max_buffered)
+
+    def get_graph_page(self, cursor: Optional[str] = None, page_size: int = DEFAULT_PAGE_SIZE
+                       ) -> tuple[dict, list, Optional[str]]:
+        """Export the graph a page at a time: returns (vertices, edges, next cursor), the vertices and edges
+        shaped like get_full_graph_as_json()'s.
+
+        Pass None for the first page and the returned cursor for each following page, until it comes back as
+        None.  The cursor is an opaque string that can be handed to a client and back, or kept to resume an
+        export that failed part way.  Pages go through the vertices one label at a time, in the order of their
+        indexed uid, so that each page starts with an index seek, and hold at most `page_size` vertices with
+        the edges starting at them, of any relationship type.  Each page is read in its own transaction:
+        vertices and edges written while an export is running may or may not be in it.  Nodes written before
+        PlatDBNode had a uid are only exported once given one, see PlatDBNode.assign_uids()."""
+        return self._run_read_plan('get_graph_page', graph_page_plan(cursor, page_size))
+
+    def get_graph_delta(self, since: Optional[datetime.datetime], lag: float = WATERMARK_LAG) -> GraphDelta:
+        """The vertices and edges created or changed after `since`, and the element ids of the vertices deleted
+        after it, shaped like get_full_graph_as_json()'s.
+
+        An edge is in the delta when either of its vertices changed: writing a relationship through
+        bulk_connect() or deleting a vertex marks the vertices at both ends as changed.  Pass the returned
+        `watermark` as `since` for the next delta; `since=None` returns the whole graph and its watermark.
+
+        The watermark is `lag` seconds behind the server's time, the longest a write transaction is expected
+        to run: a write is stamped when it starts, so one committing after the delta was read still has a
+        modified_timestamp after the watermark.  Consecutive deltas overlap by `lag` seconds as a result,
+        and consumers must accept vertices and deletions reported again, replacing what they hold.
+
+        Changes are tracked by the modified_timestamp PlatDBNode writes set and the PlatDBTombstone nodes
+        deletes leave behind, so relationships connected or disconnected through neomodel directly only show
+        up once one of their vertices is saved."""
+        return self._run_read_plan('get_graph_delta', graph_delta_plan(since, lag))
+
+    def get_subgraph_as_json(self, platdb_cls: type["PlatDBNode"], key: Any, max_depth: int = 1,
+                             relationship_types: Optional[Iterable[str]] = None, direction: int = EITHER
+                             ) -> tuple[dict, list]:
+        """The neighbourhood of a node, shaped like get_full_graph_as_json(): the vertices at most `max_depth`
+        relationships away from it, and the relationships walked to reach them.
+
+        `key` identifies the seed node like a bulk_connect() key, by element_id or by properties, ie.
+        `Application, {"name": "app1"}` or `Resource, {"address": "10.0.0.1"}`; the first match is the seed.
+        `relationship_types` limits the walk to those types, ie. ["CALLS"], and `direction` is neomodel's
+        OUTGOING, INCOMING or EITHER.  The vertices' relationship attributes still list all their neighbours.
+
+        It is a single query walking out from the seed, so its cost follows the size of the neighbourhood rather
+        than the graph's, but grows with the number of paths: keep `max_depth` small on densely connected
+        graphs.  Returns ({}, []) when no node matches `key`."""
+        return self._run_read_plan(
+            'get_subgraph_as_json', subgraph_plan(platdb_cls, key, max_depth, relationship_types, direction))
+
+    def write_full_graph_ndjson(self, fp: TextIO, fetch_size: Optional[int] = None) -> int:
+        """Write the graph to `fp` as newline delimited JSON, one vertex or edge per line:
+           {"kind": "vertex"|"edge", "id": <element_id>, "data": {...}}
+
+           Returns the number of lines written."""
+        count = 0
+        for kind, key, data in self.iter_full_graph(fetch_size=fetch_size):
+            fp.write(json.dumps({"kind": kind, "id": key, "data": data}, default=json_default))
+            fp.write('\n')
+            count += 1
+
+        return count
+
+    def _export_part(self, kind: str, name: str, fetch_size: Optional[int] = None) -> tuple[dict, list]:
+        """The vertices of the label `name`, or the edges of the relationship type `name`"""
+        with self._read_transaction(fetch_size) as tx:
+            if kind == GRAPH_VERTEX:
+                query = GRAPH_LABEL_VERTICES_QUERY.format(label=name)
+                rows = instrumentation.stream(
+                    query, lambda: tx.run(query, {"label": name}), 'Neo4jConnection.get_full_graph_in_parts')
+                return {vertex.element_id: vertex_ht(vertex_type[0], vertex, outgoing, incoming)
+                        for vertex, vertex_type, outgoing, incoming in rows}, []
+
+            query = GRAPH_TYPE_EDGES_QUERY.format(relation_type=name)
+            rows = instrumentation.stream(query, lambda: tx.run(query), 'Neo4jConnection.get_full_graph_in_parts')
+            return {}, [edge_ht(start_node, end_node, edge_type, properties)
+                        for _, start_node, end_node, edge_type, properties in rows]
+
+    def _run_read_plan(self, operation: str, plan: QueryPlan) -> Any:
+        """_run_plan() in a read transaction, its queries reported as sent by the connection's `operation`"""
+        with self._read_transaction() as tx, instrumentation.operation(f'Neo4jConnection.{operation}'):
+            try:
+                query, params = next(plan)
+                while True:
+                    query, params = plan.send(instrumentation.measure(query, lambda: list(tx.run(query, params))))
+            except StopIteration as stop:
+                return stop.value
+
+    @contextlib.contextmanager
+    def _read_transaction(self, fetch_size: Optional[int] = None) -> Iterator[neo4j.Transaction]:
+        with self._driver.session(database=self._database,
+                                  fetch_size=fetch_size or self._fetch_size,
+                                  default_access_mode=neo4j.READ_ACCESS) as session:
+            with session.begin_transaction() as tx:
+                yield tx
+
+    def _write_session(self) -> neo4j.Session:
+        return self._driver.session(database=self._database)
+
+
+# Run on a node `n` about to be deleted: its neighbours lose a relationship so they count as modified, and a
+# PlatDBTombstone records the deletion, see Neo4jConnection.get_graph_delta()
+_TOMBSTONE_CLAUSES = f"""CALL {{
+                        WITH n
+                        MATCH (n)--(neighbour)
+                        SET neighbour.modified_timestamp = {SERVER_NOW}
+                    }}
+                    CALL {{
+                        WITH n
+                        MATCH (lookup:PlatDBDnsName {{owner: elementId(n)}})
+                        DELETE lookup
+                    }}
+                    CREATE (:PlatDBTombstone {{
+                        deleted_element_id: elementId(n),
+                        label: head(labels(n)),
+                        deleted_timestamp: {SERVER_NOW}
+                    }})"""
+
+
+def _dns_name_clauses(label: str) -> str:
+    """Run on a PlatDBDNSNode `n` once its dns_names are written: the PlatDBDnsName of each of its dns_names
+       points at it, and those of the dns_names it no longer has are deleted"""
+    return f"""CALL {{
+                        WITH n
+                        MATCH (stale:PlatDBDnsName {{owner: elementId(n)}})
+                        WHERE NOT stale.name IN coalesce(n.dns_names, [])
+                        DELETE stale
+                    }}
+                    CALL {{
+                        WITH n
+                        UNWIND coalesce(n.dns_names, []) AS name
+                        MERGE (lookup:PlatDBDnsName {{key: '{label}:' + name}})
+                        SET lookup.name = name, lookup.owner = elementId(n)
+                    }}"""
+
+
+class PlatDBTombstone(StructuredNode):
+    """A deleted PlatDBNode, so that deltas can report the deletion.  Tombstones have no relationships and aren't
+       part of the exported graph."""
+    deleted_element_id = StringProperty()
+    label = StringProperty()
+    deleted_timestamp = DateTimeProperty(index=True)
+
+    @classmethod
+    def purge(cls, before: datetime.datetime) -> int:
+        """Delete the tombstones of deletions before `before`, once every consumer has synced past it.  Returns
+           the number of tombstones deleted."""
+        with instrumentation.operation('PlatDBTombstone.purge'):
+            results, _ = db.cypher_query("""
+                MATCH (tombstone:PlatDBTombstone)
+                WHERE tombstone.deleted_timestamp < $before
+                DELETE tombstone
+                RETURN count(tombstone)
+                """, {'before': before.timestamp()})
+        return results[0][0]
+
+
+class PlatDBDnsName(StructuredNode):
+    """One dns_name of a PlatDBDNSNode, found through the unique index on `key`, the node's label and the dns
+       name, since Neo4j indexes can't answer membership in a list property.  `owner` is the element id of the
+       node.  The writes of PlatDBDNSNode and the deletions of PlatDBNode keep them in sync; install the index
+       with neomodel's install_labels(), and write the lookups of the nodes that existed before with
+       PlatDBDNSNode.assign_dns_name_lookups().  Nodes written by queries of your own, rather than the PlatDBNode
+       operations, save() or create(), aren't found by their dns_names until it runs again.  Lookups have no
+       relationships and aren't part of the exported graph."""
+    key = StringProperty(unique_index=True)
+    name = StringProperty()
+    owner = StringProperty(index=True)
+
+
+class PlatDBSerializer:
+    """Turns the vertices of one PlatDBNode class into dicts.
+
+    The property converters and relationship definitions of the class are looked up once, when the
+    serializer is built, instead of with dir()/isinstance() for every vertex.  Serializers are cached per
+    class and per label, see for_class() and for_label()."""
+    _by_label: dict[str, "PlatDBSerializer"] = {}
+
+    def __init__(self, platdb_cls: type["PlatDBNode"]):
+        self.platdb_cls = platdb_cls
+        self.label = platdb_cls.__label__
+
+        # (name, db property name, Property) in the same (alphabetical) order platdbnode_to_dict() has always used
+        self.properties = tuple(sorted(
+            (name, prop.get_db_property_name(name), prop)
+            for name, prop in platdb_cls.__all_properties__))
+        self.relationship_attrs = tuple(sorted(attr for attr, _ in platdb_cls.__all_relationships__))
+        self._keys = tuple(sorted([name for name, _, _ in self.properties] + list(self.relationship_attrs)))
 
-        return platdb_ht
+        self._relationships: Optional[dict[tuple[int, str, str], list[str]]] = None
+
+    @classmethod
+    def for_class(cls, platdb_cls: type["PlatDBNode"]) -> "PlatDBSerializer":
+        return cls.for_label(platdb_cls.__label__)
+
+    @classmethod
+    def for_label(cls, label: str) -> "PlatDBSerializer":
+        try:
+            return cls._by_label[label]
+        except KeyError:
+            pass
+
+        try:
+            return cls._registry()[label]
+        except KeyError:
+            raise ValueError(f'{label} is not a PlatDB node type!') from None
+
+    @classmethod
+    def labels(cls) -> list[str]:
+        """The labels of every PlatDB node type, sorted"""
+        return sorted(cls._registry())
+
+    @classmethod
+    def relation_types(cls) -> list[str]:
+        """The relationship types declared by any PlatDB node type, sorted"""
+        return sorted({relationship.definition['relation_type']
+                       for serializer in cls._registry().values()
+                       for _, relationship in serializer.platdb_cls.__all_relationships__})
+
+    @classmethod
+    def _registry(cls) -> dict[str, "PlatDBSerializer"]:
+        pending = list(PlatDBNode.__subclasses__())
+        while pending:
+            platdb_cls = pending.pop()
+            pending.extend(platdb_cls.__subclasses__())
+            # abstract nodes don't get a label
+            if hasattr(platdb_cls, '__label__') and platdb_cls.__label__ not in cls._by_label:
+                cls._by_label[platdb_cls.__label__] = cls(platdb_cls)
+
+        return cls._by_label
+
+    @property
+    def relationships(self) -> dict[tuple[int, str, str], list[str]]:
+        """Relationship attribute names keyed by (direction, relationship type, label of the other node).
+
+        Resolved on first use, the other node classes might not be defined yet when the serializer is built."""
+        if self._relationships is None:
+            relationships = {}
+            for attr, relationship in self.platdb_cls.__all_relationships__:
+                relationship.lookup_node_class()
+                definition = relationship.definition
+                key = (definition['direction'], definition['relation_type'], definition['node_class'].__label__)
+                relationships.setdefault(key, []).append(attr)
+            self._relationships = relationships
+
+        return self._relationships
+
+    def relationship_ids(self, outgoing: list, incoming: list) -> dict[str, list]:
+        """Sort a vertex's neighbours into its RelationshipTo/RelationshipFrom attributes.
+
+        `outgoing` and `incoming` hold one `[relationship type, neighbour labels, neighbour element_id]` entry
+        per relationship, as returned by FULL_GRAPH_VERTICES_QUERY.  A neighbour is listed under an attribute
+        when its direction, relationship type and label match the attribute's definition, which is the same
+        set of nodes `getattr(node, attr).all()` would return."""
+        relationships = self.relationships
+        ids = {attr: [] for attr in self.relationship_attrs}
+        for direction, neighbours in ((OUTGOING, outgoing), (INCOMING, incoming)):
+            for relation_type, labels, element_id in neighbours:
+                for label in labels:
+                    for attr in relationships.get((direction, relation_type, label), ()):
+                        ids[attr].append(element_id)
+
+        return ids
+
+    def node_to_dict(self, vertex: neo4j.graph.Node, outgoing: list, incoming: list) -> dict:
+        """Same result as `platdb_cls.inflate(vertex).platdbnode_to_dict(...)`, without building the
+           StructuredNode in between"""
+        data = self.relationship_ids(outgoing, incoming)
+        for name, db_name, prop in self.properties:
+            value = vertex.get(db_name)
+            if value is not None:
+                data[name] = prop.inflate(value, vertex)
+            elif prop.has_default:
+                data[name] = prop.default_value()
+            else:
+                data[name] = None
+
+        return {key: data[key] for key in self._keys}
+
+    def instance_to_dict(self, platdb_obj: "PlatDBNode", relationship_ids: Optional[dict[str, list]] = None) -> dict:
+        data = {name: getattr(platdb_obj, name) for name, _, _ in self.properties}
+        for attr in self.relationship_attrs:
+            if relationship_ids is not None:
+                data[attr] = relationship_ids.get(attr, [])
+            else:
+                data[attr] = [rel.element_id for rel in getattr(platdb_obj, attr).all()]
+
+        return {key: data[key] for key in self._keys}
+
+
+class Lease(NamedTuple):
+    """Nodes claimed for profiling by PlatDBNode.claim_stale(), `token` renewing and releasing them"""
+    token: str
+    nodes: list["PlatDBNode"]
 
 
 class PlatDBNode(StructuredNode):
     __abstract_node__ = True  # prevents neo4j from adding `PlatDBNode` as a "label" in the graph db
     profile_timestamp: Optional[datetime.datetime] = DateTimeProperty()
     profile_lock_time: Optional[datetime.datetime] = DateTimeProperty()
+    # The claim_stale() lease holding profile_lock_time, so only its holder renews or releases it
+    profile_lease_token = StringProperty()
 
     # Attributes that are being added to maintain the Node obj in Astrolabe
     profile_strategy_name = StringProperty()
@@ -126,58 +901,508 @@ class PlatDBNode(StructuredNode):
     profile_warnings = JSONProperty(default={})
     profile_errors = JSONProperty(default={})
 
+    # Set by every write, see Neo4jConnection.get_graph_delta()
+    modified_timestamp: Optional[datetime.datetime] = DateTimeProperty(index=True)
+    # A random uuid set when the node is created, the key get_graph_page() pages on.  Not unique_index, which
+    # would make it one of the keys create_or_update() merges on.
+    uid = StringProperty(index=True)
+
+    DEFAULT_BATCH_SIZE = DEFAULT_BATCH_SIZE
+
+    # The write operations below are written once, as query plans: generators that yield each
+    # `(query, params)` to run and are sent back the result rows.  _run_plan() runs them through neomodel,
+    # AsyncNeo4jConnection runs the same plans on the async driver.
+
     @classmethod
     def delete_by_attributes(cls, attributes: dict) -> bool:
-        try:
-            obj = cls.nodes.get(**attributes)  # pylint: disable=no-member
-            return super(PlatDBNode, obj).delete()
-        except DoesNotExist:
-            return False
+        return _run_write_plan(cls, 'delete_by_attributes', cls._delete_many_by_attributes_plan([attributes])) > 0
 
     @classmethod
-    def update(cls, attributes: dict, new_attributes: dict
-               ) -> Optional["PlatDBNode"]:
-        """TODO: Is this method used anywhere? Defunct?"""
-        try:
-            obj = cls.nodes.get(**attributes)  # pylint: disable=no-member
+    def delete_many_by_attributes(cls, attributes_list: Iterable[dict], batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        """Delete, with its relationships, the node matching each of `attributes_list`.  The deletes are sent as
+           one query per batch of filters using the same attribute names.  Returns the number of nodes deleted.
 
-            for key, value in new_attributes.items():
-                setattr(obj, key, value)
+           Filters matching several nodes delete none of them, and MultipleNodesReturned is raised once all the
+           batches are written."""
+        return _run_write_plan(
+            cls, 'delete_many_by_attributes', cls._delete_many_by_attributes_plan(attributes_list, batch_size))
 
-            obj.save()
+    @classmethod
+    def update(cls, attributes: dict, new_attributes: dict
+               ) -> Optional["PlatDBNode"]:
+        """Set `new_attributes` on the node matching `attributes` in a single query, None removing the property.
+           Returns the updated node, or None when there is no match.  Raises MultipleNodesReturned, updating
+           nothing, when several nodes match."""
+        return _run_write_plan(cls, 'update', cls._update_plan(attributes, new_attributes))
 
-            return obj
-        except DoesNotExist:
-            return None
+    @classmethod
+    def update_many(cls, updates: Iterable[tuple[dict, dict]], batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        """update() for many `(attributes, new_attributes)` pairs, one query per batch of filters using the
+           same attribute names.  Returns the number of nodes updated.  Filters matching several nodes update
+           none of them, and MultipleNodesReturned is raised once all the batches are written."""
+        return _run_write_plan(cls, 'update_many', cls._update_many_plan(updates, batch_size))
 
     @classmethod
     def create_or_update(cls, *props, **kwargs):
         """We have to do this because apparently neomodel library does not null-out an attribute
-           when you try to update an existing attribute with a None/null replacement!"""
-        instances = super().create_or_update(*props, **kwargs)
+           when you try to update an existing attribute with a None/null replacement!
+
+           Properties explicitly given as None are removed by the MERGE itself, see merge_params(), so this is
+           a single query however many nodes are written."""
+        return _run_write_plan(cls, 'create_or_update', cls._create_or_update_plan(
+            props, lazy=kwargs.get('lazy', False), relationship=kwargs.get('relationship')))
+
+    @classmethod
+    def bulk_upsert(cls, records: Iterable[dict], batch_size: int = DEFAULT_BATCH_SIZE) -> list[str]:
+        """create_or_update() for many records, sent as one `UNWIND ... MERGE` query per `batch_size` records.
 
-        # Check each instance to ensure profile_lock_time is set to None if specified
-        for instance, prop in zip(instances, props):
-            if 'profile_lock_time' in prop and prop['profile_lock_time'] is None:
-                instance.profile_lock_time = None
-                instance.save()  # Persist the explicit None value
+        Returns the element_id of the node each record was written to, in the same order as `records`."""
+        return _run_write_plan(cls, 'bulk_upsert', cls._bulk_upsert_plan(records, batch_size))
 
-        return instances
+    @classmethod
+    def bulk_connect(cls, edges: Iterable[tuple], batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        """Create relationships from nodes of this class, one `UNWIND ... MATCH ... MERGE` query per batch.
+
+        Each edge is a `(source key, target key, relationship name, properties)` tuple:
+          * the keys are either an element_id or a dict of properties identifying a single node, ie.
+            `{'name': 'app1'}` for an Application or `{'address': '1.2.3.4'}` for a Compute
+          * the relationship name is one of the RelationshipTo/RelationshipFrom attributes of this class, which
+            decides the type, direction and target node class, ie. `Compute.bulk_connect([(..., ..., 'applications', None)])`
+            creates `(:Compute)-[:RUNS]->(:Application)`
+          * properties is a dict or None
+
+        Relationships are MERGEd, so creating one that already exists only updates its properties.  Edges
+        with a source or target that can't be found are skipped.  Returns the number of relationships
+        created or updated."""
+        return _run_write_plan(cls, 'bulk_connect', cls._bulk_connect_plan(edges, batch_size))
+
+    @classmethod
+    def claim_stale(cls, older_than: datetime.timedelta, lease: datetime.timedelta, limit: int) -> Lease:
+        """Claim up to `limit` nodes to profile, for profilers running concurrently.
+
+        A node is claimed when it wasn't profiled in the last `older_than` (profile_timestamp) and isn't held by
+        a lease taken less than `lease` ago (profile_lock_time), the nodes never profiled first.  Claimed nodes
+        get profile_lock_time set to the database server's time and the token of the returned Lease.
+
+        The claim is a single query: each candidate is locked before the conditions are checked again, so two
+        profilers never claim the same node.  Hold on to the nodes with renew_leases() and hand them back with
+        release_leases() before the lease runs out, after which they can be claimed again."""
+        return _run_write_plan(cls, 'claim_stale', cls._claim_stale_plan(older_than, lease, limit))
+
+    @classmethod
+    def renew_leases(cls, token: str, element_ids: Optional[Iterable[str]] = None) -> int:
+        """Restart the lease `token` of its nodes, or of those of `element_ids`, as if just claimed.  Nodes
+           whose lease ran out and were claimed again aren't renewed.  Returns the number of nodes renewed."""
+        return _run_write_plan(cls, 'renew_leases', cls._renew_leases_plan(token, element_ids))
+
+    @classmethod
+    def release_leases(cls, token: str, element_ids: Optional[Iterable[str]] = None, profiled: bool = False
+                       ) -> int:
+        """Release the nodes of the lease `token`, or those of `element_ids`, so they can be claimed again.
+           `profiled` sets their profile_timestamp to the server's time.  Returns the number of nodes released."""
+        return _run_write_plan(cls, 'release_leases', cls._release_leases_plan(token, element_ids, profiled))
+
+    @classmethod
+    def assign_uids(cls, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+        """Give a uid to the nodes written before PlatDBNode had one, `batch_size` nodes per query, so that
+           get_graph_page() exports them.  Returns the number of nodes given a uid."""
+        return _run_write_plan(cls, 'assign_uids', cls._assign_uids_plan(batch_size))
+
+    @classmethod
+    def _delete_many_by_attributes_plan(cls, attributes_list: Iterable[dict],
+                                        batch_size: int = DEFAULT_BATCH_SIZE) -> QueryPlan:
+        grouped = {}
+        for attributes in attributes_list:
+            params, shape = cls.deflate_filter(attributes)
+            grouped.setdefault(shape, []).append({'match': params})
+
+        count = 0
+        ambiguous = []
+        for shape, rows in grouped.items():
+            query = f"""
+                UNWIND $batch AS row
+                {cls._single_match_clauses(shape)}
+                CALL {{
+                    WITH n
+                    WITH n WHERE n IS NOT NULL
+                    {_TOMBSTONE_CLAUSES}
+                    DETACH DELETE n
+                }}
+                RETURN count(n), collect(CASE WHEN matched > 1 THEN row.match END)
+                """
+            for batch in chunks(rows, batch_size):
+                results = yield query, {'batch': batch}
+                count += results[0][0]
+                ambiguous.extend(results[0][1])
+
+        cls.check_single_matches(ambiguous)
+        return count
+
+    @classmethod
+    def _update_plan(cls, attributes: dict, new_attributes: dict) -> QueryPlan:
+        params, shape = cls.deflate_filter(attributes)
+        results = yield f"""
+            WITH {{match: $match}} AS row
+            {cls._single_match_clauses(shape)}
+            CALL {{
+                WITH n
+                WITH n WHERE n IS NOT NULL
+                SET n += $update, n.modified_timestamp = {SERVER_NOW}
+                {cls._written_clauses()}
+            }}
+            RETURN matched, n
+            """, {'match': params, 'update': cls.deflate_update(new_attributes)}
+
+        [[matched, node]] = results
+        if matched > 1:
+            cls.check_single_matches([params])
+
+        return None if node is None else cls.inflate(node)
+
+    @classmethod
+    def _update_many_plan(cls, updates: Iterable[tuple[dict, dict]], batch_size: int = DEFAULT_BATCH_SIZE
+                          ) -> QueryPlan:
+        grouped = {}
+        for attributes, new_attributes in updates:
+            params, shape = cls.deflate_filter(attributes)
+            grouped.setdefault(shape, []).append({'match': params, 'update': cls.deflate_update(new_attributes)})
+
+        count = 0
+        ambiguous = []
+        for shape, rows in grouped.items():
+            query = f"""
+                UNWIND $batch AS row
+                {cls._single_match_clauses(shape)}
+                CALL {{
+                    WITH row, n
+                    WITH row, n WHERE n IS NOT NULL
+                    SET n += row.update, n.modified_timestamp = {SERVER_NOW}
+                    {cls._written_clauses()}
+                }}
+                RETURN count(n), collect(CASE WHEN matched > 1 THEN row.match END)
+                """
+            for batch in chunks(rows, batch_size):
+                results = yield query, {'batch': batch}
+                count += results[0][0]
+                ambiguous.extend(results[0][1])
+
+        cls.check_single_matches(ambiguous)
+        return count
+
+    @classmethod
+    def _single_match_clauses(cls, shape: tuple[tuple[str, bool], ...]) -> str:
+        """Bind `matched`, the number of nodes matching the filter `row.match`, and `n`, the node when it is the
+           only one, null otherwise: like nodes.get(), a filter matching several nodes doesn't pick one"""
+        return f"""CALL {{
+                    WITH row
+                    MATCH ({cls._label_pattern('n')})
+                    WHERE {_filter_where('n', shape, 'row.match')}
+                    WITH collect(n) AS matches
+                    RETURN size(matches) AS matched, CASE size(matches) WHEN 1 THEN matches[0] END AS n
+                }}"""
+
+    @classmethod
+    def check_single_matches(cls, ambiguous: list[dict]):
+        """Raise MultipleNodesReturned for the filters matching several nodes, which were left alone"""
+        if ambiguous:
+            raise MultipleNodesReturned(
+                f'{len(ambiguous)} filter(s) matched more than one {cls.__name__} and were skipped: {ambiguous}')
+
+    @classmethod
+    def _create_or_update_plan(cls, props: Iterable[dict], lazy: bool = False, relationship: Any = None
+                               ) -> QueryPlan:
+        merge_params = [cls.merge_params(prop) for prop in props]
+        if relationship is None:
+            query, params = cls._merge_query(lazy), {'merge_params': merge_params}
+        else:
+            query, params = cls._build_merge_query(
+                merge_params, update_existing=True, relationship=relationship, lazy=lazy)
+
+        results = yield query, params
+
+        return [cls.inflate(row[0]) for row in results]
+
+    @classmethod
+    def _bulk_upsert_plan(cls, records: Iterable[dict], batch_size: int = DEFAULT_BATCH_SIZE) -> QueryPlan:
+        element_ids = []
+        query = cls._merge_query(lazy=True)
+        for batch in chunks(records, batch_size):
+            results = yield query, {'merge_params': [cls.merge_params(record) for record in batch]}
+            element_ids.extend(row[0] for row in results)
+
+        return element_ids
+
+    @classmethod
+    def _bulk_connect_plan(cls, edges: Iterable[tuple], batch_size: int = DEFAULT_BATCH_SIZE) -> QueryPlan:
+        relationships = dict(cls.__all_relationships__)
+        grouped = {}
+        for edge in edges:
+            source, target, name, properties = edge
+            if name not in relationships:
+                raise ValueError(f'{cls.__name__} has no relationship {name}!')
+
+            relationship = relationships[name]
+            relationship.lookup_node_class()
+            target_cls = relationship.definition['node_class']
+            model = relationship.definition['model']
+            if model and properties:
+                properties = model.deflate(properties)
+
+            source, source_shape = cls.node_key(source)
+            target, target_shape = target_cls.node_key(target)
+            grouped.setdefault((name, source_shape, target_shape), []).append(
+                {'source': source, 'target': target, 'properties': properties or {}})
+
+        count = 0
+        for (name, source_shape, target_shape), rows in grouped.items():
+            definition = relationships[name].definition
+            relation = f"-[edge:{definition['relation_type']}]-"
+            relation = f"{relation}>" if definition['direction'] == OUTGOING else f"<{relation}"
+            query = f"""
+                UNWIND $batch AS row
+                MATCH {_node_match('source', cls.__label__, source_shape, 'row.source')}
+                MATCH {_node_match('target', definition['node_class'].__label__, target_shape, 'row.target')}
+                MERGE (source){relation}(target)
+                SET edge += row.properties,
+                    source.modified_timestamp = {SERVER_NOW},
+                    target.modified_timestamp = {SERVER_NOW}
+                RETURN count(edge)
+                """
+            for batch in chunks(rows, batch_size):
+                results = yield query, {'batch': batch}
+                count += results[0][0]
+
+        return count
+
+    @classmethod
+    def _claim_stale_plan(cls, older_than: datetime.timedelta, lease: datetime.timedelta, limit: int
+                          ) -> QueryPlan:
+        if limit < 1:
+            raise ValueError(f'limit must be at least 1, got {limit}')
+        if lease <= datetime.timedelta(0):
+            raise ValueError(f'lease must be positive, got {lease}')
+
+        # Other profilers can claim a candidate between the MATCH and the SET: setting a property takes the
+        # node's write lock, until the end of the transaction, and the conditions are checked again once held
+        stale = ("coalesce(n.profile_timestamp, 0) < now - $older_than "
+                 "AND coalesce(n.profile_lock_time, 0) < now - $lease")
+        token = uuid.uuid4().hex
+        results = yield f"""
+            WITH {SERVER_NOW} AS now
+            MATCH ({cls._label_pattern('n')})
+            WHERE {stale}
+            WITH n, now
+            ORDER BY coalesce(n.profile_timestamp, 0)
+            LIMIT $limit
+            CALL {{
+                WITH n, now
+                SET n._claim_lock = true
+                REMOVE n._claim_lock
+                WITH n, now
+                WHERE {stale}
+                SET n.profile_lock_time = now, n.profile_lease_token = $token, n.modified_timestamp = now
+                RETURN n AS claimed
+            }}
+            RETURN claimed
+            """, {'older_than': older_than.total_seconds(), 'lease': lease.total_seconds(), 'limit': limit,
+                   'token': token}
+
+        return Lease(token, [cls.inflate(row[0]) for row in results])
+
+    @classmethod
+    def _renew_leases_plan(cls, token: str, element_ids: Optional[Iterable[str]] = None) -> QueryPlan:
+        results = yield f"""
+            MATCH ({cls._label_pattern('n')} {{profile_lease_token: $token}})
+            WHERE $element_ids IS NULL OR elementId(n) IN $element_ids
+            SET n.profile_lock_time = {SERVER_NOW}, n.modified_timestamp = {SERVER_NOW}
+            RETURN count(n)
+            """, {'token': token, 'element_ids': None if element_ids is None else list(element_ids)}
+
+        return results[0][0]
+
+    @classmethod
+    def _release_leases_plan(cls, token: str, element_ids: Optional[Iterable[str]] = None, profiled: bool = False
+                             ) -> QueryPlan:
+        profile_timestamp = SERVER_NOW if profiled else 'n.profile_timestamp'
+        results = yield f"""
+            MATCH ({cls._label_pattern('n')} {{profile_lease_token: $token}})
+            WHERE $element_ids IS NULL OR elementId(n) IN $element_ids
+            SET n.profile_lock_time = null, n.profile_lease_token = null,
+                n.profile_timestamp = {profile_timestamp}, n.modified_timestamp = {SERVER_NOW}
+            RETURN count(n)
+            """, {'token': token, 'element_ids': None if element_ids is None else list(element_ids)}
+
+        return results[0][0]
+
+    @classmethod
+    def _assign_uids_plan(cls, batch_size: int = DEFAULT_BATCH_SIZE) -> QueryPlan:
+        if batch_size < 1:
+            raise ValueError(f'batch_size must be at least 1, got {batch_size}')
+
+        count = 0
+        while True:
+            results = yield f"""
+                MATCH ({cls._label_pattern('n')})
+                WHERE n.uid IS NULL
+                WITH n LIMIT $limit
+                SET n.uid = randomUUID(), n.modified_timestamp = {SERVER_NOW}
+                RETURN count(n)
+                """, {'limit': batch_size}
+            count += results[0][0]
+            if results[0][0] < batch_size:
+                return count
+
+    @classmethod
+    def _label_pattern(cls, alias: str) -> str:
+        return ":".join([alias] + cls.inherited_labels())
+
+    @classmethod
+    def deflate_filter(cls, attributes: dict) -> tuple[dict, tuple[tuple[str, bool], ...]]:
+        """`attributes` as query parameters, and the shape of the filter: a (db property name, is None) pair
+           per attribute, see _filter_where()"""
+        if not attributes:
+            raise ValueError(f'{cls.__name__} filter needs at least one attribute!')
+
+        properties = dict(cls.__all_properties__)
+        params = {}
+        shape = []
+        for name, value in sorted(attributes.items()):
+            if name not in properties:
+                raise ValueError(f'{cls.__name__} has no property {name}!')
+
+            db_name = properties[name].get_db_property_name(name)
+            if value is not None:
+                params[db_name] = properties[name].deflate(value)
+            shape.append((db_name, value is None))
+
+        return params, tuple(shape)
+
+    @classmethod
+    def deflate_update(cls, new_attributes: dict) -> dict:
+        """`new_attributes` as a `SET n += ...` map, None removing the property.  Attributes that aren't
+           properties of the class are ignored, like save() does."""
+        update = {}
+        for name, prop in cls.__all_properties__:
+            if name in new_attributes:
+                value = new_attributes[name]
+                update[prop.get_db_property_name(name)] = None if value is None else prop.deflate(value)
+
+        return update
+
+    @classmethod
+    def node_key(cls, key: Any) -> tuple[Any, Optional[tuple[str, ...]]]:
+        """A bulk_connect() node key as a query parameter, and its shape, which is None for an element_id
+           and the sorted property names otherwise"""
+        if isinstance(key, str):
+            return key, None
+
+        properties = dict(cls.__all_properties__)
+        deflated = {}
+        for name, value in key.items():
+            if name not in properties:
+                raise ValueError(f'{cls.__name__} has no property {name}!')
+            deflated[properties[name].get_db_property_name(name)] = properties[name].deflate(value)
+
+        return deflated, tuple(sorted(deflated))
+
+    @classmethod
+    def _merge_query(cls, lazy: bool) -> str:
+        """The query neomodel's _build_merge_query() builds for update_existing=True, with a fixed elementId()
+           for `lazy` instead of asking the database which id function it supports"""
+        merge_keys = ", ".join(
+            f"{db_name}: params.create.{db_name}"
+            for db_name in (getattr(cls, name).get_db_property_name(name) for name in cls.__required_properties__))
+        return (f"UNWIND $merge_params as params\n MERGE (n:{':'.join(cls.inherited_labels())} {{{merge_keys}}})\n "
+                "ON CREATE SET n = params.create, n.uid = randomUUID()\n "
+                "ON MATCH SET n += params.update\n "
+                f"SET n.modified_timestamp = {SERVER_NOW}\n"
+                f"RETURN {'elementId(n)' if lazy else 'n'}")
+
+    @classmethod
+    def merge_params(cls, props: dict) -> dict:
+        """The `create` and `update` maps neomodel's _build_merge_query() expects for `props`.
+
+        Unlike neomodel's own create_or_update(), properties explicitly given as None are part of `update`,
+        and `SET n += update` removes them from an existing node."""
+        create = cls.deflate(props, skip_empty=True)
+        update = {}
+        for name, prop in cls.__all_properties__:
+            if name not in props:
+                continue
+
+            db_name = prop.get_db_property_name(name)
+            update[db_name] = None if props[name] is None else create[db_name]
 
-    def platdbnode_to_dict(self):
-        data = {}
+        return {'create': create, 'update': update}
 
-        for attr in dir(self):
-            obj_attr = getattr(self.__class__, attr, None)
+    def save(self, *args, **kwargs):
+        """neomodel's save(), in a single query which also sets modified_timestamp and runs _written_clauses(),
+           rather than one query for the properties and another for the server side writes"""
+        with instrumentation.operation(f'{self.__class__.__name__}.save'):
+            if getattr(self, 'deleted', False):
+                raise ValueError(f"{self.__class__.__name__}.save() attempted on deleted node")
+
+            self.pre_save()
+            # modified_timestamp is set by the server, like every other write, since deltas compare it to the
+            # server's clock: a client clock running behind would hide the save from them
+            stamp = f"SET n.modified_timestamp = {SERVER_NOW}\n{self._written_clauses()}"
+            if hasattr(self, 'element_id_property'):
+                params = self.deflate(self.__properties__, self)
+                params.pop('modified_timestamp', None)
+                assignments = ",\n".join(f"n.{key} = ${key}" for key in params)
+                results, _ = self.cypher(f"""
+                    MATCH (n) WHERE elementId(n) = $self
+                    {f'SET {assignments}' if assignments else ''}
+                    {"".join(f'SET n:`{label}` ' for label in self.inherited_labels())}
+                    {stamp}
+                    RETURN elementId(n), n.modified_timestamp
+                    """, params)
+            else:
+                params = self.deflate(self.__properties__, self, skip_empty=True)
+                params.pop('modified_timestamp', None)
+                results, _ = db.cypher_query(f"""
+                    CREATE (n:{':'.join(self.inherited_labels())} $create_params)
+                    {stamp}
+                    RETURN elementId(n), n.modified_timestamp
+                    """, {'create_params': params})
+            [[self.element_id_property, modified_timestamp]] = results
+            self.modified_timestamp = DateTimeProperty().inflate(modified_timestamp)
+            self.post_save()
+            return self
+
+    def delete(self, *args, **kwargs):
+        """neomodel's delete(), in a single query which also leaves the tombstone, see _TOMBSTONE_CLAUSES"""
+        with instrumentation.operation(f'{self.__class__.__name__}.delete'):
+            self._pre_action_check('delete')
+            self.cypher(f"""
+                MATCH (n) WHERE elementId(n) = $self
+                {_TOMBSTONE_CLAUSES}
+                DETACH DELETE n
+                """)
+            delattr(self, 'element_id_property')
+            self.deleted = True
+            self.post_delete()
+            return True
+
+    def pre_save(self):
+        if self.uid is None:
+            self.uid = str(uuid.uuid4())
+
+    def post_save(self):
+        notify_write(self.__class__, 'save')
+
+    @classmethod
+    def _written_clauses(cls) -> str:
+        """Clauses run on a node `n` once save(), update() or update_many() wrote its properties"""
+        return ""
 
-            # Only want to keep neomodel Property objects and Relationships
-            # Any other attribute present in the object should be ignored
-            if isinstance(obj_attr, Property):
-                data[attr] = getattr(self, attr)
-            elif isinstance(obj_attr, (RelationshipTo, RelationshipFrom)):
-                data[attr] = [rel.element_id for rel in getattr(self, attr).all()]
+    def post_delete(self):
+        notify_write(self.__class__, 'delete')
 
-        return data
+    def platdbnode_to_dict(self, relationship_ids: Optional[dict[str, list]] = None):
+        """`relationship_ids` are used for the relationship attributes when given, see
+           PlatDBSerializer.relationship_ids(), otherwise each relationship is queried from the database."""
+        return PlatDBSerializer.for_class(self.__class__).instance_to_dict(self, relationship_ids)
 
 
 class PlatDBDNSNode(PlatDBNode):
@@ -190,45 +1415,339 @@ class PlatDBDNSNode(PlatDBNode):
         """For Ressouce types, sometimes we have the address and not the dns names, sometimes we have the dns_names and
              not the address.  However, address:dns_names is a natural unique key.  So we cannot specity unique and null
              in neomodel - so as you see here we create that constraint programitcally in the application layer"""
+        return _run_write_plan(cls, 'create_or_update', cls._create_or_update_plan([data]))
+
+    @classmethod
+    def bulk_upsert(cls, records: Iterable[dict], batch_size: int = PlatDBNode.DEFAULT_BATCH_SIZE) -> list[str]:
+        """create_or_update() for many records, one query per `batch_size` records.
+
+        Each record is matched by address first and then by any overlapping dns_names, exactly like
+        create_or_update().  Records of the same batch that would match each other are combined before they
+        are sent, later records winning, since the MERGE can't see the nodes created earlier in its own batch.
+
+        Returns the element_id of the node each record was written to, in the same order as `records`."""
+        return _run_write_plan(cls, 'bulk_upsert', cls._bulk_upsert_plan(records, batch_size))
+
+    @classmethod
+    def find_by_dns_names(cls, dns_names: list[str]) -> Optional["PlatDBDNSNode"]:
+        """Returns a node sharing at least one of `dns_names`, or None.
+
+        neomodel can't express this filter (https://github.com/neo4j-contrib/neomodel/issues/379) so it is
+        written in cypher.  Neo4j indexes can't answer list membership, so the dns names are looked up in the
+        unique index of PlatDBDnsName, which points at the node, instead of scanning the label."""
+        with instrumentation.operation(f'{cls.__name__}.find_by_dns_names'):
+            return _run_plan(cls._find_by_dns_names_plan(dns_names))
+
+    @classmethod
+    def create(cls, *props, **kwargs):
+        """neomodel's create(), which doesn't run the save() hooks, followed by the PlatDBDnsName lookups of the
+           created nodes.  Prefer create_or_update(), which merges with the existing nodes."""
+        nodes = super().create(*props, **kwargs)
+        _run_write_plan(cls, 'create', cls._dns_name_lookups_plan([node.element_id for node in nodes]))
+        return nodes
+
+    @classmethod
+    def get_or_create(cls, *props, **kwargs):
+        """neomodel's get_or_create(), followed by the PlatDBDnsName lookups of the nodes, see create()"""
+        nodes = super().get_or_create(*props, **kwargs)
+        _run_write_plan(cls, 'get_or_create', cls._dns_name_lookups_plan([node.element_id for node in nodes]))
+        return nodes
+
+    @classmethod
+    def assign_dns_name_lookups(cls, batch_size: int = PlatDBNode.DEFAULT_BATCH_SIZE) -> int:
+        """Write the PlatDBDnsName lookups of every node of the class with dns_names, `batch_size` nodes per
+        query, so that find_by_dns_names() and the upserts find the nodes written before the lookups existed.
+        Run it once after upgrading, with the index installed.
+
+        Nodes sharing a dns name, which reconcile_duplicates() merges, leave its lookup to the last of them.
+        Returns the number of nodes whose lookups were written."""
+        return _run_write_plan(cls, 'assign_dns_name_lookups', cls._assign_dns_name_lookups_plan(batch_size))
+
+    @classmethod
+    def reconcile_duplicates(cls, batch_size: int = PlatDBNode.DEFAULT_BATCH_SIZE) -> int:
+        """Merge the nodes create_or_update() would have merged, had they not been written concurrently: nodes
+        sharing an address or a dns_name, directly or through other nodes, are merged into one.
+
+        The server groups the nodes by address and by dns_name in a single query, returning only the keys
+        shared by several nodes, and a union-find joins the groups sharing a node.  Each group keeps its most
+        recently modified node, which gets the union of the group's dns_names, the properties it lacks from the
+        others, the newest first, and their relationships of the declared types.  The others are deleted, leaving
+        tombstones.  Groups are merged `batch_size` at a time, each batch in its own transaction, so a failure
+        part way leaves the batches already merged in place: run it again to finish.
+
+        Returns the number of nodes merged into another and deleted."""
+        return _run_write_plan(cls, 'reconcile_duplicates', cls._reconcile_duplicates_plan(batch_size))
+
+    @classmethod
+    def _written_clauses(cls) -> str:
+        return _dns_name_clauses(cls.__label__)
+
+    @classmethod
+    def _create_or_update_plan(cls, props: Iterable[dict], lazy: bool = False, relationship: Any = None
+                               ) -> QueryPlan:
+        if relationship is not None:
+            raise ValueError(f'{cls.__name__}.create_or_update() does not support relationship!')
+
+        [data] = props
+
         # MUST HAVE ADDRESS OR DNS_NAMES
-        address = data.get('address', None)
-        dns_names = data.get('dns_names', [])
-        if not address and not dns_names:
+        cls.check_natural_key(data)
+
+        # FIND BY ADDRESS, OR BY DNS_NAMES, OR INSERT A NEW RESOURCE - ALL IN A SINGLE QUERY
+        results = yield cls._upsert_query(lazy), cls.upsert_params([data])
+
+        return [cls.inflate(results[0][1])]
+
+    @classmethod
+    def _bulk_upsert_plan(cls, records: Iterable[dict], batch_size: int = PlatDBNode.DEFAULT_BATCH_SIZE
+                          ) -> QueryPlan:
+        element_ids = []
+        query = cls._upsert_query(lazy=True)
+        for batch in chunks(records, batch_size):
+            groups, group_of_record = cls.combine_batch(batch)
+            results = yield query, cls.upsert_params(groups)
+            group_ids = dict(results)
+            element_ids.extend(group_ids[group] for group in group_of_record)
+
+        return element_ids
+
+    @classmethod
+    def _find_by_dns_names_plan(cls, dns_names: list[str]) -> QueryPlan:
+        results = yield f"""
+            MATCH (lookup:PlatDBDnsName)
+            WHERE lookup.key IN [name IN $dns_names | '{cls.__label__}:' + name]
+            MATCH (n:{cls.__label__})
+            WHERE elementId(n) = lookup.owner AND lookup.name IN n.dns_names
+            RETURN n
+            LIMIT 1
+            """, {'dns_names': list(dns_names)}
+
+        if not results:
+            return None
+
+        return cls.inflate(results[0][0])
+
+    @classmethod
+    def _dns_name_lookups_plan(cls, element_ids: list[str]) -> QueryPlan:
+        results = yield f"""
+            MATCH ({cls._label_pattern('n')})
+            WHERE elementId(n) IN $element_ids
+            {_dns_name_clauses(cls.__label__)}
+            RETURN count(n)
+            """, {'element_ids': element_ids}
+
+        return results[0][0]
+
+    @classmethod
+    def _assign_dns_name_lookups_plan(cls, batch_size: int = PlatDBNode.DEFAULT_BATCH_SIZE) -> QueryPlan:
+        if batch_size < 1:
+            raise ValueError(f'batch_size must be at least 1, got {batch_size}')
+
+        # pages on the element ids, since nodes sharing a dns name would always have one without its lookup
+        count = 0
+        after = ''
+        while True:
+            results = yield f"""
+                MATCH ({cls._label_pattern('n')})
+                WHERE n.dns_names IS NOT NULL AND elementId(n) > $after
+                WITH n ORDER BY elementId(n) LIMIT $limit
+                {_dns_name_clauses(cls.__label__)}
+                RETURN count(n), max(elementId(n))
+                """, {'after': after, 'limit': batch_size}
+            [[written, after]] = results
+            count += written
+            if written < batch_size:
+                return count
+
+    @classmethod
+    def _reconcile_duplicates_plan(cls, batch_size: int = PlatDBNode.DEFAULT_BATCH_SIZE) -> QueryPlan:
+        if batch_size < 1:
+            raise ValueError(f'batch_size must be at least 1, got {batch_size}')
+
+        results = yield f"""
+            MATCH (n:{cls.__label__})
+            UNWIND [key IN [['address', n.address]] + [name IN coalesce(n.dns_names, []) | ['dns_name', name]]
+                    WHERE key[1] IS NOT NULL] AS key
+            WITH key, collect(elementId(n)) AS element_ids
+            WHERE size(element_ids) > 1
+            RETURN element_ids
+            """, {}
+
+        count = 0
+        for groups in chunks(cls._duplicate_groups(row[0] for row in results), batch_size):
+            results = yield f"""
+                MATCH (n:{cls.__label__})
+                WHERE elementId(n) IN $element_ids
+                RETURN elementId(n), properties(n)
+                """, {'element_ids': [element_id for group in groups for element_id in group]}
+            properties = dict(results)
+
+            # duplicates deleted since the first read leave groups of one node, or none, with nothing to merge
+            fetched = [{element_id: properties[element_id] for element_id in group if element_id in properties}
+                       for group in groups]
+            merges = [cls._merge_group(group) for group in fetched if len(group) > 1]
+            if merges:
+                results = yield cls._reconcile_query(), {'groups': merges}
+                count += results[0][0] or 0
+
+        return count
+
+    @staticmethod
+    def _duplicate_groups(key_groups: Iterable[list[str]]) -> list[list[str]]:
+        """Join the groups of element ids sharing an element id, a union-find over the element ids"""
+        parent: dict[str, str] = {}
+
+        def find(element_id: str) -> str:
+            root = element_id
+            while parent.setdefault(root, root) != root:
+                root = parent[root]
+            while parent[element_id] != root:
+                parent[element_id], element_id = root, parent[element_id]
+            return root
+
+        for element_ids in key_groups:
+            root = find(element_ids[0])
+            for element_id in element_ids[1:]:
+                other = find(element_id)
+                if other != root:
+                    parent[other] = root
+
+        groups: dict[str, list[str]] = {}
+        for element_id in parent:
+            groups.setdefault(find(element_id), []).append(element_id)
+
+        return [sorted(group) for group in groups.values()]
+
+    @staticmethod
+    def _merge_group(properties: dict[str, dict]) -> dict:
+        """The survivor of a group of at least two duplicates, given as element id: properties, the duplicates
+           merged into it, the newest first, and the properties it gets from them"""
+        newest_first = sorted(properties, key=lambda element_id: (
+            properties[element_id].get('modified_timestamp') or 0, element_id), reverse=True)
+        survivor, duplicates = newest_first[0], newest_first[1:]
+
+        update = {}
+        dns_names = {}
+        for element_id in newest_first:
+            for name, value in properties[element_id].items():
+                if name not in properties[survivor]:
+                    update.setdefault(name, value)
+            dns_names.update(dict.fromkeys(properties[element_id].get('dns_names') or []))
+        if dns_names:
+            update['dns_names'] = list(dns_names)
+
+        return {'survivor': survivor, 'duplicates': duplicates, 'update': update}
+
+    @classmethod
+    def _reconcile_query(cls) -> str:
+        """Merges each _merge_group() of $groups: the relationships of the duplicates are re-created on the
+           survivor, the duplicates are deleted before the survivor's properties are set, so that its merged
+           dns_names and address don't collide with theirs, its PlatDBDnsName lookups are updated, and returns
+           the number of duplicates deleted"""
+        moves = "".join(f"""
+                    CALL {{
+                        WITH survivor, n
+                        MATCH (n){left}[old:`{relation_type}`]{right}(other)
+                        WHERE other <> survivor AND other <> n
+                        MERGE (survivor){left}[new:`{relation_type}`]{right}(other)
+                        SET new += properties(old)
+                    }}"""
+                        for relation_type in PlatDBSerializer.relation_types()
+                        for left, right in (('-', '->'), ('<-', '-')))
+        return f"""
+            UNWIND $groups AS group
+            MATCH (survivor:{cls.__label__})
+            WHERE elementId(survivor) = group.survivor
+            CALL {{
+                WITH survivor, group
+                UNWIND group.duplicates AS duplicate
+                MATCH (n:{cls.__label__})
+                WHERE elementId(n) = duplicate
+                {moves}
+                {_TOMBSTONE_CLAUSES}
+                DETACH DELETE n
+                RETURN count(n) AS merged
+            }}
+            SET survivor += group.update, survivor.modified_timestamp = {SERVER_NOW}
+            WITH survivor AS n, merged
+            {_dns_name_clauses(cls.__label__)}
+            RETURN sum(merged)
+            """
+
+    @classmethod
+    def _upsert_query(cls, lazy: bool) -> str:
+        """Upserts each record of upsert_params(), which must not match each other, and returns an
+           `[index, node]` row per record, with the node's element_id in place of the node when `lazy`."""
+        return f"""
+            UNWIND $batch AS row
+            OPTIONAL MATCH (by_address:{cls.__label__} {{address: row.address}})
+            WITH row, head(collect(by_address)) AS by_address
+            CALL {{
+                WITH row, by_address
+                OPTIONAL MATCH (lookup:PlatDBDnsName)
+                WHERE by_address IS NULL AND lookup.key IN [name IN row.dns_names | '{cls.__label__}:' + name]
+                OPTIONAL MATCH (n:{cls.__label__})
+                WHERE elementId(n) = lookup.owner AND lookup.name IN n.dns_names
+                RETURN head(collect(n)) AS by_dns_names
+            }}
+            WITH row, coalesce(by_address, by_dns_names) AS existing
+            CALL {{
+                WITH row, existing
+                WITH row, existing WHERE existing IS NULL
+                CREATE (n:{cls.__label__})
+                SET n = row.create, n.uid = randomUUID(), n.modified_timestamp = {SERVER_NOW}
+                RETURN n
+              UNION
+                WITH row, existing
+                WITH row, existing WHERE existing IS NOT NULL
+                SET existing += row.update, existing.modified_timestamp = {SERVER_NOW}
+                RETURN existing AS n
+            }}
+            {_dns_name_clauses(cls.__label__)}
+            RETURN row.index, {'elementId(n)' if lazy else 'n'}
+            """
+
+    @classmethod
+    def upsert_params(cls, records: list[dict]) -> dict:
+        """The `batch` parameter of _upsert_query() for `records`"""
+        return {'batch': [
+            dict(cls.merge_params(record),
+                 index=index,
+                 address=record.get('address'),
+                 dns_names=record.get('dns_names') or [])
+            for index, record in enumerate(records)]}
+
+    @classmethod
+    def combine_batch(cls, batch: list[dict]) -> tuple[list[dict], list[int]]:
+        """Combine records sharing an address or a dns_name.  Returns the combined records and, for each
+           record of `batch`, the index of the combined record it went into."""
+        groups = []
+        group_of_record = []
+        group_by_key = {}
+        for record in batch:
+            cls.check_natural_key(record)
+            keys = [('address', record.get('address'))] + [('dns_name', name) for name in record.get('dns_names') or []]
+            keys = [key for key in keys if key[1]]
+
+            group = next((group_by_key[key] for key in keys if key in group_by_key), None)
+            if group is None:
+                group = len(groups)
+                groups.append(dict(record))
+            else:
+                groups[group].update(record)
+
+            for key in keys:
+                group_by_key[key] = group
+            group_of_record.append(group)
+
+        return groups, group_of_record
+
+    @staticmethod
+    def check_natural_key(data: dict):
+        if not data.get('address', None) and not data.get('dns_names', []):
             # pylint:disable=broad-exception-raised
             raise Exception('neomodel Resource type must have either address or dns_names fields set to save!')
 
-        # TRY TO FIND BY ADDRESS
-        existing_resource = None
-        if address:
-            try:
-                existing_resource = cls.nodes.get(address=address)
-            except DoesNotExist:
-                pass
-
-        # IF NOT, TRY TO FIND BY DNS_NAMES
-        if not existing_resource:
-            # This is garbage, no current way to run this query in neomodel!  https://github.com/neo4j-contrib/neomodel/issues/379
-            all_resources = cls.nodes.all()
-            if len(all_resources) > 0:
-                for resource in all_resources:
-                    for dns_name in dns_names:
-                        if resource.dns_names and dns_name in resource.dns_names:
-                            existing_resource = resource 
-                            continue
-
-        # IF NOT, MUST BE A NEW RESOURCE TO INSERT!
-        if not existing_resource:
-            new_resource = cls(**data)
-            new_resource.save()
-            return [new_resource]
-
-        # OTHERWISE, "UPDATE" EXISTING
-        for k, v in data.items():
-            setattr(existing_resource, k, v)
-
-        existing_resource.save()
-        return [existing_resource]
-
 
 class Application(PlatDBNode):
     name = StringProperty(unique_index=True)
@@ -308,6 +1827,12 @@ class Insights(PlatDBNode):
         self.updated = datetime.datetime.now(datetime.timezone.utc)
         return super().save(*args, **kwargs)
 
+    @classmethod
+    def deflate_update(cls, new_attributes: dict) -> dict:
+        # update() and update_many() write without save(), so 'updated' is set here too
+        return super().deflate_update(
+            dict(new_attributes, updated=datetime.datetime.now(datetime.timezone.utc)))
+
 
 class Repo(PlatDBNode):
     name = StringProperty()
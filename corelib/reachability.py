@@ -0,0 +1,315 @@
+"""
+Module Name: reachability
+
+Description:
+A transitive dependency index over the PlatDB graph: for each Application, Resource and TrafficController, the
+nodes it depends on and the nodes depending on it through any number of CALLS, USES and DEPENDS_ON relationships,
+kept up to date from graph deltas.
+
+License:
+SPDX-License-Identifier: Apache-2.0
+"""
+import threading
+import time
+
+from typing import Iterable, Iterator, Optional
+
+from neomodel.util import OUTGOING
+
+from corelib.platdb import GraphDelta, Neo4jConnection, PlatDBNode, PlatDBSerializer
+
+# The relationships a node depends on its neighbour through, as (label, relationship attribute) pairs: the
+# applications an application calls, the resources it uses and the traffic controllers it depends on
+DEPENDENCY_RELATIONSHIPS = (
+    ('Application', 'application_to'),
+    ('Application', 'resources'),
+    ('Application', 'traffic_controllers'),
+)
+
+
+def _dependency_edges(relationships: Iterable[tuple[str, str]]) -> frozenset[tuple[str, str, str]]:
+    """The (start label, relationship type, end label) of the edges going from a node to a dependency"""
+    edges = set()
+    for label, name in relationships:
+        relationship = dict(PlatDBSerializer.for_label(label).platdb_cls.__all_relationships__)[name]
+        relationship.lookup_node_class()
+        definition = relationship.definition
+        other = definition['node_class'].__label__
+        start, end = (label, other) if definition['direction'] == OUTGOING else (other, label)
+        edges.add((start, definition['relation_type'], end))
+
+    return frozenset(edges)
+
+
+def _bits(bitset: int) -> Iterator[int]:
+    """The positions of the bits set in `bitset`, lowest first"""
+    while bitset:
+        lowest = bitset & -bitset
+        yield lowest.bit_length() - 1
+        bitset ^= lowest
+
+
+def _components(successors: list[list[int]]) -> list[list[int]]:
+    """The strongly connected components of the graph, each before the components that reach it (Tarjan's
+       algorithm, without recursion)"""
+    order = [-1] * len(successors)
+    low = [0] * len(successors)
+    on_stack = [False] * len(successors)
+    stack: list[int] = []
+    components = []
+    counter = 0
+    for root in range(len(successors)):
+        if order[root] != -1:
+            continue
+
+        order[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, 0)]
+        while work:
+            node, position = work[-1]
+            if position < len(successors[node]):
+                work[-1] = (node, position + 1)
+                child = successors[node][position]
+                if order[child] == -1:
+                    order[child] = low[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack[child] = True
+                    work.append((child, 0))
+                elif on_stack[child]:
+                    low[node] = min(low[node], order[child])
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+            if low[node] == order[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack[member] = False
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+
+    return components
+
+
+class DependencyIndex:
+    """The transitive dependencies of the PlatDB graph, answering "which applications depend on this resource,
+    directly or not" without walking the graph.
+
+    Each node is numbered, and the nodes it depends on and the nodes depending on it are kept as bitsets: a
+    membership test is a bit test, and listing them costs the size of the answer.  The bitsets are computed
+    from the graph's strongly connected components, so cycles of CALLS cost no more than a single node.  Added
+    edges update the bitsets of the nodes they connect in place; a removed edge or node recomputes them from
+    the direct dependencies kept in memory, without going back to the database.  The memory used grows with
+    the square of the number of indexed nodes in the worst case, a fully connected graph.
+
+    With a `connection`, the index is loaded on first use and refreshed from get_graph_delta() when
+    invalidate() was called since the last lookup, ie. registered with add_write_listener(), or when it is
+    older than `ttl` seconds.  Without one, feed it with load() and apply()."""
+
+    def __init__(self, connection: Optional[Neo4jConnection] = None, ttl: Optional[float] = None,
+                 relationships: Iterable[tuple[str, str]] = DEPENDENCY_RELATIONSHIPS):
+        self._connection = connection
+        self.ttl = ttl
+        self._edge_types = _dependency_edges(relationships)
+        self._labels = frozenset(label for start, _, end in self._edge_types for label in (start, end))
+
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._stale = False
+        self._watermark = None
+        self._refreshed_at = 0.0
+        self._vertex_labels: dict[str, str] = {}
+        self._successors: dict[str, set[str]] = {}
+        self._positions: dict[str, int] = {}
+        self._element_ids: list[str] = []
+        self._descendants: list[int] = []
+        self._ancestors: list[int] = []
+
+    @classmethod
+    def from_json(cls, vertices: dict, edges: list,
+                  relationships: Iterable[tuple[str, str]] = DEPENDENCY_RELATIONSHIPS) -> "DependencyIndex":
+        """The index of a graph as get_full_graph_as_json() returns it"""
+        index = cls(relationships=relationships)
+        index.load(vertices, edges)
+        return index
+
+    def __len__(self) -> int:
+        return len(self._element_ids)
+
+    def dependencies(self, element_id: str) -> set[str]:
+        """The element ids of the nodes `element_id` depends on, directly or not, itself only when it is on a
+           cycle.  Empty for a node that isn't indexed."""
+        with self._lock:
+            self._refresh()
+            return self._members(self._descendants, element_id)
+
+    def dependents(self, element_id: str) -> set[str]:
+        """The element ids of the nodes depending on `element_id`, directly or not"""
+        with self._lock:
+            self._refresh()
+            return self._members(self._ancestors, element_id)
+
+    def depends_on(self, element_id: str, dependency: str) -> bool:
+        with self._lock:
+            self._refresh()
+            position = self._positions.get(element_id)
+            other = self._positions.get(dependency)
+            return position is not None and other is not None and bool(self._descendants[position] >> other & 1)
+
+    def invalidate(self, platdb_cls: Optional[type[PlatDBNode]] = None, _operation: Optional[str] = None):
+        """Refresh the index on the next lookup, a WriteListener ignoring the writes of unindexed labels"""
+        if platdb_cls is None or platdb_cls.__label__ in self._labels:
+            self._stale = True
+
+    def load(self, vertices: dict, edges: list):
+        """Index the graph `vertices` and `edges`, shaped like get_full_graph_as_json()'s"""
+        with self._lock:
+            self._vertex_labels = {element_id: vertex['type'] for element_id, vertex in vertices.items()
+                                   if vertex['type'] in self._labels}
+            self._successors = {}
+            for start, end in self._dependency_pairs(edges):
+                self._successors.setdefault(start, set()).add(end)
+            self._rebuild()
+            self._loaded = True
+
+    def apply(self, delta: GraphDelta):
+        """Bring the index up to date with a get_graph_delta(), which holds every edge of the vertices it
+           reports: vertices and deletions reported again by overlapping deltas change nothing"""
+        with self._lock:
+            self._refreshed_at = time.monotonic()
+            self._watermark = delta.watermark
+            removed = False
+            for element_id in delta.deleted:
+                if self._vertex_labels.pop(element_id, None) is not None:
+                    removed = True
+                    self._successors.pop(element_id, None)
+                    for successors in self._successors.values():
+                        successors.discard(element_id)
+
+            for element_id, vertex in delta.vertices.items():
+                if vertex['type'] in self._labels:
+                    self._vertex_labels[element_id] = vertex['type']
+
+            # the dependencies of the reported vertices, in and out, are replaced by those of the delta
+            changed = set(delta.vertices)
+            pairs = set(self._dependency_pairs(delta.edges))
+            for start, ends in self._successors.items():
+                for end in list(ends):
+                    if (start in changed or end in changed) and (start, end) not in pairs:
+                        ends.discard(end)
+                        removed = True
+            added = [(start, end) for start, end in pairs if end not in self._successors.get(start, ())]
+            for start, end in added:
+                self._successors.setdefault(start, set()).add(end)
+
+            if removed:
+                self._rebuild()
+                return
+
+            for element_id in changed:
+                if element_id in self._vertex_labels:
+                    self._position(element_id)
+            for start, end in added:
+                self._add(self._position(start), self._position(end))
+
+    def _refresh(self):
+        if self._connection is None:
+            return
+
+        if not self._loaded:
+            self._stale = False
+            delta = self._connection.get_graph_delta(None)
+            self.load(delta.vertices, delta.edges)
+            self._watermark, self._refreshed_at = delta.watermark, time.monotonic()
+        elif self._stale or (self.ttl is not None and time.monotonic() - self._refreshed_at >= self.ttl):
+            self._stale = False
+            self.apply(self._connection.get_graph_delta(self._watermark))
+
+    def _dependency_pairs(self, edges: list) -> list[tuple[str, str]]:
+        """The (node, dependency) element ids of the dependency `edges`, those between indexed vertices"""
+        pairs = []
+        for edge in edges:
+            start = self._vertex_labels.get(edge['start_node'])
+            end = self._vertex_labels.get(edge['end_node'])
+            if (start, edge['type'], end) in self._edge_types:
+                pairs.append((edge['start_node'], edge['end_node']))
+
+        return pairs
+
+    def _members(self, bitsets: list[int], element_id: str) -> set[str]:
+        position = self._positions.get(element_id)
+        if position is None:
+            return set()
+
+        return {self._element_ids[member] for member in _bits(bitsets[position])}
+
+    def _position(self, element_id: str) -> int:
+        position = self._positions.get(element_id)
+        if position is None:
+            position = self._positions[element_id] = len(self._element_ids)
+            self._element_ids.append(element_id)
+            self._descendants.append(0)
+            self._ancestors.append(0)
+
+        return position
+
+    def _add(self, start: int, end: int):
+        """Add the edge start -> end: whatever reaches `start` now reaches whatever `end` reaches"""
+        if self._descendants[start] >> end & 1:
+            return
+
+        ancestors = self._ancestors[start] | 1 << start
+        descendants = self._descendants[end] | 1 << end
+        for position in _bits(ancestors):
+            self._descendants[position] |= descendants
+        for position in _bits(descendants):
+            self._ancestors[position] |= ancestors
+
+    def _rebuild(self):
+        """Recompute the bitsets from the direct dependencies, one strongly connected component at a time"""
+        self._element_ids = list(self._vertex_labels)
+        self._positions = {element_id: position for position, element_id in enumerate(self._element_ids)}
+        successors: list[list[int]] = [[] for _ in self._element_ids]
+        predecessors: list[list[int]] = [[] for _ in self._element_ids]
+        for element_id, ends in self._successors.items():
+            start = self._positions[element_id]
+            for end in ends:
+                successors[start].append(self._positions[end])
+                predecessors[self._positions[end]].append(start)
+
+        components = _components(successors)
+        component_of = [0] * len(self._element_ids)
+        members = []
+        for component, positions in enumerate(components):
+            bitset = 0
+            for position in positions:
+                component_of[position] = component
+                bitset |= 1 << position
+            members.append(bitset)
+
+        # Components come before the components reaching them, so whatever a component reaches is known by the
+        # time it is visited; a component reaches its own members when they are on a cycle
+        reaches = [0] * len(components)
+        for component, positions in enumerate(components):
+            for position in positions:
+                for successor in successors[position]:
+                    other = component_of[successor]
+                    reaches[component] |= reaches[other] | members[other]
+        reached_by = [0] * len(components)
+        for component in reversed(range(len(components))):
+            for position in components[component]:
+                for predecessor in predecessors[position]:
+                    other = component_of[predecessor]
+                    reached_by[component] |= reached_by[other] | members[other]
+
+        # members of a component share its bitsets until an added edge changes them
+        self._descendants = [reaches[component] for component in component_of]
+        self._ancestors = [reached_by[component] for component in component_of]
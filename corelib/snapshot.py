@@ -0,0 +1,242 @@
+"""
+Module Name: snapshot
+
+Description:
+Versioned binary snapshot files of the exported PlatDB graph.  Snapshots are opened memory-mapped and decoded a
+vertex at a time, so processes on the same host share a single copy of the graph through the page cache.
+
+License:
+SPDX-License-Identifier: Apache-2.0
+"""
+import datetime
+import json
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from array import array
+from typing import Iterable, Iterator, Optional, Sequence
+
+from neomodel import DateTimeProperty
+
+from corelib.columnar import CSR, ColumnarGraph
+from corelib.platdb import PlatDBSerializer, json_default
+
+MAGIC = b'PLATDBSN'
+VERSION = 1
+
+# magic, version, directory offset, directory length.  The directory is a JSON document at the end of the file
+# locating each section, all of them 8 byte aligned
+_HEADER = struct.Struct('<8sI4xQQ')
+_ALIGNMENT = 8
+
+
+def _pool(items: Iterable[bytes]) -> tuple[array, bytes]:
+    """`items` concatenated, and the offset of each item in the concatenation followed by the total length"""
+    offsets = array('q', [0])
+    data = bytearray()
+    for item in items:
+        data += item
+        offsets.append(len(data))
+
+    return offsets, bytes(data)
+
+
+def write_snapshot(graph: ColumnarGraph, path: str):
+    """Write `graph` as a snapshot file at `path`.
+
+    The snapshot is written next to `path` and renamed into place, so a process opening `path` sees either
+    the previous snapshot or the new one, never a partial file.
+
+    File layout, all numbers in the byte order of the writing host:
+      * header: MAGIC, VERSION, the offset and length of the directory
+      * string pool of the element ids, vertex labels as codes into the directory's label list
+      * a record per vertex, its properties as a JSON array in the order of the directory's columns for its label
+      * for each relationship type, the CSR by source with the edge properties, and the CSR by target
+      * directory: a JSON document with the labels, relationship types, columns and the location of each section"""
+    sections = {}
+    sections['id_offsets'], sections['id_data'] = _pool(element_id.encode() for element_id in graph.element_ids)
+    sections['label_codes'] = array('i', graph.label_codes)
+
+    columns = {label: [name for name, _, _ in PlatDBSerializer.for_label(label).properties] for label in graph.labels}
+    records = [b''] * len(graph)
+    for index, label, properties in graph.iter_vertices():
+        records[index] = json.dumps([properties[name] for name in columns[label]],
+                                    default=json_default, separators=(',', ':')).encode()
+    sections['record_offsets'], sections['record_data'] = _pool(records)
+
+    relation_types = list(graph.adjacency)
+    for number, relation_type in enumerate(relation_types):
+        csr = graph.adjacency[relation_type]
+        reverse = graph.reverse_adjacency(relation_type)
+        sections[f'out_offsets.{number}'] = csr.offsets
+        sections[f'out_targets.{number}'] = csr.targets
+        sections[f'in_offsets.{number}'] = reverse.offsets
+        sections[f'in_targets.{number}'] = reverse.targets
+        if csr.properties is not None:
+            sections[f'properties_offsets.{number}'], sections[f'properties_data.{number}'] = _pool(
+                json.dumps(properties, default=json_default).encode() if properties else b''
+                for properties in csr.properties)
+
+    directory = {
+        "byteorder": sys.byteorder,
+        "vertex_count": len(graph),
+        "labels": list(graph.labels),
+        "relation_types": relation_types,
+        "columns": columns,
+        "sections": {},
+    }
+
+    target_dir = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile('wb', dir=target_dir, prefix='.snapshot-', delete=False) as fp:
+        try:
+            fp.write(b'\0' * _HEADER.size)
+            for name, section in sections.items():
+                fp.write(b'\0' * (-fp.tell() % _ALIGNMENT))
+                data = section.tobytes() if isinstance(section, array) else section
+                directory['sections'][name] = [fp.tell(), len(data), getattr(section, 'typecode', 'B')]
+                fp.write(data)
+
+            directory_offset = fp.tell()
+            encoded = json.dumps(directory).encode()
+            fp.write(encoded)
+            fp.seek(0)
+            fp.write(_HEADER.pack(MAGIC, VERSION, directory_offset, len(encoded)))
+            fp.flush()
+            os.fsync(fp.fileno())
+        except BaseException:
+            os.unlink(fp.name)
+            raise
+
+    os.replace(fp.name, path)
+
+
+def _copy(neighbours) -> array:
+    """`neighbours` as an array of its own, when it is a view of the mapping"""
+    if isinstance(neighbours, memoryview):
+        return array(neighbours.format, neighbours.tobytes())
+
+    return neighbours
+
+
+class _BytesPool(Sequence):
+    """The items of a _pool(), read from the mapped file on access"""
+
+    def __init__(self, offsets: memoryview, data: memoryview):
+        self._offsets = offsets
+        self._data = data
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index: int) -> bytes:
+        if not -len(self) <= index < len(self):
+            raise IndexError(index)
+
+        index %= len(self)
+        return self._data[self._offsets[index]:self._offsets[index + 1]].tobytes()
+
+
+class _StringPool(_BytesPool):
+    def __getitem__(self, index: int) -> str:
+        return super().__getitem__(index).decode()
+
+
+class _JSONPool(_BytesPool):
+    def __getitem__(self, index: int) -> Optional[dict]:
+        item = super().__getitem__(index)
+        return json.loads(item) if item else None
+
+
+class GraphSnapshot(ColumnarGraph):
+    """A snapshot file written by write_snapshot(), memory-mapped.
+
+    The element ids, labels and adjacency arrays are read straight from the mapping, and a vertex's
+    properties are only decoded when the vertex is asked for, so opening a snapshot costs about nothing
+    whatever its size.  Supports the read methods of ColumnarGraph: vertex(), to_json(), out_neighbours()...
+
+    Neighbour arrays are copied out of the mapping, which close() couldn't unmap while views of it are held."""
+
+    def __init__(self, path: str):
+        with open(path, 'rb') as fp:
+            self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = [memoryview(self._mmap)]
+
+        try:
+            magic, version, directory_offset, directory_length = _HEADER.unpack_from(self._mmap, 0)
+        except struct.error:
+            magic, version = None, None
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f'{path} is not a PlatDB snapshot')
+        if version != VERSION:
+            self.close()
+            raise ValueError(f'{path} is a version {version} snapshot, expected version {VERSION}')
+
+        directory = json.loads(self._mmap[directory_offset:directory_offset + directory_length])
+        if directory['byteorder'] != sys.byteorder:
+            self.close()
+            raise ValueError(f'{path} was written on a {directory["byteorder"]} endian host')
+
+        self._sections = directory['sections']
+        self._columns = directory['columns']
+        self._records = _BytesPool(self._section('record_offsets'), self._section('record_data'))
+
+        adjacency = {}
+        reverse = {}
+        for number, relation_type in enumerate(directory['relation_types']):
+            properties = None
+            if f'properties_offsets.{number}' in self._sections:
+                properties = _JSONPool(self._section(f'properties_offsets.{number}'),
+                                       self._section(f'properties_data.{number}'))
+            adjacency[relation_type] = CSR(
+                self._section(f'out_offsets.{number}'), self._section(f'out_targets.{number}'), properties)
+            reverse[relation_type] = CSR(
+                self._section(f'in_offsets.{number}'), self._section(f'in_targets.{number}'), None)
+
+        super().__init__(_StringPool(self._section('id_offsets'), self._section('id_data')),
+                         directory['labels'], self._section('label_codes'), {}, adjacency)
+        self._reverse = reverse
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    def out_neighbours(self, relation_type: str, index: int) -> array:
+        return _copy(super().out_neighbours(relation_type, index))
+
+    def in_neighbours(self, relation_type: str, index: int) -> array:
+        return _copy(super().in_neighbours(relation_type, index))
+
+    def _section(self, name: str) -> memoryview:
+        offset, length, typecode = self._sections[name]
+        view = self._views[0][offset:offset + length]
+        if typecode != 'B':
+            view = view.cast(typecode)
+        self._views.append(view)
+        return view
+
+    def _properties(self, index: int, label: str) -> dict:
+        values = json.loads(self._records[index])
+        properties = dict(zip(self._columns[label], values))
+        for name, _, prop in PlatDBSerializer.for_label(label).properties:
+            if isinstance(prop, DateTimeProperty) and properties.get(name) is not None:
+                properties[name] = datetime.datetime.fromisoformat(properties[name])
+
+        return properties
+
+    def iter_vertices(self) -> Iterator[tuple[int, str, dict]]:
+        for index in range(len(self)):
+            label = self.label_of(index)
+            if label is not None:
+                yield index, label, self._properties(index, label)
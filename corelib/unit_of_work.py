@@ -0,0 +1,171 @@
+"""
+Module Name: unit_of_work
+
+Description:
+Buffered PlatDB writes, sent in a few large transactions, see Neo4jConnection.unit_of_work().
+
+License:
+SPDX-License-Identifier: Apache-2.0
+"""
+from typing import Any, Optional
+
+import neo4j
+
+from corelib import instrumentation
+from corelib.platdb import (DEFAULT_BATCH_SIZE,
+                            DEFAULT_MAX_BUFFERED,
+                            Neo4jConnection,
+                            PlatDBDNSNode,
+                            PlatDBNode,
+                            notify_write)
+
+
+def _freeze(value: Any) -> Any:
+    """`value` as a dict key, dicts and lists becoming tuples"""
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+
+    return value
+
+
+class UnitOfWork:
+    """Writes buffered in memory and sent in a few large transactions, see Neo4jConnection.unit_of_work().
+
+    Repeated writes collapse into one: upserts of the same node (same merge keys, or for PlatDBDNSNode classes
+    a shared address or dns_name) are combined, later values winning, and so are updates with the same filter
+    and connections of the same nodes by the same relationship.
+
+    flush() sends the upserts, then the updates, then the relationships, as the bulk_upsert(), update_many() and
+    bulk_connect() queries, one transaction per `chunk_size` writes.  Each transaction is a managed one, run by
+    the driver's execute_write(), which runs it again after a transient error or a lost connection until the
+    driver's max_transaction_retry_time runs out, see Neo4jConnection.  The queries are MERGEs and SETs, so
+    running one again after an ambiguous commit is harmless.  If a transaction still fails, the error is raised
+    with the transactions before it committed.
+
+    The buffer is flushed once it holds `max_buffered` writes and when the `with` block exits normally.  It is
+    discarded when the block raises."""
+    # runs the query plans of the PlatDBNode classes on the connection's sessions, like AsyncNeo4jConnection
+    # pylint: disable=protected-access
+    DEFAULT_MAX_BUFFERED = DEFAULT_MAX_BUFFERED
+
+    def __init__(self, connection: Neo4jConnection, chunk_size: int = DEFAULT_BATCH_SIZE,
+                 max_buffered: int = DEFAULT_MAX_BUFFERED):
+        if chunk_size < 1:
+            raise ValueError(f'chunk_size must be at least 1, got {chunk_size}')
+
+        self._connection = connection
+        self.chunk_size = chunk_size
+        self.max_buffered = max_buffered
+
+        self._upserts: dict[type[PlatDBNode], dict[Any, dict]] = {}
+        # the combined records of each PlatDBDNSNode class, and the record of each address / dns_name
+        self._dns_upserts: dict[type[PlatDBDNSNode], list[dict]] = {}
+        self._dns_keys: dict[type[PlatDBDNSNode], dict[tuple[str, str], int]] = {}
+        self._updates: dict[type[PlatDBNode], dict[Any, tuple[dict, dict]]] = {}
+        self._edges: dict[type[PlatDBNode], dict[Any, tuple]] = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.flush()
+        else:
+            self.discard()
+
+    def __len__(self) -> int:
+        return sum(len(writes) for buffer in (self._upserts, self._dns_upserts, self._updates, self._edges)
+                   for writes in buffer.values())
+
+    def upsert(self, platdb_cls: type[PlatDBNode], record: dict):
+        """Buffer `platdb_cls.create_or_update(record)`"""
+        if issubclass(platdb_cls, PlatDBDNSNode):
+            # combined like PlatDBDNSNode.combine_batch() does
+            platdb_cls.check_natural_key(record)
+            records = self._dns_upserts.setdefault(platdb_cls, [])
+            record_of_key = self._dns_keys.setdefault(platdb_cls, {})
+            keys = [('address', record.get('address'))] + [('dns_name', name) for name in record.get('dns_names') or []]
+            keys = [key for key in keys if key[1]]
+            index = next((record_of_key[key] for key in keys if key in record_of_key), None)
+            if index is None:
+                index = len(records)
+                records.append(dict(record))
+            else:
+                records[index].update(record)
+            for key in keys:
+                record_of_key[key] = index
+        else:
+            key = _freeze([record.get(name) for name in platdb_cls.__required_properties__])
+            self._upserts.setdefault(platdb_cls, {}).setdefault(key, {}).update(record)
+        self._buffered()
+
+    def update(self, platdb_cls: type[PlatDBNode], attributes: dict, new_attributes: dict):
+        """Buffer `platdb_cls.update(attributes, new_attributes)`"""
+        platdb_cls.deflate_filter(attributes)
+        updates = self._updates.setdefault(platdb_cls, {})
+        key = _freeze(attributes)
+        if key in updates:
+            updates[key][1].update(new_attributes)
+        else:
+            updates[key] = (dict(attributes), dict(new_attributes))
+        self._buffered()
+
+    def connect(self, platdb_cls: type[PlatDBNode], source: Any, target: Any, name: str,
+                properties: Optional[dict] = None):
+        """Buffer `platdb_cls.bulk_connect([(source, target, name, properties)])`"""
+        if name not in dict(platdb_cls.__all_relationships__):
+            raise ValueError(f'{platdb_cls.__name__} has no relationship {name}!')
+
+        edges = self._edges.setdefault(platdb_cls, {})
+        key = _freeze((source, target, name))
+        merged = dict(edges[key][3] or {}) if key in edges else {}
+        merged.update(properties or {})
+        edges[key] = (source, target, name, merged or None)
+        self._buffered()
+
+    def discard(self):
+        self._upserts, self._dns_upserts, self._dns_keys, self._updates, self._edges = {}, {}, {}, {}, {}
+
+    def flush(self) -> int:
+        """Send the buffered writes, returns the number of writes sent"""
+        count = len(self)
+        plans = []
+        for platdb_cls, records in self._upserts.items():
+            plans.append((platdb_cls, 'bulk_upsert',
+                          platdb_cls._bulk_upsert_plan(list(records.values()), self.chunk_size)))
+        for platdb_cls, records in self._dns_upserts.items():
+            plans.append((platdb_cls, 'bulk_upsert', platdb_cls._bulk_upsert_plan(records, self.chunk_size)))
+        for platdb_cls, updates in self._updates.items():
+            plans.append((platdb_cls, 'update_many',
+                          platdb_cls._update_many_plan(list(updates.values()), self.chunk_size)))
+        for platdb_cls, edges in self._edges.items():
+            plans.append((platdb_cls, 'bulk_connect',
+                          platdb_cls._bulk_connect_plan(list(edges.values()), self.chunk_size)))
+        self.discard()
+
+        for platdb_cls, operation, plan in plans:
+            try:
+                with instrumentation.operation(f'{platdb_cls.__name__}.{operation}'):
+                    query, params = next(plan)
+                    while True:
+                        query, params = plan.send(self._run_chunk(query, params))
+            except StopIteration:
+                pass
+            finally:
+                notify_write(platdb_cls, operation)
+
+        return count
+
+    def _buffered(self):
+        if len(self) >= self.max_buffered:
+            self.flush()
+
+    def _run_chunk(self, query: str, params: dict) -> list:
+        """Run `query` in its own managed transaction, which the driver runs again after a retryable error"""
+        def work(tx: neo4j.ManagedTransaction) -> list:
+            return instrumentation.measure(query, lambda: [list(row) for row in tx.run(query, params)])
+
+        with self._connection._write_session() as session:
+            return session.execute_write(work)
@@ -1,14 +1,67 @@
+import asyncio
+import concurrent.futures
 import datetime
 import neo4j
 import pytest
 
+from neomodel import NodeSet, db, install_labels
+from neomodel.util import OUTGOING
+
 from tests.conftest import neo4j_db_fixtures
+from tests.platdb_contract import PlatDBContract
+
+from corelib.async_platdb import AsyncNeo4jConnection
+from corelib.cache import GraphCache
+from corelib.columnar import ColumnarGraph
+from corelib.instrumentation import count_round_trips
+from corelib.platdb import (GRAPH_PAGE_VERTICES_QUERY,
+                            Application,
+                            Compute,
+                            PlatDBDnsName,
+                            Repo,
+                            Resource,
+                            add_write_listener,
+                            remove_write_listener,
+                            vertex_ht)
+from corelib.reachability import DependencyIndex
 
 # Neo4jConnection seem like they are unused arguments but they are the
 # DB connection objects that were yielded to the function.
 # pylint: disable=unused-argument
 
 
+class Neo4jPlatDB:
+    """The InMemoryPlatDB operations run by the PlatDBNode classmethods and a Neo4jConnection"""
+
+    def __init__(self, connection):
+        self._connection = connection
+
+    def __len__(self):
+        return len(self.get_full_graph_as_json()[0])
+
+    def __getattr__(self, operation):
+        return lambda platdb_cls, *args, **kwargs: getattr(platdb_cls, operation)(*args, **kwargs)
+
+    def get_full_graph_as_json(self):
+        return self._connection.get_full_graph_as_json(use_cache=False)
+
+    def get_subgraph_as_json(self, *args, **kwargs):
+        return self._connection.get_subgraph_as_json(*args, **kwargs)
+
+
+class TestNeo4jPlatDB(PlatDBContract):
+    @pytest.fixture
+    def platdb(self, neo4j_connection):
+        return Neo4jPlatDB(neo4j_connection)
+
+
+def _operators(plan):
+    """The operators of an EXPLAIN plan, depth first"""
+    yield plan['operatorType']
+    for child in plan.get('children', []):
+        yield from _operators(child)
+
+
 @pytest.mark.parametrize('neomodel_class, create_attrs, update_attrs', neo4j_db_fixtures)
 def test_create(neomodel_class, create_attrs, update_attrs):
     # arrange/act
@@ -56,15 +109,12 @@ def test_delete(neomodel_class, create_attrs, update_attrs):
 
 
 def test_get_full_graph_as_json(mocker, mock_complex_graph, neo4j_connection):
-    mock_create_platdb_ht = mocker.patch.object(
-        neo4j_connection, 
-        '_create_platdb_ht',
-        side_effect=neo4j_connection._create_platdb_ht)  # pylint: disable=protected-access
+    mock_vertex_ht = mocker.patch('corelib.platdb.vertex_ht', side_effect=vertex_ht)
 
     vertices, edges = neo4j_connection.get_full_graph_as_json()
 
     # The number is 4 because that is how many vertices are in mock_complex_graph
-    assert mock_create_platdb_ht.call_count == 4
+    assert mock_vertex_ht.call_count == 4
 
     for edge in edges:
         start = edge['start_node']
@@ -92,6 +142,196 @@ def test_get_full_graph_as_json(mocker, mock_complex_graph, neo4j_connection):
             assert vertices[start]['name'] == 'app2'
             assert vertices[dest]['name'] == 'app1'
 
+
+def test_get_full_graph_as_json_round_trips(mocker, mock_complex_graph, neo4j_connection):
+    run_spy = mocker.spy(neo4j.Transaction, 'run')
+
+    vertices, _ = neo4j_connection.get_full_graph_as_json()
+
+    # One query for the vertices and one for the edges, however many vertices there are
+    assert len(vertices) == 4
+    assert run_spy.call_count == 2
+
+
+def test_get_full_graph_as_json_relationship_ids(mock_complex_graph, neo4j_connection):
+    vertices, _ = neo4j_connection.get_full_graph_as_json()
+    by_name = {(v['type'], v['name']): element_id for element_id, v in vertices.items()}
+    app1 = vertices[by_name[('Application', 'app1')]]
+    compute1 = vertices[by_name[('Compute', 'compute1')]]
+
+    assert app1['application_to'] == [by_name[('Application', 'app2')]]
+    assert app1['compute'] == [by_name[('Compute', 'compute1')]]
+    assert compute1['applications'] == [by_name[('Application', 'app1')]]
+
+
+def test_iter_full_graph_matches_full_graph(mock_complex_graph, neo4j_connection):
+    vertices, edges = neo4j_connection.get_full_graph_as_json()
+
+    streamed = list(neo4j_connection.iter_full_graph(fetch_size=1))
+
+    assert {key: data for kind, key, data in streamed if kind == 'vertex'} == vertices
+    streamed_edges = [data for kind, _, data in streamed if kind == 'edge']
+    assert sorted(streamed_edges, key=repr) == sorted(edges, key=repr)
+
+
+def test_get_full_graph_as_json_reads_in_read_transaction(mocker, mock_complex_graph, neo4j_connection):
+    session_spy = mocker.spy(neo4j.Driver, 'session')
+
+    vertices, _ = neo4j_connection.get_full_graph_as_json()
+
+    assert len(vertices) == 4
+    assert session_spy.call_args.kwargs['default_access_mode'] == neo4j.READ_ACCESS
+
+
+def test_get_graph_page_matches_full_graph(mock_complex_graph, neo4j_connection):
+    db.cypher_query("MATCH (a:Application {name: 'app1'}), (b:Application {name: 'app2'}) CREATE (a)-[:MIRRORS]->(b)")
+    full_vertices, full_edges = neo4j_connection.get_full_graph_as_json()
+
+    vertices, edges, pages = {}, [], 0
+    cursor = None
+    while True:
+        page_vertices, page_edges, cursor = neo4j_connection.get_graph_page(cursor, page_size=3)
+        assert len(page_vertices) <= 3
+        vertices.update(page_vertices)
+        edges.extend(page_edges)
+        pages += 1
+        if cursor is None:
+            break
+
+    assert pages > 1
+    assert vertices == full_vertices
+    assert sorted(edges, key=repr) == sorted(full_edges, key=repr)
+    assert "MIRRORS" in {edge["type"] for edge in edges}
+
+
+def test_get_graph_page_seeks_the_uid_index(neo4j_connection):
+    install_labels(Application)
+    query = GRAPH_PAGE_VERTICES_QUERY.format(label="Application")
+
+    with neo4j_connection._driver.session() as session:  # pylint: disable=protected-access
+        plan = session.run(f"EXPLAIN {query}", {"after": "", "label": "Application", "limit": 10}).consume().plan
+
+    operators = list(_operators(plan))
+    assert any(operator.startswith('NodeIndexSeekByRange') for operator in operators)
+    assert not any(operator.startswith(('Sort', 'Top')) for operator in operators)
+
+
+def test_assign_dns_name_lookups_to_existing_nodes(neo4j_connection):
+    install_labels(PlatDBDnsName)
+    db.cypher_query("UNWIND range(1, 5) AS i CREATE (:Resource {dns_names: ['db' + i + '.local']})")
+    [created] = Resource.create({"dns_names": ["created.local"]})
+    assert Resource.find_by_dns_names(["db1.local"]) is None
+
+    assigned = Resource.assign_dns_name_lookups(batch_size=2)
+
+    assert assigned == 6
+    assert Resource.find_by_dns_names(["db5.local"]).dns_names == ["db5.local"]
+    assert Resource.find_by_dns_names(["created.local"]).element_id == created.element_id
+    assert len(Resource.bulk_upsert([{"dns_names": ["db1.local"], "name": "db1"}])) == 1
+    assert len(Resource.nodes) == 6
+
+
+def test_assign_uids_to_nodes_without_one(neo4j_connection):
+    db.cypher_query("UNWIND range(1, 3) AS i CREATE (:Application {name: 'app' + i})")
+
+    assigned = Application.assign_uids(batch_size=2)
+
+    assert assigned == 3
+    assert all(app.uid for app in Application.nodes.all())
+    assert Application.assign_uids() == 0
+
+
+def test_get_graph_delta_since_watermark(mock_complex_graph, neo4j_connection):
+    full_vertices, _ = neo4j_connection.get_full_graph_as_json()
+    by_name = {(v['type'], v['name']): element_id for element_id, v in full_vertices.items()}
+    watermark = neo4j_connection.get_graph_delta(None, lag=0).watermark
+
+    Application.update({'name': 'app2'}, {'provider': 'aws'})
+    Compute.delete_by_attributes({'name': 'compute2'})
+    delta = neo4j_connection.get_graph_delta(watermark, lag=0)
+
+    assert delta.deleted == [by_name[('Compute', 'compute2')]]
+    assert delta.vertices[by_name[('Application', 'app2')]]['provider'] == 'aws'
+    assert by_name[('Compute', 'compute1')] not in delta.vertices
+    assert delta.watermark > watermark
+    assert neo4j_connection.get_graph_delta(delta.watermark, lag=0).vertices == {}
+
+
+def test_get_graph_delta_overlaps_the_previous_one(mock_complex_graph, neo4j_connection):
+    watermark = neo4j_connection.get_graph_delta(None).watermark
+
+    Application.update({'name': 'app2'}, {'provider': 'aws'})
+    delta = neo4j_connection.get_graph_delta(watermark)
+    again = neo4j_connection.get_graph_delta(delta.watermark)
+
+    assert delta.vertices.keys() <= again.vertices.keys()
+    assert any(vertex['name'] == 'app2' for vertex in again.vertices.values())
+
+
+def test_save_is_in_the_next_delta(neo4j_connection):
+    watermark = neo4j_connection.get_graph_delta(None).watermark
+
+    app = Application(name='saved').save()
+    delta = neo4j_connection.get_graph_delta(watermark)
+
+    assert app.element_id in delta.vertices
+    assert app.modified_timestamp.timestamp() > watermark.timestamp()
+
+
+def test_graph_cache_follows_writes(mocker, mock_complex_graph, neo4j_connection):
+    neo4j_connection.cache = GraphCache(neo4j_connection, ttl=3600)
+    add_write_listener(neo4j_connection.cache.invalidate)
+    try:
+        cached_vertices, _ = neo4j_connection.get_full_graph_as_json()
+        run_spy = mocker.spy(neo4j.Transaction, 'run')
+        assert neo4j_connection.get_full_graph_as_json()[0] == cached_vertices
+        assert run_spy.call_count == 0
+
+        Application.update({'name': 'app2'}, {'provider': 'aws'})
+        Compute.delete_by_attributes({'name': 'compute2'})
+        vertices, edges = neo4j_connection.get_full_graph_as_json()
+    finally:
+        remove_write_listener(neo4j_connection.cache.invalidate)
+        neo4j_connection.cache = None
+
+    full_vertices, full_edges = neo4j_connection.get_full_graph_as_json()
+    assert vertices == full_vertices
+    assert sorted(edges, key=repr) == sorted(full_edges, key=repr)
+
+
+def test_get_full_graph_in_parts_matches_full_graph(mock_complex_graph, neo4j_connection):
+    db.cypher_query("MATCH (a:Application {name: 'app1'}), (b:Application {name: 'app2'}) CREATE (a)-[:MIRRORS]->(b)")
+    full_vertices, full_edges = neo4j_connection.get_full_graph_as_json()
+
+    vertices, edges = neo4j_connection.get_full_graph_as_json(workers=4)
+
+    assert vertices == full_vertices
+    assert sorted(edges, key=repr) == sorted(full_edges, key=repr)
+    assert "MIRRORS" in {edge["type"] for edge in edges}
+
+
+def test_get_full_graph_as_json_exports_isolated_vertices(mock_complex_graph, neo4j_connection):
+    repo = Repo(name='lonely').save()
+
+    vertices, edges = neo4j_connection.get_full_graph_as_json()
+
+    assert vertices[repo.element_id]['name'] == 'lonely'
+    assert vertices[repo.element_id]['applications'] == []
+    assert all(repo.element_id not in (edge['start_node'], edge['end_node']) for edge in edges)
+
+
+def test_columnar_graph_matches_full_graph(mock_complex_graph, neo4j_connection):
+    full_vertices, full_edges = neo4j_connection.get_full_graph_as_json()
+
+    vertices, edges = ColumnarGraph.from_connection(neo4j_connection).to_json()
+
+    assert {key: {name: sorted(value) if isinstance(value, list) else value for name, value in data.items()}
+            for key, data in vertices.items()} == \
+        {key: {name: sorted(value) if isinstance(value, list) else value for name, value in data.items()}
+         for key, data in full_vertices.items()}
+    assert sorted(edges, key=repr) == sorted(full_edges, key=repr)
+
+
 @pytest.mark.parametrize('cls,orig_attrs,updated_attrs', neo4j_db_fixtures)
 def test_platdb_time_attrs(cls, orig_attrs, updated_attrs):
     """This function is for testing the PlatDB attrs which are inherited 
@@ -113,3 +353,250 @@ def test_platdb_time_attrs(cls, orig_attrs, updated_attrs):
     assert read_obj.profile_timestamp == time_now
     assert read_obj.profile_lock_time == time_now
     assert hasattr(read_obj, 'missing_attr') is False
+
+
+def test_dns_node_create_or_update_matches_dns_names(mocker):
+    Resource.create_or_update({"dns_names": ["a.example.com", "b.example.com"], "name": "first"})
+    Resource.create_or_update({"dns_names": ["other.example.com"], "name": "other"})
+    mock_all = mocker.spy(NodeSet, 'all')
+
+    updated = Resource.create_or_update({"dns_names": ["b.example.com"], "name": "second"})
+
+    mock_all.assert_not_called()
+    assert updated[0].dns_names == ["b.example.com"]
+    assert updated[0].name == "second"
+    assert len(Resource.nodes.all()) == 2
+
+
+def test_dns_name_lookups_use_the_unique_index(neo4j_connection):
+    install_labels(PlatDBDnsName)
+    resource = Resource.create_or_update({"dns_names": ["a.example.com", "b.example.com"]})[0]
+    Resource.create_or_update({"address": "1.2.3.4", "dns_names": ["d.example.com"]})
+    query, params = next(Resource._find_by_dns_names_plan(["a.example.com"]))  # pylint: disable=protected-access
+
+    with neo4j_connection._driver.session() as session:  # pylint: disable=protected-access
+        plan = session.run(f"EXPLAIN {query}", params).consume().plan
+
+    assert any(operator.startswith('NodeUniqueIndexSeek') for operator in _operators(plan))
+    assert Resource.find_by_dns_names(["nope.example.com", "b.example.com"]).element_id == resource.element_id
+    assert Resource.find_by_dns_names(["d.example.com"]).address == "1.2.3.4"
+
+    resource.dns_names = ["c.example.com"]
+    resource.save()
+    Resource.delete_by_attributes({"address": "1.2.3.4"})
+
+    assert Resource.find_by_dns_names(["a.example.com", "b.example.com", "d.example.com"]) is None
+    assert Resource.find_by_dns_names(["c.example.com"]).element_id == resource.element_id
+    assert sorted(lookup.name for lookup in PlatDBDnsName.nodes.all()) == ["c.example.com"]
+
+
+def test_bulk_upsert_creates_and_updates():
+    time_now = datetime.datetime.now(datetime.timezone.utc)
+    Compute(address="1.2.3.4", name="old", profile_lock_time=time_now).save()
+
+    element_ids = Compute.bulk_upsert([
+        {"address": "1.2.3.4", "name": "new", "profile_lock_time": None},
+        {"address": "5.6.7.8", "name": "other"},
+    ], batch_size=1)
+
+    updated = Compute.nodes.get(address="1.2.3.4")
+    assert element_ids == [updated.element_id, Compute.nodes.get(address="5.6.7.8").element_id]
+    assert updated.name == "new"
+    assert updated.profile_lock_time is None
+
+
+def test_dns_node_bulk_upsert_matches_address_and_dns_names():
+    existing = Resource.create_or_update({"address": "1.2.3.4", "dns_names": ["a.example.com"]})[0]
+
+    element_ids = Resource.bulk_upsert([
+        {"dns_names": ["a.example.com"], "name": "by_dns"},
+        {"address": "5.6.7.8", "name": "new"},
+        {"address": "5.6.7.8", "dns_names": ["b.example.com"]},
+    ])
+
+    assert element_ids[0] == existing.element_id
+    assert element_ids[1] == element_ids[2]
+    assert len(Resource.nodes.all()) == 2
+    assert Resource.nodes.get(address="5.6.7.8").dns_names == ["b.example.com"]
+
+
+def test_bulk_upsert_applies_defaults():
+    Application.bulk_upsert([{"name": "app1"}])
+
+    assert Application.nodes.get(name="app1").profile_warnings == {}
+
+
+def test_bulk_connect_is_idempotent(neo4j_connection):
+    Application.bulk_upsert([{"name": "app1"}, {"name": "app2"}])
+    compute_ids = Compute.bulk_upsert([{"address": "1.2.3.4"}])
+    edges = [
+        ({"name": "app1"}, {"name": "app2"}, 'application_to', None),
+        (compute_ids[0], {"name": "app1"}, 'applications', None),
+        ({"name": "app1"}, {"name": "missing"}, 'application_to', None),
+    ]
+
+    assert Application.bulk_connect(edges[:1] + edges[2:]) == 1
+    assert Compute.bulk_connect(edges[1:2]) == 1
+    assert Application.bulk_connect(edges[:1]) == 1
+
+    _, graph_edges = neo4j_connection.get_full_graph_as_json()
+    assert sorted(edge['type'] for edge in graph_edges) == ['CALLS', 'RUNS']
+
+
+def test_create_or_update_clears_none_in_one_query(mocker):
+    time_now = datetime.datetime.now(datetime.timezone.utc)
+    Compute.create_or_update({"address": "1.2.3.4", "name": "compute1", "profile_lock_time": time_now})
+    run_spy = mocker.spy(neo4j.Session, 'run')
+
+    updated = Compute.create_or_update({"address": "1.2.3.4", "name": None, "profile_lock_time": None})[0]
+
+    assert run_spy.call_count == 1
+    assert updated.name is None
+    assert updated.profile_lock_time is None
+    assert Compute.nodes.get(address="1.2.3.4").name is None
+
+
+def test_delete_and_update_many_report_counts(mocker):
+    Application.bulk_upsert([{"name": f"app{i}"} for i in range(5)])
+    run_spy = mocker.spy(neo4j.Session, 'run')
+
+    updated = Application.update_many([({"name": f"app{i}"}, {"provider": "aws"}) for i in range(3)])
+    deleted = Application.delete_many_by_attributes(
+        [{"name": "app0"}, {"name": "app1"}, {"name": "missing"}, {"provider": "aws", "name": "app2"}])
+
+    assert run_spy.call_count == 3
+    assert updated == 3
+    assert deleted == 3
+    assert sorted(app.name for app in Application.nodes.all()) == ["app3", "app4"]
+
+
+def test_async_connection_round_trip(mock_complex_graph, neo4j_connection):
+    async def profile():
+        async with AsyncNeo4jConnection("bolt://localhost:7687", ("neo4j", "guruai11")) as connection:
+            await asyncio.gather(*[
+                connection.bulk_upsert(Resource, [{"address": f"10.0.0.{i}", "name": f"db{i}"}])
+                for i in range(10)])
+            found = await connection.find_by_dns_names(Resource, ["nope.example.com"])
+            deleted = await connection.delete_by_attributes(Resource, {"address": "10.0.0.0"})
+            return found, deleted, await connection.get_full_graph_as_json()
+
+    found, deleted, (vertices, edges) = asyncio.run(profile())
+
+    assert found is None
+    assert deleted is True
+    assert len(Resource.nodes.all()) == 9
+    sync_vertices, sync_edges = neo4j_connection.get_full_graph_as_json()
+    assert vertices == sync_vertices
+    assert sorted(edges, key=repr) == sorted(sync_edges, key=repr)
+
+
+def test_count_round_trips(neo4j_connection):
+    with count_round_trips() as round_trips:
+        Compute.bulk_upsert([{"address": f"10.0.0.{i}"} for i in range(20)])
+        Application(name="app1").save()
+        neo4j_connection.get_full_graph_as_json(use_cache=False)
+
+    operations = [event.operation for event in round_trips.events]
+    assert operations[0] == "Compute.bulk_upsert"
+    assert "Application.save" in operations
+    assert operations[-2:] == ["Neo4jConnection.iter_full_graph"] * 2
+    assert [event.rows for event in round_trips.events][-2:] == [21, 0]
+
+
+def test_claim_stale_never_claims_twice(neo4j_connection):
+    Compute.bulk_upsert([{"address": f"10.0.0.{i}"} for i in range(20)])
+    hour = datetime.timedelta(hours=1)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+        leases = list(executor.map(lambda _: Compute.claim_stale(hour, hour, limit=8), range(4)))
+
+    claimed = [node.element_id for lease in leases for node in lease.nodes]
+    assert len(claimed) == len(set(claimed)) == 20
+    assert not Compute.claim_stale(hour, hour, limit=8).nodes
+
+    lease = max(leases, key=lambda lease: len(lease.nodes))
+    assert Compute.renew_leases(lease.token) == len(lease.nodes)
+    assert Compute.renew_leases("not a token") == 0
+    assert Compute.release_leases(lease.token, [lease.nodes[0].element_id], profiled=True) == 1
+    assert Compute.release_leases(lease.token) == len(lease.nodes) - 1
+    assert len(Compute.claim_stale(hour, hour, limit=8).nodes) == len(lease.nodes) - 1
+
+
+def test_unit_of_work(neo4j_connection):
+    with count_round_trips() as round_trips:
+        with neo4j_connection.unit_of_work(chunk_size=10) as work:
+            work.upsert(Application, {"name": "app1"})
+            for i in range(25):
+                work.upsert(Compute, {"address": f"10.0.0.{i}", "platform": "k8s"})
+                work.upsert(Compute, {"address": f"10.0.0.{i}", "name": f"compute{i}"})
+                work.connect(Compute, {"address": f"10.0.0.{i}"}, {"name": "app1"}, "applications")
+            work.update(Application, {"name": "app1"}, {"provider": "aws"})
+
+    assert round_trips.count == 1 + 3 + 1 + 3
+    assert {compute.name for compute in Compute.nodes.all()} == {f"compute{i}" for i in range(25)}
+    assert len(Application.nodes.get(name="app1").compute.all()) == 25
+    assert Application.nodes.get(name="app1").provider == "aws"
+
+
+def test_get_subgraph_as_json(mock_complex_graph, neo4j_connection):
+    full_vertices, full_edges = neo4j_connection.get_full_graph_as_json()
+    by_name = {(v['type'], v['name']): element_id for element_id, v in full_vertices.items()}
+
+    def names(vertices):
+        return sorted(vertex['name'] for vertex in vertices.values())
+
+    with count_round_trips() as round_trips:
+        vertices, edges = neo4j_connection.get_subgraph_as_json(Compute, {'name': 'compute1'}, max_depth=2)
+
+    assert round_trips.count == 1
+    assert names(vertices) == ['app1', 'app2', 'compute1']
+    assert all(vertices[element_id] == full_vertices[element_id] for element_id in vertices)
+    assert sorted(edge['type'] for edge in edges) == ['CALLED_BY', 'CALLS', 'RUNS']
+    assert all(edge in full_edges for edge in edges)
+
+    vertices, _ = neo4j_connection.get_subgraph_as_json(Compute, by_name[('Compute', 'compute1')], max_depth=3)
+    assert names(vertices) == ['app1', 'app2', 'compute1', 'compute2']
+    vertices, edges = neo4j_connection.get_subgraph_as_json(
+        Application, {'name': 'app1'}, max_depth=3, relationship_types=['CALLS'], direction=OUTGOING)
+    assert names(vertices) == ['app1', 'app2'] and len(edges) == 1
+    assert neo4j_connection.get_subgraph_as_json(Application, {'name': 'missing'}) == ({}, [])
+
+
+def test_dependency_index_follows_writes(mock_complex_graph, neo4j_connection):
+    index = DependencyIndex(neo4j_connection)
+    add_write_listener(index.invalidate)
+    try:
+        vertices, _ = neo4j_connection.get_full_graph_as_json()
+        by_name = {(v['type'], v['name']): element_id for element_id, v in vertices.items()}
+        assert index.dependencies(by_name[('Application', 'app1')]) == {by_name[('Application', 'app2')]}
+
+        [resource] = Resource.bulk_upsert([{'address': '10.0.0.1', 'name': 'db'}])
+        Application.bulk_connect([({'name': 'app2'}, resource, 'resources', None)])
+        dependents = index.dependents(resource)
+    finally:
+        remove_write_listener(index.invalidate)
+
+    assert dependents == {by_name[('Application', 'app1')], by_name[('Application', 'app2')]}
+
+
+def test_reconcile_duplicates(neo4j_connection):
+    # save() skips the address / dns_names matching of create_or_update(), like concurrent profilers can
+    app1 = Application(name='app1').save()
+    app2 = Application(name='app2').save()
+    first = Resource(address='10.0.0.1', dns_names=['db.local'], protocol='TCP').save()
+    second = Resource(dns_names=['db.local', 'db2.local'], name='db').save()
+    third = Resource(dns_names=['db2.local']).save()
+    other = Resource(dns_names=['cache.local']).save()
+    app1.resources.connect(first)
+    app2.resources.connect(third)
+
+    merged = Resource.reconcile_duplicates(batch_size=1)
+
+    [resource] = [node for node in Resource.nodes.all() if node.element_id != other.element_id]
+    assert merged == 2
+    assert resource.element_id in {first.element_id, second.element_id, third.element_id}
+    assert (resource.address, resource.name, resource.protocol) == ('10.0.0.1', 'db', 'TCP')
+    assert sorted(resource.dns_names) == ['db.local', 'db2.local']
+    assert [node.element_id for node in app1.resources.all()] == [resource.element_id]
+    assert [node.element_id for node in app2.resources.all()] == [resource.element_id]
+    assert Resource.reconcile_duplicates() == 0
@@ -0,0 +1,161 @@
+import pytest
+
+from neomodel import MultipleNodesReturned
+from neomodel.util import OUTGOING
+
+from corelib.platdb import Application, Compute, Resource
+
+
+class PlatDBContract:
+    """The behaviour every PlatDB backend shares, run against each of them by a subclass providing a `platdb`
+    fixture with the operations of InMemoryPlatDB, and its len()"""
+
+    def test_create_or_update_merges_on_unique_properties(self, platdb):
+        # arrange
+        platdb.create_or_update(Application, {"name": "app1", "provider": "aws"})
+
+        # act
+        [app] = platdb.create_or_update(Application, {"name": "app1", "provider": None})
+
+        # assert
+        assert len(platdb) == 1
+        assert (app.name, app.provider) == ("app1", None)
+        assert app.modified_timestamp is not None and app.uid is not None
+
+    def test_bulk_upsert_matches_dns_nodes_by_address_or_dns_names(self, platdb):
+        # arrange
+        [first] = platdb.bulk_upsert(Resource, [{"address": "10.0.0.1"}])
+
+        # act
+        element_ids = platdb.bulk_upsert(Resource, [
+            {"address": "10.0.0.1", "dns_names": ["db.local"]},
+            {"dns_names": ["db.local", "db2.local"], "name": "db"},
+            {"address": "10.0.0.2"},
+        ], batch_size=1)
+
+        # assert
+        assert element_ids[:2] == [first, first]
+        assert element_ids[2] != first
+        resource = platdb.find_by_dns_names(Resource, ["db2.local"])
+        assert (resource.element_id, resource.address, resource.name) == (first, "10.0.0.1", "db")
+        assert platdb.find_by_dns_names(Resource, ["other.local"]) is None
+
+    def test_bulk_connect_merges_relationships(self, platdb):
+        # arrange
+        [app_id] = platdb.bulk_upsert(Application, [{"name": "app1"}])
+        platdb.bulk_upsert(Compute, [{"address": "1.2.3.4"}])
+        edge = ({"address": "1.2.3.4"}, app_id, "applications", None)
+
+        # act
+        count = platdb.bulk_connect(Compute, [edge, edge, ({"address": "9.9.9.9"}, app_id, "applications", None)])
+
+        # assert
+        vertices, edges = platdb.get_full_graph_as_json()
+        assert count == 2
+        assert [(edge["type"], vertices[edge["start_node"]]["type"]) for edge in edges] == [("RUNS", "Compute")]
+        assert vertices[app_id]["compute"] == [edges[0]["start_node"]]
+        with pytest.raises(ValueError):
+            platdb.bulk_connect(Compute, [(edge[0], app_id, "unknown", None)])
+
+    def test_bulk_connect_by_dns_names_key(self, platdb):
+        # arrange
+        [app_id] = platdb.bulk_upsert(Application, [{"name": "app1"}])
+        [resource_id] = platdb.bulk_upsert(Resource, [{"dns_names": ["db.local", "db2.local"]}])
+
+        # act
+        count = platdb.bulk_connect(Application, [
+            (app_id, {"dns_names": ["db.local", "db2.local"]}, "resources", None),
+            (app_id, {"dns_names": ["db.local"]}, "resources", None)])
+
+        # assert
+        vertices, _ = platdb.get_full_graph_as_json()
+        assert count == 1
+        assert vertices[app_id]["resources"] == [resource_id]
+
+    def test_update_and_delete_by_attributes(self, platdb):
+        # arrange
+        platdb.bulk_upsert(Compute, [{"address": "1.2.3.4", "platform": "k8s"}, {"address": "5.6.7.8"}])
+        [app_id] = platdb.bulk_upsert(Application, [{"name": "app1"}])
+        platdb.bulk_connect(Compute, [({"address": "1.2.3.4"}, app_id, "applications", None)])
+
+        # act
+        updated = platdb.update(Compute, {"platform": "k8s"}, {"name": "compute1"})
+        updated_count = platdb.update_many(Compute, [({"platform": None}, {"platform": "ec2"})])
+        deleted = platdb.delete_by_attributes(Compute, {"name": "compute1"})
+
+        # assert
+        vertices, edges = platdb.get_full_graph_as_json()
+        assert (updated.address, updated_count, deleted) == ("1.2.3.4", 1, True)
+        assert sorted(vertex["type"] for vertex in vertices.values()) == ["Application", "Compute"]
+        assert edges == [] and vertices[app_id]["compute"] == []
+        assert platdb.update(Compute, {"address": "1.2.3.4"}, {"name": "gone"}) is None
+        assert platdb.delete_many_by_attributes(Compute, [{"address": "5.6.7.8"}, {"address": "1.2.3.4"}]) == 1
+
+    def test_updated_dns_names_are_found(self, platdb):
+        # arrange
+        [first, second] = platdb.bulk_upsert(Resource, [{"address": "10.0.0.1", "dns_names": ["old.local"]},
+                                                        {"address": "10.0.0.2"}])
+
+        # act
+        platdb.update(Resource, {"address": "10.0.0.1"}, {"dns_names": ["db.local"]})
+        platdb.update_many(Resource, [({"address": "10.0.0.2"}, {"dns_names": ["cache.local"]})])
+        [merged] = platdb.create_or_update(Resource, {"dns_names": ["db.local"], "name": "db"})
+
+        # assert
+        assert platdb.find_by_dns_names(Resource, ["db.local"]).element_id == first == merged.element_id
+        assert platdb.find_by_dns_names(Resource, ["cache.local"]).element_id == second
+        assert platdb.find_by_dns_names(Resource, ["old.local"]) is None
+        assert len(platdb) == 2
+
+    def test_writes_skip_filters_matching_several_nodes(self, platdb):
+        # arrange
+        platdb.bulk_upsert(Application, [{"name": "app1", "provider": "aws"}, {"name": "app2", "provider": "aws"},
+                                         {"name": "app3", "provider": "gcp"}])
+
+        # act/assert
+        with pytest.raises(MultipleNodesReturned):
+            platdb.update(Application, {"provider": "aws"}, {"profile_strategy_name": "ambiguous"})
+        with pytest.raises(MultipleNodesReturned):
+            platdb.update_many(Application, [({"provider": "aws"}, {"profile_strategy_name": "ambiguous"}),
+                                             ({"provider": "gcp"}, {"profile_strategy_name": "single"})])
+        with pytest.raises(MultipleNodesReturned):
+            platdb.delete_many_by_attributes(Application, [{"provider": "aws"}, {"name": "app3"}])
+        vertices, _ = platdb.get_full_graph_as_json()
+        assert sorted((vertex["name"], vertex["profile_strategy_name"]) for vertex in vertices.values()) == [
+            ("app1", None), ("app2", None)]
+
+    def test_full_graph_export_matches_serializer(self, platdb):
+        # arrange
+        [app] = platdb.create_or_update(Application, {"name": "app1", "provider": "aws"})
+
+        # act
+        vertices, edges = platdb.get_full_graph_as_json()
+
+        # assert
+        expected = app.platdbnode_to_dict({})
+        expected["type"] = "Application"
+        assert vertices == {app.element_id: expected}
+        assert edges == []
+
+    def test_get_subgraph_as_json_walks_up_to_max_depth(self, platdb):
+        # arrange
+        app_ids = platdb.bulk_upsert(Application, [{"name": f"app{index}"} for index in range(4)])
+        [compute_id] = platdb.bulk_upsert(Compute, [{"address": "1.2.3.4"}])
+        platdb.bulk_connect(Application, [(app_ids[index], app_ids[index + 1], "application_to", None)
+                                          for index in range(3)])
+        platdb.bulk_connect(Compute, [(compute_id, app_ids[0], "applications", None)])
+
+        # act
+        vertices, edges = platdb.get_subgraph_as_json(Application, {"name": "app1"}, max_depth=1)
+        outgoing, _ = platdb.get_subgraph_as_json(Application, {"name": "app0"}, max_depth=5, direction=OUTGOING)
+        runs, _ = platdb.get_subgraph_as_json(Compute, compute_id, max_depth=2, relationship_types=["RUNS"])
+
+        # assert
+        full_vertices, _ = platdb.get_full_graph_as_json()
+        assert vertices == {element_id: full_vertices[element_id] for element_id in app_ids[:3]}
+        assert len(edges) == 2
+        assert {(edge["start_node"], edge["end_node"]) for edge in edges} == {(app_ids[0], app_ids[1]),
+                                                                             (app_ids[1], app_ids[2])}
+        assert set(outgoing) == set(app_ids)
+        assert set(runs) == {compute_id, app_ids[0]}
+        assert platdb.get_subgraph_as_json(Application, {"name": "missing"}) == ({}, [])
@@ -0,0 +1,106 @@
+import pytest
+
+from benchmarks import graphs, suite
+from benchmarks.__main__ import _parser, main
+from corelib.platdb import Application, Compute, PlatDBDnsName, PlatDBTombstone, Resource, TrafficController
+
+
+def test_generate_follows_spec():
+    # arrange
+    spec = graphs.GraphSpec({"Application": 10, "Compute": 5, "Resource": 6},
+                            {("Compute", "applications"): 2, ("Application", "resources"): 1})
+
+    # act
+    graph = graphs.generate(spec)
+
+    # assert
+    assert {cls: len(records) for cls, records in graph.records.items()} == {Application: 10, Compute: 5, Resource: 6}
+    assert (len(graph.edges[Compute]), len(graph.edges[Application])) == (10, 10)
+    assert graph == graphs.generate(spec)
+    assert all("address" in record or "dns_names" in record for record in graph.records[Resource])
+
+
+def test_run_reports_every_benchmark():
+    # arrange
+    graph = graphs.generate(graphs.GraphSpec.at_scale(50))
+
+    # act
+    results = suite.run(suite.MemoryBackend(), graph, 50, repeat=1)
+
+    # assert
+    names = {result["name"] for result in results}
+    assert {"upsert.Resource", "dns_upsert.Resource", "connect", "delete.Compute", "export"} <= names
+    assert {"upsert.TrafficController", "dns_upsert.TrafficController", "delete.TrafficController"} <= names
+    assert all(result["scale"] == 50 and result["round_trips"] == 0 for result in results)
+
+
+def test_at_scale_takes_counts_per_label():
+    # arrange
+    counts = dict(_parser().parse_args(["--count", "TrafficController=7", "--count", "Compute=3"]).count)
+
+    # act
+    spec = graphs.GraphSpec.at_scale(100, counts=counts)
+
+    # assert
+    assert spec.counts == {"Application": 20, "Compute": 3, "Deployment": 10, "Resource": 25, "TrafficController": 7}
+    assert len(graphs.generate(spec).records[TrafficController]) == 7
+    with pytest.raises(SystemExit):
+        _parser().parse_args(["--count", "Nope=7"])
+
+
+def test_operations_run_on_their_own_class(mocker):
+    # arrange
+    backend = mocker.MagicMock()
+    graph = graphs.generate(graphs.GraphSpec.at_scale(50))
+
+    # act
+    for benchmark in (suite.upsert, suite.delete):
+        for _, _, operation in list(benchmark(backend, graph)):
+            operation()
+
+    # assert
+    calls = [call.args[:2] for call in backend.call.call_args_list if call.args[0] != 'bulk_connect']
+    assert calls.count(('bulk_upsert', TrafficController)) == 2
+    assert calls.count(('delete_many_by_attributes', Application)) == 1
+    assert len(set(calls)) == 2 * len(graph.records)
+
+
+def test_neo4j_is_the_default_backend(mocker, capsys):
+    # arrange
+    connection = mocker.patch('benchmarks.__main__.Neo4jConnection')
+
+    # act
+    status = main(["--scales", "10"])
+
+    # assert
+    assert status == 2
+    assert "--wipe-database" in capsys.readouterr().err
+    connection.assert_not_called()
+
+
+def test_neo4j_backend_installs_the_indexes(mocker):
+    # arrange
+    install_labels = mocker.patch('benchmarks.suite.install_labels')
+
+    # act
+    suite.Neo4jBackend(mocker.MagicMock())
+
+    # assert
+    installed = {call.args[0] for call in install_labels.call_args_list}
+    assert {Application, Resource, TrafficController, PlatDBDnsName, PlatDBTombstone} <= installed
+
+
+def test_compare_flags_slower_results_and_more_round_trips():
+    # arrange
+    baseline = [{"name": "export", "scale": 10, "seconds": 1.0, "round_trips": 2},
+                {"name": "connect", "scale": 10, "seconds": 1.0, "round_trips": 2}]
+    results = [{"name": "export", "scale": 10, "seconds": 1.1, "round_trips": 3},
+               {"name": "connect", "scale": 10, "seconds": 2.0, "round_trips": 2},
+               {"name": "upsert.Compute", "scale": 10, "seconds": 2.0, "round_trips": 2}]
+
+    # act
+    rows, regressions = suite.compare(results, baseline, tolerance=0.25)
+
+    # assert
+    assert [row["name"] for row in rows] == ["export", "connect"]
+    assert regressions == ["export @ 10: 3 round trips, 2 in the baseline", "connect @ 10: 2.00x the baseline time"]
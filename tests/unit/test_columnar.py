@@ -0,0 +1,117 @@
+from array import array
+
+import pytest
+
+from corelib.columnar import ColumnarGraph
+from corelib.platdb import Application, Compute, GRAPH_EDGE, GRAPH_VERTEX
+
+
+def _vertex(obj, **relationship_ids):
+    platdb_ht = obj.platdbnode_to_dict(relationship_ids)
+    platdb_ht['type'] = obj.__class__.__label__
+    return platdb_ht
+
+
+def _graph():
+    """app1 -CALLS-> app2, compute1 -RUNS-> app1, compute1 -RUNS-> app2"""
+    vertices = {
+        "4:db:1": _vertex(Application(name="app1", provider="aws"), application_to=["4:db:2"], compute=["4:db:3"]),
+        "4:db:2": _vertex(Application(name="app2", provider="aws"), application_from=[], compute=["4:db:3"]),
+        "4:db:3": _vertex(Compute(name="compute1", address="1.2.3.4", platform="k8s"),
+                          applications=["4:db:1", "4:db:2"]),
+    }
+    edges = [
+        {"start_node": "4:db:1", "end_node": "4:db:2", "type": "CALLS", "properties": {}},
+        {"start_node": "4:db:3", "end_node": "4:db:1", "type": "RUNS", "properties": {"weight": 1}},
+        {"start_node": "4:db:3", "end_node": "4:db:2", "type": "RUNS", "properties": {}},
+    ]
+    return vertices, edges
+
+
+def test_to_json_round_trips():
+    # arrange
+    vertices, edges = _graph()
+
+    # act
+    columnar_vertices, columnar_edges = ColumnarGraph.from_json(vertices, edges).to_json()
+
+    # assert
+    assert columnar_vertices == vertices
+    assert sorted(columnar_edges, key=repr) == sorted(edges, key=repr)
+
+
+def test_csr_adjacency():
+    # arrange
+    vertices, edges = _graph()
+
+    # act
+    graph = ColumnarGraph.from_json(vertices, edges)
+
+    # assert
+    runs = graph.adjacency["RUNS"]
+    assert runs.offsets == array('i', [0, 0, 0, 2])
+    assert runs.targets == array('i', [0, 1])
+    assert runs.properties == [{"weight": 1}, None]
+    assert graph.adjacency["CALLS"].properties is None
+    assert graph.out_neighbours("RUNS", graph.index["4:db:3"]) == array('i', [0, 1])
+    assert graph.in_neighbours("RUNS", graph.index["4:db:2"]) == array('i', [2])
+    assert list(graph.in_neighbours("USES", 0)) == []
+    assert (len(graph), graph.edge_count) == (3, 3)
+
+
+def test_label_tables_hold_columns():
+    # arrange
+    vertices, edges = _graph()
+
+    # act
+    graph = ColumnarGraph.from_json(vertices, edges)
+
+    # assert
+    applications = graph.tables["Application"]
+    assert list(applications.rows) == [0, 1]
+    assert applications.columns["name"] == ["app1", "app2"]
+    assert applications.columns["provider"][0] is applications.columns["provider"][1]
+    assert "application_to" not in applications.columns
+    assert graph.label_of(2) == "Compute"
+
+
+def test_vertex_matches_json():
+    # arrange
+    vertices, edges = _graph()
+    graph = ColumnarGraph.from_json(vertices, edges)
+
+    # act/assert
+    for element_id, data in vertices.items():
+        assert graph.vertex(graph.index[element_id]) == data
+
+
+def test_edges_to_unexported_vertices():
+    # arrange
+    vertices, edges = _graph()
+    edges.append({"start_node": "4:db:1", "end_node": "4:db:99", "type": "USES", "properties": {}})
+    graph = ColumnarGraph.from_json(vertices, edges)
+
+    # act
+    _, columnar_edges = graph.to_json()
+
+    # assert
+    assert graph.label_of(graph.index["4:db:99"]) is None
+    assert edges[-1] in columnar_edges
+    with pytest.raises(KeyError):
+        graph.vertex(graph.index["4:db:99"])
+
+
+def test_from_connection_streams_records(mocker):
+    # arrange
+    vertices, edges = _graph()
+    connection = mocker.MagicMock()
+    connection.iter_full_graph.return_value = iter(
+        [(GRAPH_VERTEX, key, data) for key, data in vertices.items()] +
+        [(GRAPH_EDGE, f"5:db:{i}", data) for i, data in enumerate(edges)])
+
+    # act
+    graph = ColumnarGraph.from_connection(connection, fetch_size=10)
+
+    # assert
+    connection.iter_full_graph.assert_called_once_with(fetch_size=10)
+    assert graph.to_json()[0] == vertices
@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+
+from neomodel import db
+
+from corelib.instrumentation import (QueryStats,
+                                     add_query_listener,
+                                     count_round_trips,
+                                     fingerprint,
+                                     measure,
+                                     operation,
+                                     remove_query_listener)
+from corelib.platdb import Application, Compute
+
+from tests.unit.test_platdb import _full_graph_rows, _mock_async_connection, _mock_connection
+
+
+def test_count_round_trips_reports_operation_and_rows(mocker):
+    # arrange
+    mocker.patch.object(type(db), 'cypher_query', return_value=([[2, []]], None))
+
+    # act
+    with count_round_trips() as round_trips:
+        Compute.delete_many_by_attributes([{"address": "1.2.3.4"}, {"address": "5.6.7.8"}])
+
+    # assert
+    [event] = round_trips.events
+    assert round_trips.count == 1
+    assert (event.operation, event.rows, event.error) == ("Compute.delete_many_by_attributes", 1, None)
+    assert event.fingerprint == fingerprint(event.query)
+
+
+def test_neomodel_queries_take_the_enclosing_operation(mocker):
+    # arrange
+    mocker.patch.object(type(db), 'cypher_query', return_value=([], None))
+
+    # act
+    with count_round_trips() as round_trips:
+        db.cypher_query("MATCH (n) RETURN n")
+        with operation("sync"):
+            db.cypher_query("MATCH (n) RETURN n")
+
+    # assert
+    assert [event.operation for event in round_trips.events] == [None, "sync"]
+
+
+def test_neomodel_queries_keep_their_arguments(mocker):
+    # arrange
+    cypher_query = mocker.patch.object(type(db), 'cypher_query', return_value=([], None))
+
+    # act
+    with count_round_trips():
+        db.cypher_query("RETURN $x", {"x": 1}, resolve_objects=True)
+        db.cypher_query("RETURN 1", handle_unique=False)
+
+    # assert
+    assert [call.args[1:] for call in cypher_query.call_args_list] == [("RETURN $x", {"x": 1}), ("RETURN 1",)]
+    assert [call.kwargs for call in cypher_query.call_args_list] == [{"resolve_objects": True},
+                                                                     {"handle_unique": False}]
+
+
+def test_failed_query_is_reported(mocker):
+    # arrange
+    mocker.patch.object(type(db), 'cypher_query', side_effect=RuntimeError("boom"))
+
+    # act
+    with count_round_trips() as round_trips:
+        with pytest.raises(RuntimeError):
+            Application.update({"name": "app1"}, {"provider": "aws"})
+
+    # assert
+    [event] = round_trips.events
+    assert (event.operation, event.rows) == ("Application.update", None)
+    assert isinstance(event.error, RuntimeError)
+
+
+def test_streamed_export_reported_once_read(mocker):
+    # arrange
+    connection, _ = _mock_connection(mocker, *_full_graph_rows())
+
+    # act
+    with count_round_trips() as round_trips:
+        records = connection.iter_full_graph()
+        next(records)
+        count_before_end = round_trips.count
+        list(records)
+
+    # assert
+    assert count_before_end == 0
+    assert [(event.operation, event.rows) for event in round_trips.events] == [
+        ("Neo4jConnection.iter_full_graph", 3), ("Neo4jConnection.iter_full_graph", 2)]
+
+
+def test_async_export_is_reported(mocker):
+    # arrange
+    connection, _ = _mock_async_connection(mocker, *_full_graph_rows())
+
+    # act
+    with count_round_trips() as round_trips:
+        asyncio.run(connection.get_full_graph_as_json())
+
+    # assert
+    assert [event.rows for event in round_trips.events] == [3, 2]
+
+
+def test_query_stats_totals_per_operation_and_query():
+    # arrange
+    stats = QueryStats()
+    add_query_listener(stats)
+
+    # act
+    try:
+        with operation("Compute.bulk_upsert"):
+            for _ in range(3):
+                measure("RETURN  1", lambda: [[1]])
+        measure("RETURN 1", lambda: [[1], [2]])
+    finally:
+        remove_query_listener(stats)
+
+    # assert
+    query_fingerprint = fingerprint("RETURN 1")
+    totals = {key: (count, rows) for key, (count, _, rows) in stats.top()}
+    assert totals == {("Compute.bulk_upsert", query_fingerprint): (3, 3), (None, query_fingerprint): (1, 2)}
+    assert stats.queries[query_fingerprint] == "RETURN  1"
@@ -0,0 +1,42 @@
+import pytest
+
+from neomodel.util import OUTGOING
+
+from corelib.memory import InMemoryPlatDB
+from corelib.platdb import Application, Compute
+from tests.platdb_contract import PlatDBContract
+
+
+class TestInMemoryPlatDB(PlatDBContract):
+    @pytest.fixture
+    def platdb(self):
+        return InMemoryPlatDB()
+
+
+def test_create_or_update_rejects_missing_merge_key():
+    # arrange
+    platdb = InMemoryPlatDB()
+
+    # act/assert
+    with pytest.raises(ValueError):
+        platdb.create_or_update(Application, {"provider": "aws"})
+
+
+def test_exports_follow_insertion_order():
+    # arrange
+    platdb = InMemoryPlatDB()
+    app_ids = platdb.bulk_upsert(Application, [{"name": f"app{index}"} for index in range(4)])
+    [compute_id] = platdb.bulk_upsert(Compute, [{"address": "1.2.3.4"}])
+    platdb.bulk_connect(Application, [(app_ids[index], app_ids[index + 1], "application_to", None)
+                                      for index in range(3)])
+    platdb.bulk_connect(Compute, [(compute_id, app_ids[0], "applications", None)])
+
+    # act
+    vertices, edges = platdb.get_full_graph_as_json()
+    outgoing, _ = platdb.get_subgraph_as_json(Application, {"name": "app0"}, max_depth=5, direction=OUTGOING)
+
+    # assert
+    assert list(vertices) == app_ids + [compute_id]
+    assert [(edge["start_node"], edge["end_node"]) for edge in edges] == [
+        (app_ids[0], app_ids[1]), (app_ids[1], app_ids[2]), (app_ids[2], app_ids[3]), (compute_id, app_ids[0])]
+    assert list(outgoing) == app_ids
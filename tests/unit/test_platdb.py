@@ -7,25 +7,100 @@
 # DB connection objects that were yielded to the function.
 # pylint: disable=unused-argument
 
+import asyncio
 import datetime
+import io
+import json
 
+import neo4j
 import pytest
 
-from neomodel import ZeroOrMore
+from neo4j.graph import Graph, Node
+from neomodel import MultipleNodesReturned, ZeroOrMore, config, db
+from neomodel.util import OUTGOING
 
 from tests.conftest import neo4j_db_fixtures
 
-from corelib.platdb import Insights, PlatDBNode, StructuredNode
+from corelib.async_platdb import AsyncNeo4jConnection
+from corelib.cache import GraphCache
+from corelib.instrumentation import count_round_trips
+from corelib.platdb import (GRAPH_EDGE,
+                            GRAPH_VERTEX,
+                            Application,
+                            Compute,
+                            GraphDelta,
+                            Insights,
+                            Neo4jConnection,
+                            PlatDBNode,
+                            PlatDBSerializer,
+                            PlatDBTombstone,
+                            Resource,
+                            StructuredNode,
+                            add_write_listener,
+                            remove_write_listener)
+
+
+def _mock_connection(mocker, *results):
+    """A Neo4jConnection whose driver session streams each of `results` from successive run() calls, its
+    transactions run on the session"""
+    connection = Neo4jConnection(uri="bolt://localhost:7687", auth=("neo4j", "neo4j"))
+    connection._driver = mocker.MagicMock()  # pylint: disable=protected-access
+    session = connection._driver.session.return_value.__enter__.return_value  # pylint: disable=protected-access
+    session.begin_transaction.return_value.__enter__.return_value = session
+    session.execute_write.side_effect = lambda work: work(session)
+    session.run.side_effect = [iter(rows) for rows in results]
+    return connection, session
+
+
+class _AsyncResult:
+    def __init__(self, rows):
+        self._rows = rows
+
+    async def __aiter__(self):
+        for row in self._rows:
+            yield row
+
+
+def _mock_async_connection(mocker, *results):
+    """An AsyncNeo4jConnection whose driver sessions return each of `results` from successive run() calls"""
+    connection = AsyncNeo4jConnection(uri="bolt://localhost:7687", auth=("neo4j", "neo4j"))
+    connection._driver = mocker.MagicMock()  # pylint: disable=protected-access
+    session = connection._driver.session.return_value.__aenter__.return_value  # pylint: disable=protected-access
+    transaction = mocker.MagicMock()
+    transaction.__aenter__.return_value = session
+    session.begin_transaction = mocker.AsyncMock(return_value=transaction)
+    session.run = mocker.AsyncMock(side_effect=[_AsyncResult(rows) for rows in results])
+    return connection, session
+
+
+def _full_graph_rows():
+    """app1 -CALLS-> app2, compute1 -RUNS-> app1, as (vertex rows, edge rows)"""
+    graph = Graph()
+    app1 = Node(graph, "4:db:1", 1, ["Application"], {"name": "app1", "uid": "u1"})
+    app2 = Node(graph, "4:db:2", 2, ["Application"], {"name": "app2", "uid": "u2"})
+    compute1 = Node(graph, "4:db:3", 3, ["Compute"], {"name": "compute1", "address": "1.2.3.4", "uid": "u3"})
+
+    vertex_rows = [
+        (app1, ["Application"],
+         [["CALLS", ["Application"], "4:db:2"]],
+         [["RUNS", ["Compute"], "4:db:3"]]),
+        (app2, ["Application"], [], [["CALLS", ["Application"], "4:db:1"]]),
+        (compute1, ["Compute"], [["RUNS", ["Application"], "4:db:1"]], []),
+    ]
+    edge_rows = [
+        ("5:db:1", "4:db:1", "4:db:2", "CALLS", {}),
+        ("5:db:2", "4:db:3", "4:db:1", "RUNS", {}),
+    ]
+    return vertex_rows, edge_rows
 
 
 def test_delete_by_attributes_object_does_not_exist(mocker):
     # arrange
-    mock_nodes = mocker.patch.object(StructuredNode, "nodes")
     attributes = {"name": "nonexistant"}
-    mock_nodes.get.side_effect = PlatDBNode.DoesNotExist(msg=None)
+    mocker.patch.object(db, 'cypher_query', return_value=([[0, []]], None))
 
     # act
-    result = PlatDBNode.delete_by_attributes(attributes=attributes)
+    result = Application.delete_by_attributes(attributes=attributes)
 
     # assert
     assert result is False
@@ -33,36 +108,57 @@ def test_delete_by_attributes_object_does_not_exist(mocker):
 
 def test_delete_by_attributes_object_exists(mocker):
     # arrange
-    attributes = {}
+    attributes = {"name": "a name", "provider": None}
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', return_value=([[1, []]], None))
+    mock_nodes = mocker.patch.object(StructuredNode, "nodes")
 
-    mock_obj = mocker.Mock(spec=PlatDBNode)
-    mock_obj.name = "a name"
-    mock_obj.delete.return_value = True
+    # act
+    result = Application.delete_by_attributes(attributes=attributes)
 
-    mock_nodes = mocker.patch.object(StructuredNode, "nodes")
-    mock_nodes.get.return_value = mock_obj
+    # assert
+    assert result is True
+    mock_nodes.get.assert_not_called()
+    mock_cypher_query.assert_called_once()
+    query, params = mock_cypher_query.call_args.args
+    assert "MATCH (n:Application)" in query
+    assert "WHERE n.name = row.match.name AND n.provider IS NULL" in query
+    assert "DETACH DELETE n" in query
+    assert params == {'batch': [{'match': {'name': 'a name'}}]}
 
-    mock_delete = mocker.patch.object(StructuredNode, "delete",
-                                      return_value=True)
+
+@pytest.mark.parametrize('attributes', [{}, {"not_a_property": 1}])
+def test_delete_by_attributes_invalid_filter(mocker, attributes):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query')
+
+    # act/assert
+    with pytest.raises(ValueError):
+        Application.delete_by_attributes(attributes=attributes)
+    mock_cypher_query.assert_not_called()
+
+
+def test_delete_many_by_attributes_batches(mocker):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', side_effect=lambda query, params: (
+        [[len(params['batch']), []]], None))
+    attributes_list = [{"name": f"app{i}"} for i in range(5)] + [{"name": "app", "provider": "aws"}]
 
     # act
-    result = PlatDBNode.delete_by_attributes(attributes=attributes)
+    count = Application.delete_many_by_attributes(attributes_list, batch_size=3)
 
     # assert
-    mock_delete.assert_called_once()
-    assert result is True
+    assert count == 6
+    assert mock_cypher_query.call_count == 3
 
 
 def test_update_object_does_not_exist(mocker):
     # arrange
     attributes = {"name": "app1"}
     new_attributes = {"name": "new_app1"}
-
-    mock_nodes = mocker.patch.object(StructuredNode, "nodes")
-    mock_nodes.get.side_effect = PlatDBNode.DoesNotExist(msg=None)
+    mocker.patch.object(db, 'cypher_query', return_value=([[0, None]], None))
 
     # act
-    result = PlatDBNode.update(attributes, new_attributes)
+    result = Application.update(attributes, new_attributes)
 
     # assert
     assert result is None
@@ -70,27 +166,141 @@ def test_update_object_does_not_exist(mocker):
 
 def test_update_object_exists(mocker):
     # arrange
-    name_orig, data_orig, rel_orig = "app1", 5, "app2"
-    name_update, data_update, rel_update = "app1", 10, "app10"
-    node_orig = {"name": name_orig, "data": data_orig, "relationship": rel_orig}
-    node_update = {"name": name_update, "data": data_update, "relationship": rel_update}
+    node_orig = {"name": "app1"}
+    node_update = {"name": "app10", "provider": None, "not_a_property": 10}
+    updated = Node(Graph(), "4:db:1", 1, ["Application"], {"name": "app10"})
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', return_value=([[1, updated]], None))
 
-    mock_obj = mocker.Mock(spec=PlatDBNode)
-    mock_obj.name = name_orig
-    mock_obj.data = data_orig
-    mock_obj.relationship = rel_orig
-    mock_obj.save.side_effect = lambda x: None
+    # act
+    obj = Application.update(node_orig, node_update)
 
-    mock_nodes = mocker.patch.object(StructuredNode, "nodes")
-    mock_nodes.get.side_effect = mock_obj
+    # assert
+    mock_cypher_query.assert_called_once()
+    query, params = mock_cypher_query.call_args.args
+    assert "SET n += $update" in query
+    assert params == {'match': {'name': 'app1'}, 'update': {'name': 'app10', 'provider': None}}
+    assert obj.name == "app10"
+    assert obj.element_id == "4:db:1"
+
+
+def test_writes_skip_filters_matching_several_nodes(mocker):
+    # arrange
+    first = Node(Graph(), "4:db:1", 1, ["Compute"], {"platform": "k8s"})
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', side_effect=[
+        ([[2, None]], None),
+        ([[0, [{'platform': 'k8s'}]]], None),
+        ([[1, []]], None),
+        ([[0, [{'platform': 'k8s'}]]], None),
+        ([[1, first]], None),
+    ])
+
+    # act/assert
+    with pytest.raises(MultipleNodesReturned):
+        Compute.update({"platform": "k8s"}, {"name": "compute1"})
+    with pytest.raises(MultipleNodesReturned, match="platform"):
+        Compute.update_many([({"platform": "k8s"}, {"name": "compute1"}), ({"address": "1.2.3.4"}, {})])
+    with pytest.raises(MultipleNodesReturned):
+        Compute.delete_by_attributes({"platform": "k8s"})
+    assert Compute.update({"address": "1.2.3.4"}, {"platform": "k8s"}).element_id == "4:db:1"
+    query = mock_cypher_query.call_args_list[0].args[0]
+    assert "WITH collect(n) AS matches" in query
+    assert "CASE size(matches) WHEN 1 THEN matches[0] END AS n" in query
+    assert "LIMIT 1" not in query
+
+
+def test_update_many_batches(mocker):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', side_effect=lambda query, params: (
+        [[len(params['batch']), []]], None))
+    updates = [({"name": f"app{i}"}, {"provider": "aws"}) for i in range(4)]
+
+    # act
+    count = Application.update_many(updates, batch_size=2)
+
+    # assert
+    assert count == 4
+    assert mock_cypher_query.call_count == 2
+    _, params = mock_cypher_query.call_args.args
+    assert params['batch'][0] == {'match': {'name': 'app2'}, 'update': {'provider': 'aws'}}
+
+
+def test_dns_node_updates_keep_dns_name_lookups(mocker):
+    # arrange
+    updated = Node(Graph(), "4:db:1", 1, ["Resource"], {"address": "10.0.0.1", "dns_names": ["db.local"]})
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', side_effect=[
+        ([[1, updated]], None), ([[1, []]], None), ([[1, None]], None)])
+
+    # act
+    Resource.update({"address": "10.0.0.1"}, {"dns_names": ["db.local"]})
+    Resource.update_many([({"address": "10.0.0.1"}, {"dns_names": ["db.local"]})])
+    Application.update({"name": "app1"}, {"provider": "aws"})
+
+    # assert
+    resource_query, resource_many_query, app_query = [call.args[0] for call in mock_cypher_query.call_args_list]
+    assert "MERGE (lookup:PlatDBDnsName {key: 'Resource:' + name})" in resource_query
+    assert "MERGE (lookup:PlatDBDnsName {key: 'Resource:' + name})" in resource_many_query
+    assert "PlatDBDnsName" not in app_query
+
+
+def test_claim_stale_claims_in_one_query(mocker):
+    # arrange
+    claimed = Node(Graph(), "4:db:1", 1, ["Compute"], {"address": "1.2.3.4", "profile_lease_token": "t"})
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', return_value=([[claimed]], None))
+
+    # act
+    lease = Compute.claim_stale(older_than=datetime.timedelta(hours=1), lease=datetime.timedelta(minutes=5), limit=10)
+
+    # assert
+    mock_cypher_query.assert_called_once()
+    query, params = mock_cypher_query.call_args.args
+    assert "SET n._claim_lock = true" in query
+    assert query.count("coalesce(n.profile_lock_time, 0) < now - $lease") == 2
+    assert params == {'older_than': 3600.0, 'lease': 300.0, 'limit': 10, 'token': lease.token}
+    assert [node.address for node in lease.nodes] == ["1.2.3.4"]
+
+
+@pytest.mark.parametrize('arguments', [
+    {'older_than': datetime.timedelta(hours=1), 'lease': datetime.timedelta(minutes=5), 'limit': 0},
+    {'older_than': datetime.timedelta(hours=1), 'lease': datetime.timedelta(0), 'limit': 10},
+])
+def test_claim_stale_validates_arguments(mocker, arguments):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query')
+
+    # act/assert
+    with pytest.raises(ValueError):
+        Compute.claim_stale(**arguments)
+    mock_cypher_query.assert_not_called()
+
+
+def test_renew_and_release_leases_match_token(mocker):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', return_value=([[2]], None))
+
+    # act
+    renewed = Compute.renew_leases("token")
+    released = Compute.release_leases("token", element_ids=iter(["4:db:1"]), profiled=True)
+
+    # assert
+    (renew_query, renew_params), (release_query, release_params) = [
+        call.args for call in mock_cypher_query.call_args_list]
+    assert (renewed, released) == (2, 2)
+    assert renew_params == {'token': "token", 'element_ids': None}
+    assert release_params == {'token': "token", 'element_ids': ["4:db:1"]}
+    assert "{profile_lease_token: $token}" in renew_query
+    assert "n.profile_timestamp = timestamp() / 1000.0" in release_query
+
+
+def test_insights_update_sets_updated(mocker):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', return_value=([[0, None]], None))
 
     # act
-    obj = PlatDBNode.update(node_orig, node_update)
+    Insights.update({"note": "a note"}, {"note": "another note"})
 
     # assert
-    assert obj.name == name_update
-    assert obj.data == data_update
-    assert obj.relationship == rel_update
+    _, params = mock_cypher_query.call_args.args
+    assert isinstance(params['update']['updated'], float)
 
 
 def test_insights_save(mocker):
@@ -109,6 +319,164 @@ def test_insights_save(mocker):
     assert insight.updated.tzinfo is datetime.timezone.utc
 
 
+def test_writes_set_modified_timestamp(mocker):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', side_effect=[
+        ([[0, None]], None), ([[1, []]], None), ([["4:db:1"]], None), ([[1]], None)])
+
+    # act
+    Application.update({"name": "app1"}, {"provider": "aws"})
+    Application.update_many([({"name": "app1"}, {"provider": "aws"})])
+    Application.bulk_upsert([{"name": "app1"}])
+    Application.bulk_connect([("4:db:1", "4:db:2", "application_to", None)])
+
+    # assert
+    queries = [call.args[0] for call in mock_cypher_query.call_args_list]
+    assert all("n.modified_timestamp = timestamp() / 1000.0" in query for query in queries[:3])
+    assert "source.modified_timestamp = timestamp() / 1000.0" in queries[3]
+    assert "target.modified_timestamp = timestamp() / 1000.0" in queries[3]
+
+
+def test_creates_set_a_uid(mocker):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', side_effect=[
+        ([["4:db:1"]], None), ([[0, "4:db:2"]], None)])
+    app = Application(name="app1")
+
+    # act
+    Application.bulk_upsert([{"name": "app1"}])
+    Resource.bulk_upsert([{"address": "10.0.0.1"}])
+    app.pre_save()
+
+    # assert
+    merge_query, upsert_query = [call.args[0] for call in mock_cypher_query.call_args_list]
+    assert "ON CREATE SET n = params.create, n.uid = randomUUID()" in merge_query
+    assert "SET n = row.create, n.uid = randomUUID()" in upsert_query
+    assert app.uid is not None
+
+
+def test_assign_uids_in_batches(mocker):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', side_effect=[([[2]], None), ([[1]], None)])
+
+    # act
+    assigned = Application.assign_uids(batch_size=2)
+
+    # assert
+    assert assigned == 3
+    query, params = mock_cypher_query.call_args.args
+    assert "WHERE n.uid IS NULL" in query
+    assert params == {'limit': 2}
+
+
+def test_assign_dns_name_lookups_in_batches(mocker):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', side_effect=[
+        ([[2, "4:db:2"]], None), ([[2, "4:db:5"]], None), ([[0, None]], None)])
+
+    # act
+    assigned = Resource.assign_dns_name_lookups(batch_size=2)
+
+    # assert
+    assert assigned == 4
+    params = [call.args[1] for call in mock_cypher_query.call_args_list]
+    assert params == [{'after': '', 'limit': 2}, {'after': "4:db:2", 'limit': 2}, {'after': "4:db:5", 'limit': 2}]
+    query = mock_cypher_query.call_args.args[0]
+    assert "ORDER BY elementId(n)" in query
+    assert "MERGE (lookup:PlatDBDnsName {key: 'Resource:' + name})" in query
+
+
+def test_dns_node_create_writes_dns_name_lookups(mocker):
+    # arrange
+    created = Node(Graph(), "4:db:1", 1, ["Resource"], {"dns_names": ["db.local"]})
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', side_effect=[([[created]], None), ([[1]], None)])
+
+    # act
+    [resource] = Resource.create({"dns_names": ["db.local"]})
+
+    # assert
+    assert resource.element_id == "4:db:1"
+    query, params = mock_cypher_query.call_args.args
+    assert "MERGE (lookup:PlatDBDnsName {key: 'Resource:' + name})" in query
+    assert params == {'element_ids': ["4:db:1"]}
+
+
+def test_save_sets_modified_timestamp_on_the_server(mocker):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', return_value=([["4:db:1", 1700000000.0]], None))
+    mocker.patch.object(db, 'parse_element_id', return_value="4:db:1")
+    app = Application(name="app1")
+
+    # act
+    app.save()
+    app.save()
+
+    # assert
+    (create_query, create_params), (update_query, update_params) = \
+        [call.args for call in mock_cypher_query.call_args_list]
+    assert create_query.strip().startswith("CREATE (n:Application $create_params)")
+    assert update_query.strip().startswith("MATCH (n) WHERE elementId(n) = $self")
+    for query in (create_query, update_query):
+        assert "SET n.modified_timestamp = timestamp() / 1000.0" in query
+    assert "modified_timestamp" not in create_params['create_params']
+    assert create_params['create_params']['uid'] == app.uid is not None
+    assert (update_params["self"], update_params["name"]) == ("4:db:1", "app1")
+    assert app.element_id == "4:db:1"
+    assert app.modified_timestamp == datetime.datetime(2023, 11, 14, 22, 13, 20, tzinfo=datetime.timezone.utc)
+
+
+def test_save_and_delete_take_one_round_trip(mocker):
+    # arrange
+    mocker.patch.object(type(db), 'cypher_query', return_value=([["4:db:1", 1700000000.0]], None))
+    mocker.patch.object(db, 'parse_element_id', return_value="4:db:1")
+    resource = Resource(dns_names=["db.example.com"])
+
+    # act
+    with count_round_trips() as round_trips:
+        resource.save()
+        resource.save()
+        resource.delete()
+
+    # assert
+    assert [event.operation for event in round_trips.events] == ["Resource.save", "Resource.save", "Resource.delete"]
+    assert resource.deleted
+
+
+def test_deletes_leave_tombstones(mocker):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', return_value=([[1, []]], None))
+    mocker.patch.object(db, 'parse_element_id', return_value="4:db:1")
+    app = Application(name="app1")
+    app.element_id_property = "4:db:1"
+
+    # act
+    Application.delete_by_attributes({"name": "app1"})
+    app.delete()
+
+    # assert
+    (delete_query, _), (node_delete_query, node_delete_params) = \
+        [call.args for call in mock_cypher_query.call_args_list]
+    for query in (delete_query, node_delete_query):
+        assert "CREATE (:PlatDBTombstone {" in query
+        assert "MATCH (lookup:PlatDBDnsName {owner: elementId(n)})" in query
+        assert "SET neighbour.modified_timestamp = timestamp() / 1000.0" in query
+    assert "DETACH DELETE n" in node_delete_query
+    assert node_delete_params == {"self": "4:db:1"}
+
+
+def test_purge_tombstones(mocker):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', return_value=([[3]], None))
+    before = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+
+    # act
+    result = PlatDBTombstone.purge(before)
+
+    # assert
+    assert result == 3
+    assert mock_cypher_query.call_args.args[1] == {'before': before.timestamp()}
+
+
 @pytest.mark.parametrize('cls,attrs,updated_attrs', neo4j_db_fixtures)
 def test_platdb_node_to_dict_for_all_classes(mocker, cls, attrs, updated_attrs):
     obj = cls(**attrs)
@@ -125,3 +493,1044 @@ def test_platdb_node_to_dict_for_all_classes(mocker, cls, attrs, updated_attrs):
             # This could be a relationship or a None object if it was a 
             # class value that was left blank
             assert value in (rel, None), f'key: {key}, value: {value}'
+
+
+def test_iter_full_graph_yields_vertices_then_edges(mocker):
+    # arrange
+    connection, session = _mock_connection(mocker, *_full_graph_rows())
+
+    # act
+    records = list(connection.iter_full_graph(fetch_size=10))
+
+    # assert
+    connection._driver.session.assert_called_once_with(  # pylint: disable=protected-access
+        database=None, fetch_size=10, default_access_mode=neo4j.READ_ACCESS)
+    assert [(kind, key) for kind, key, _ in records] == [
+        (GRAPH_VERTEX, "4:db:1"),
+        (GRAPH_VERTEX, "4:db:2"),
+        (GRAPH_VERTEX, "4:db:3"),
+        (GRAPH_EDGE, "5:db:1"),
+        (GRAPH_EDGE, "5:db:2"),
+    ]
+    assert records[0][2]['name'] == 'app1'
+    assert records[3][2] == {"start_node": "4:db:1", "end_node": "4:db:2", "type": "CALLS", "properties": {}}
+
+
+def test_iter_full_graph_scans_labels_once(mocker):
+    # arrange
+    _patch_graph_phases(mocker)
+    connection, session = _mock_connection(mocker, *_full_graph_rows())
+
+    # act
+    list(connection.iter_full_graph())
+
+    # assert
+    (vertices_query, *_), (edges_query, *_) = [call.args for call in session.run.call_args_list]
+    assert "MATCH (vertex:`Application`)" in vertices_query
+    assert "MATCH (vertex:`Compute`)" in vertices_query
+    assert "EXISTS" not in vertices_query
+    assert "properties(edge)" in edges_query
+    assert "RETURN elementId(edge)" in edges_query
+
+
+def test_iter_full_graph_uses_connection_settings(mocker):
+    # arrange
+    connection, _ = _mock_connection(mocker, *_full_graph_rows())
+    connection._database = 'platdb'  # pylint: disable=protected-access
+    connection._fetch_size = 250  # pylint: disable=protected-access
+
+    # act
+    list(connection.iter_full_graph())
+
+    # assert
+    connection._driver.session.assert_called_once_with(  # pylint: disable=protected-access
+        database='platdb', fetch_size=250, default_access_mode=neo4j.READ_ACCESS)
+
+
+def test_unit_of_work_collapses_and_orders_writes(mocker):
+    # arrange
+    connection, session = _mock_connection(mocker, [["4:db:1"]], [[0, "4:db:2"]], [[1, []]], [[1]])
+
+    # act
+    with connection.unit_of_work() as work:
+        work.upsert(Compute, {"address": "1.2.3.4", "platform": "k8s"})
+        work.connect(Compute, {"address": "1.2.3.4"}, {"name": "app1"}, "applications", {"weight": 1})
+        work.upsert(Compute, {"address": "1.2.3.4", "name": "compute1"})
+        work.upsert(Resource, {"address": "10.0.0.1"})
+        work.upsert(Resource, {"address": "10.0.0.1", "dns_names": ["db.local"]})
+        work.update(Compute, {"address": "1.2.3.4"}, {"protocol": "HTTP"})
+        work.connect(Compute, {"address": "1.2.3.4"}, {"name": "app1"}, "applications", {"label": "x"})
+        assert len(work) == 4
+
+    # assert
+    (compute_query, compute_params), (resource_query, resource_params), (update_query, _), (connect_query, connect_params) = [
+        call.args for call in session.run.call_args_list]
+    assert "MERGE" in compute_query and "UNWIND $batch" in resource_query and "SET n += row.update" in update_query
+    assert compute_params['merge_params'][0]['update'] == {'address': '1.2.3.4', 'platform': 'k8s', 'name': 'compute1'}
+    assert resource_params['batch'][0]['dns_names'] == ["db.local"]
+    assert connect_params['batch'] == [
+        {'source': {'address': '1.2.3.4'}, 'target': {'name': 'app1'}, 'properties': {'weight': 1, 'label': 'x'}}]
+    assert "MERGE (source)-[edge:RUNS]->(target)" in connect_query
+    assert session.execute_write.call_count == 4
+
+
+def test_unit_of_work_runs_chunks_in_managed_transactions(mocker):
+    # arrange
+    connection, session = _mock_connection(mocker, [[1, []]], [[1, []]])
+    # the driver runs the transaction function again after a transient error
+    session.execute_write.side_effect = lambda work: [work(session), work(session)][-1]
+
+    # act
+    with connection.unit_of_work() as work:
+        work.update(Application, {"name": "app1"}, {"provider": "aws"})
+
+    # assert
+    assert session.execute_write.call_count == 1
+    assert session.run.call_count == 2
+    assert session.run.call_args_list[0] == session.run.call_args_list[1]
+    session.begin_transaction.assert_not_called()
+
+
+def test_unit_of_work_raises_what_the_driver_gives_up_on(mocker):
+    # arrange
+    connection, session = _mock_connection(mocker)
+    session.execute_write.side_effect = neo4j.exceptions.SessionExpired()
+    work = connection.unit_of_work()
+    work.update(Application, {"name": "app1"}, {"provider": "aws"})
+
+    # act/assert
+    with pytest.raises(neo4j.exceptions.SessionExpired):
+        work.flush()
+    assert session.run.call_count == 0
+    assert len(work) == 0
+
+
+def test_unit_of_work_flushes_at_threshold_and_discards_on_error(mocker):
+    # arrange
+    connection, session = _mock_connection(mocker, [["4:db:1"], ["4:db:2"]])
+
+    # act
+    with pytest.raises(RuntimeError):
+        with connection.unit_of_work(max_buffered=2) as work:
+            work.upsert(Application, {"name": "app1"})
+            work.upsert(Application, {"name": "app2"})
+            work.upsert(Application, {"name": "app3"})
+            raise RuntimeError("profiling failed")
+
+    # assert
+    session.run.assert_called_once()
+    assert len(work) == 0
+    with pytest.raises(ValueError):
+        work.connect(Application, "4:db:1", "4:db:2", "not_a_relationship")
+
+
+def test_open_passes_driver_settings(mocker):
+    # arrange
+    mock_driver = mocker.patch.object(neo4j.GraphDatabase, 'driver')
+    mock_set_connection = mocker.patch.object(db, 'set_connection')
+    mocker.patch.object(config, 'DATABASE_NAME', None)
+    connection = Neo4jConnection(uri="neo4j://localhost:7687", auth=("neo4j", "neo4j"), database='platdb',
+                                 max_connection_pool_size=20, connection_acquisition_timeout=5.0)
+
+    # act
+    connection.open()
+
+    # assert
+    mock_driver.assert_called_once_with("neo4j://localhost:7687", auth=("neo4j", "neo4j"),
+                                        max_connection_pool_size=20, connection_acquisition_timeout=5.0)
+    mock_set_connection.assert_called_once_with("neo4j://localhost:7687", mock_driver.return_value)
+    assert config.DATABASE_NAME == 'platdb'
+
+
+def test_open_uses_driver_defaults(mocker):
+    # arrange
+    mock_driver = mocker.patch.object(neo4j.GraphDatabase, 'driver')
+    mocker.patch.object(db, 'set_connection')
+    mocker.patch.object(config, 'DATABASE_NAME', 'configured')
+    connection = Neo4jConnection(uri="bolt://localhost:7687", auth=("neo4j", "neo4j"))
+
+    # act
+    connection.open()
+
+    # assert
+    mock_driver.assert_called_once_with("bolt://localhost:7687", auth=("neo4j", "neo4j"))
+    assert config.DATABASE_NAME == 'configured'
+
+
+def test_close_restores_database_name(mocker):
+    # arrange
+    mocker.patch.object(neo4j.GraphDatabase, 'driver')
+    mocker.patch.object(db, 'set_connection')
+    mocker.patch.object(config, 'DATABASE_NAME', 'configured')
+    connection = Neo4jConnection(uri="bolt://localhost:7687", auth=("neo4j", "neo4j"), database='platdb')
+
+    # act
+    connection.open()
+    opened = config.DATABASE_NAME
+    connection.close()
+
+    # assert
+    assert (opened, config.DATABASE_NAME) == ('platdb', 'configured')
+
+
+def test_get_full_graph_as_json_round_trips(mocker):
+    # arrange
+    connection, session = _mock_connection(mocker, *_full_graph_rows())
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query')
+
+    # act
+    connection.get_full_graph_as_json()
+
+    # assert
+    assert session.run.call_count == 2
+    mock_cypher_query.assert_not_called()
+
+
+def test_get_full_graph_as_json_relationship_ids(mocker):
+    # arrange
+    connection, _ = _mock_connection(mocker, *_full_graph_rows())
+
+    # act
+    vertices, edges = connection.get_full_graph_as_json()
+
+    # assert
+    assert set(vertices) == {"4:db:1", "4:db:2", "4:db:3"}
+    assert vertices["4:db:3"]['type'] == 'Compute'
+    assert vertices["4:db:3"]['applications'] == ["4:db:1"]
+    assert vertices["4:db:1"]['application_to'] == ["4:db:2"]
+    assert vertices["4:db:1"]['compute'] == ["4:db:3"]
+    assert vertices["4:db:1"]['application_from'] == []
+    assert vertices["4:db:2"]['application_to'] == []
+    assert [edge['type'] for edge in edges] == ['CALLS', 'RUNS']
+
+
+def test_write_full_graph_ndjson(mocker):
+    # arrange
+    connection, _ = _mock_connection(mocker, *_full_graph_rows())
+    fp = io.StringIO()
+
+    # act
+    count = connection.write_full_graph_ndjson(fp)
+
+    # assert
+    lines = [json.loads(line) for line in fp.getvalue().splitlines()]
+    assert count == len(lines) == 5
+    assert lines[0]['kind'] == GRAPH_VERTEX
+    assert lines[0]['data']['name'] == 'app1'
+
+
+@pytest.mark.parametrize('cls,attrs,updated_attrs', neo4j_db_fixtures)
+def test_serializer_node_to_dict_matches_inflate(cls, attrs, updated_attrs):
+    # arrange
+    properties = cls.deflate(attrs, skip_empty=True)
+    properties['profile_timestamp'] = 1700000000.0
+    properties['profile_warnings'] = '{"timeout": "slow"}'
+    vertex = Node(Graph(), "4:db:1", 1, [cls.__label__], properties)
+    serializer = PlatDBSerializer.for_class(cls)
+    relationship_ids = serializer.relationship_ids([], [])
+
+    # act
+    platdb_ht = serializer.node_to_dict(vertex, [], [])
+
+    # assert
+    assert platdb_ht == cls.inflate(vertex).platdbnode_to_dict(relationship_ids=relationship_ids)
+    assert list(platdb_ht) == sorted(platdb_ht)
+    assert platdb_ht['profile_timestamp'] == datetime.datetime.fromtimestamp(1700000000, datetime.timezone.utc)
+    assert platdb_ht['profile_warnings'] == {"timeout": "slow"}
+    assert platdb_ht['profile_errors'] == {}
+
+
+def test_serializer_for_label_is_cached():
+    assert PlatDBSerializer.for_label('Insights') is PlatDBSerializer.for_class(Insights)
+    assert PlatDBSerializer.for_class(Insights).platdb_cls is Insights
+
+    with pytest.raises(ValueError):
+        PlatDBSerializer.for_label('PlatDBNode')
+
+
+def test_serializer_registry_builds_each_serializer_once(mocker):
+    # arrange
+    PlatDBSerializer.labels()
+    mock_init = mocker.spy(PlatDBSerializer, '__init__')
+
+    # act
+    labels = PlatDBSerializer.labels()
+
+    # assert
+    assert 'Insights' in labels
+    assert mock_init.call_count == 0
+
+
+def test_get_full_graph_as_json_does_not_inflate(mocker):
+    # arrange
+    connection, _ = _mock_connection(mocker, *_full_graph_rows())
+    mock_inflate = mocker.patch.object(StructuredNode, 'inflate')
+
+    # act
+    vertices, _ = connection.get_full_graph_as_json()
+
+    # assert
+    assert len(vertices) == 3
+    mock_inflate.assert_not_called()
+
+
+def test_dns_node_create_or_update_single_query(mocker):
+    # arrange
+    existing = Node(Graph(), "4:db:1", 1, ["Resource"], {"dns_names": ["db.example.com"], "name": "db"})
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', return_value=([[0, existing]], None))
+    mock_nodes = mocker.patch.object(StructuredNode, "nodes")
+    mock_save = mocker.patch.object(StructuredNode, "save")
+
+    # act
+    result = Resource.create_or_update({"dns_names": ["db.example.com"], "name": "db", "protocol": None})
+
+    # assert
+    mock_cypher_query.assert_called_once()
+    mock_nodes.all.assert_not_called()
+    mock_save.assert_not_called()
+    query, params = mock_cypher_query.call_args.args
+    assert "lookup.key IN [name IN row.dns_names | 'Resource:' + name]" in query
+    assert "MERGE (lookup:PlatDBDnsName {key: 'Resource:' + name})" in query
+    assert params['batch'][0]['dns_names'] == ["db.example.com"]
+    assert params['batch'][0]['update']['protocol'] is None
+    assert result[0].element_id == "4:db:1"
+    assert result[0].name == "db"
+
+
+def test_dns_node_find_by_dns_names_in_cypher(mocker):
+    # arrange
+    existing = Node(Graph(), "4:db:1", 1, ["Resource"], {"dns_names": ["db.example.com", "db2.example.com"]})
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', return_value=([[existing]], None))
+
+    # act
+    result = Resource.find_by_dns_names(["db.example.com"])
+
+    # assert
+    query, params = mock_cypher_query.call_args.args
+    assert "WHERE lookup.key IN [name IN $dns_names | 'Resource:' + name]" in query
+    assert 'MATCH (n:Resource)' in query
+    assert 'any(' not in query
+    assert params == {'dns_names': ["db.example.com"]}
+    assert result.element_id == "4:db:1"
+
+
+def test_dns_node_save_updates_dns_name_lookups(mocker):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', return_value=([["4:db:1", 1700000000.0]], None))
+    mocker.patch.object(db, 'parse_element_id', return_value="4:db:1")
+    resource = Resource(dns_names=["db.example.com"])
+    resource.element_id_property = "4:db:1"
+
+    # act
+    resource.save()
+
+    # assert
+    query, params = mock_cypher_query.call_args.args
+    assert "WHERE NOT stale.name IN coalesce(n.dns_names, [])" in query
+    assert "SET lookup.name = name, lookup.owner = elementId(n)" in query
+    assert (params["self"], params["dns_names"]) == ("4:db:1", ["db.example.com"])
+
+
+def test_dns_node_find_by_dns_names_no_match(mocker):
+    # arrange
+    mocker.patch.object(db, 'cypher_query', return_value=([], None))
+
+    # act
+    result = Resource.find_by_dns_names(["nope.example.com"])
+
+    # assert
+    assert result is None
+
+
+def test_bulk_upsert_one_query_per_batch(mocker):
+    # arrange
+    mocker.patch.object(db, 'get_id_method', return_value='elementId')
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', side_effect=lambda query, params: (
+        [[f"4:db:{p['create']['name']}"] for p in params['merge_params']], None))
+    records = [{"name": f"app{i}", "profile_lock_time": None} for i in range(5)]
+
+    # act
+    element_ids = Application.bulk_upsert(records, batch_size=2)
+
+    # assert
+    assert mock_cypher_query.call_count == 3
+    assert element_ids == [f"4:db:app{i}" for i in range(5)]
+    query, params = mock_cypher_query.call_args_list[0].args
+    assert query.startswith("UNWIND $merge_params")
+    assert "RETURN elementId(n)" in query
+    assert params['merge_params'][0]['create'] == {
+        'name': 'app0', 'profile_warnings': '{}', 'profile_errors': '{}'}
+    assert params['merge_params'][0]['update'] == {'name': 'app0', 'profile_lock_time': None}
+
+
+def test_bulk_upsert_clears_none_properties(mocker):
+    # arrange
+    mocker.patch.object(db, 'get_id_method', return_value='elementId')
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', return_value=([["4:db:1"]], None))
+
+    # act
+    Compute.bulk_upsert([{"address": "1.2.3.4", "name": None, "platform": "k8s"}])
+
+    # assert
+    _, params = mock_cypher_query.call_args.args
+    assert params['merge_params'][0]['create'] == {
+        'address': '1.2.3.4', 'platform': 'k8s', 'profile_warnings': '{}', 'profile_errors': '{}'}
+    assert params['merge_params'][0]['update'] == {'address': '1.2.3.4', 'name': None, 'platform': 'k8s'}
+
+
+def test_create_or_update_single_query(mocker):
+    # arrange
+    returned = [[Node(Graph(), f"4:db:{i}", i, ["Application"], {"name": f"app{i}"})] for i in range(3)]
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', return_value=(returned, None))
+    mock_save = mocker.patch.object(StructuredNode, "save")
+
+    # act
+    instances = Application.create_or_update(*[{"name": f"app{i}", "profile_lock_time": None} for i in range(3)])
+
+    # assert
+    mock_cypher_query.assert_called_once()
+    mock_save.assert_not_called()
+    query, params = mock_cypher_query.call_args.args
+    assert "ON MATCH SET n += params.update" in query
+    assert params['merge_params'][2]['update'] == {'name': 'app2', 'profile_lock_time': None}
+    assert [instance.name for instance in instances] == ['app0', 'app1', 'app2']
+
+
+def test_dns_node_bulk_upsert_combines_matching_records(mocker):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', side_effect=lambda query, params: (
+        [[row['index'], f"4:db:{row['index']}"] for row in params['batch']], None))
+    records = [
+        {"address": "1.2.3.4", "name": "first"},
+        {"dns_names": ["db.example.com"], "name": "second"},
+        {"address": "1.2.3.4", "dns_names": ["db.example.com"], "name": "third"},
+        {"dns_names": ["db.example.com"], "profile_lock_time": None},
+    ]
+
+    # act
+    element_ids = Resource.bulk_upsert(records)
+
+    # assert
+    assert mock_cypher_query.call_count == 1
+    assert element_ids == ["4:db:0", "4:db:1", "4:db:0", "4:db:0"]
+    _, params = mock_cypher_query.call_args.args
+    assert [row['create']['name'] for row in params['batch']] == ['third', 'second']
+    assert params['batch'][0]['update']['profile_lock_time'] is None
+    assert 'profile_lock_time' not in params['batch'][1]['update']
+
+
+def test_dns_node_bulk_upsert_requires_natural_key(mocker):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query')
+
+    # act/assert
+    with pytest.raises(Exception, match='address or dns_names'):
+        Resource.bulk_upsert([{"name": "nameless"}])
+    mock_cypher_query.assert_not_called()
+
+
+def test_reconcile_duplicates_merges_connected_groups(mocker):
+    # arrange
+    properties = {
+        "4:db:1": {"address": "10.0.0.1", "modified_timestamp": 3.0},
+        "4:db:2": {"dns_names": ["db.local"], "name": "db", "modified_timestamp": 2.0},
+        "4:db:3": {"address": "10.0.0.3", "dns_names": ["db.local", "db2.local"], "protocol": "TCP",
+                   "modified_timestamp": 1.0},
+        "4:db:4": {"dns_names": ["cache.local"]},
+    }
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', side_effect=[
+        ([[["4:db:1", "4:db:3"]], [["4:db:2", "4:db:3"]], [["4:db:4", "4:db:5"]]], None),
+        ([[element_id, properties[element_id]] for element_id in ("4:db:1", "4:db:2", "4:db:3")], None),
+        ([[2]], None),
+        ([["4:db:4", properties["4:db:4"]]], None),
+    ])
+
+    # act
+    merged = Resource.reconcile_duplicates(batch_size=1)
+
+    # assert
+    assert merged == 2
+    assert mock_cypher_query.call_count == 4
+    _, (_, read_params), (write_query, write_params), (_, second_read_params) = [
+        call.args for call in mock_cypher_query.call_args_list]
+    assert read_params == {'element_ids': ["4:db:1", "4:db:2", "4:db:3"]}
+    assert write_params == {'groups': [{
+        'survivor': "4:db:1",
+        'duplicates': ["4:db:2", "4:db:3"],
+        'update': {'dns_names': ["db.local", "db2.local"], 'name': "db", 'protocol': "TCP"},
+    }]}
+    assert "MERGE (survivor)<-[new:`USES`]-(other)" in write_query
+    assert "DETACH DELETE n" in write_query
+    assert "MERGE (lookup:PlatDBDnsName {key: 'Resource:' + name})" in write_query
+    assert second_read_params == {'element_ids': ["4:db:4", "4:db:5"]}
+
+
+def test_reconcile_duplicates_skips_groups_deleted_meanwhile(mocker):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', side_effect=[
+        ([[["4:db:1", "4:db:2"]], [["4:db:3", "4:db:4"]]], None),
+        ([["4:db:3", {"address": "10.0.0.3"}]], None),
+    ])
+
+    # act
+    merged = Resource.reconcile_duplicates()
+
+    # assert
+    assert merged == 0
+    assert mock_cypher_query.call_count == 2
+
+
+def test_reconcile_duplicates_validates_batch_size(mocker):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query')
+
+    # act/assert
+    with pytest.raises(ValueError):
+        Resource.reconcile_duplicates(batch_size=0)
+    mock_cypher_query.assert_not_called()
+
+
+def test_bulk_connect_one_query_per_batch(mocker):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', side_effect=lambda query, params: (
+        [[len(params['batch'])]], None))
+    edges = [({"address": f"10.0.0.{i}"}, {"name": f"app{i}"}, 'applications', None) for i in range(3)]
+    edges.append(("4:db:1", "4:db:2", 'applications', {"weight": 1}))
+
+    # act
+    count = Compute.bulk_connect(edges, batch_size=2)
+
+    # assert
+    assert count == 4
+    assert mock_cypher_query.call_count == 3
+    by_key_query, params = mock_cypher_query.call_args_list[0].args
+    assert "MATCH (source:Compute {address: row.source.address})" in by_key_query
+    assert "MATCH (target:Application {name: row.target.name})" in by_key_query
+    assert "MERGE (source)-[edge:RUNS]->(target)" in by_key_query
+    assert params['batch'][0] == {'source': {'address': '10.0.0.0'}, 'target': {'name': 'app0'}, 'properties': {}}
+    by_id_query, params = mock_cypher_query.call_args_list[2].args
+    assert "WHERE elementId(source) = row.source" in by_id_query
+    assert params['batch'] == [{'source': "4:db:1", 'target': "4:db:2", 'properties': {"weight": 1}}]
+
+
+def test_bulk_connect_relationship_from(mocker):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', return_value=([[1]], None))
+
+    # act
+    Application.bulk_connect([({"name": "app1"}, {"address": "1.2.3.4"}, 'compute', None)])
+
+    # assert
+    query, _ = mock_cypher_query.call_args.args
+    assert "MERGE (source)<-[edge:RUNS]-(target)" in query
+
+
+@pytest.mark.parametrize('edge', [
+    ({"name": "app1"}, {"name": "app2"}, 'not_a_relationship', None),
+    ({"name": "app1"}, {"not_a_property": "app2"}, 'application_to', None),
+])
+def test_bulk_connect_validates_edges(mocker, edge):
+    # arrange
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query')
+
+    # act/assert
+    with pytest.raises(ValueError):
+        Application.bulk_connect([edge])
+    mock_cypher_query.assert_not_called()
+
+
+def test_async_get_full_graph_as_json(mocker):
+    # arrange
+    connection, session = _mock_async_connection(mocker, *_full_graph_rows())
+    sync_connection, _ = _mock_connection(mocker, *_full_graph_rows())
+
+    # act
+    vertices, edges = asyncio.run(connection.get_full_graph_as_json())
+
+    # assert
+    assert session.run.call_count == 2
+    assert (vertices, edges) == sync_connection.get_full_graph_as_json()
+
+
+def _patch_graph_phases(mocker):
+    mocker.patch.object(PlatDBSerializer, 'labels', return_value=['Application', 'Compute'])
+    mocker.patch.object(PlatDBSerializer, 'relation_types', return_value=['CALLS', 'RUNS'])
+
+
+def _graph_page_rows():
+    """_full_graph_rows() as GRAPH_PAGE_VERTICES_QUERY rows, each vertex with the edges starting at it"""
+    vertex_rows, edge_rows = _full_graph_rows()
+    return [row + ([[end_node, edge_type, properties] for _, start_node, end_node, edge_type, properties in edge_rows
+                    if start_node == row[0].element_id],)
+            for row in vertex_rows]
+
+
+def test_get_graph_page_resumes_from_cursor(mocker):
+    # arrange
+    _patch_graph_phases(mocker)
+    app1, app2, compute1 = _graph_page_rows()
+    connection, session = _mock_connection(mocker, [app1, app2], [], [compute1])
+    _, full_edges = _mock_connection(mocker, *_full_graph_rows())[0].get_full_graph_as_json()
+
+    # act
+    pages = []
+    cursor = None
+    for _ in range(2):
+        vertices, edges, cursor = connection.get_graph_page(cursor, page_size=2)
+        pages.append((list(vertices), edges, cursor is None))
+
+    # assert
+    assert pages == [(["4:db:1", "4:db:2"], [full_edges[0]], False), (["4:db:3"], [full_edges[1]], True)]
+    params = [call.args[1] for call in session.run.call_args_list]
+    assert params == [
+        {"after": "", "label": "Application", "limit": 2},
+        {"after": "u2", "label": "Application", "limit": 2},
+        {"after": "", "label": "Compute", "limit": 2},
+    ]
+    query = session.run.call_args.args[0]
+    assert "WHERE vertex.uid > $after" in query and "ORDER BY vertex.uid" in query
+    assert "elementId(vertex) >" not in query
+
+
+def test_get_graph_page_matches_full_graph(mocker):
+    # arrange
+    _patch_graph_phases(mocker)
+    app1, app2, compute1 = _graph_page_rows()
+    connection, _ = _mock_connection(mocker, [app1, app2], [compute1])
+    full_vertices, full_edges = _mock_connection(mocker, *_full_graph_rows())[0].get_full_graph_as_json()
+
+    # act
+    vertices, edges, cursor = connection.get_graph_page(page_size=100)
+
+    # assert
+    assert cursor is None
+    assert (vertices, edges) == (full_vertices, full_edges)
+
+
+def test_get_graph_page_exports_undeclared_relationship_types(mocker):
+    # arrange
+    _patch_graph_phases(mocker)
+    app1, app2, compute1 = _graph_page_rows()
+    app1[4].append(["4:db:2", "MIRRORS", {"since": 1}])
+    connection, _ = _mock_connection(mocker, [app1, app2], [compute1])
+
+    # act
+    _, edges, _ = connection.get_graph_page(page_size=100)
+
+    # assert
+    assert {"start_node": "4:db:1", "end_node": "4:db:2", "type": "MIRRORS", "properties": {"since": 1}} in edges
+    assert len(edges) == 3
+
+
+@pytest.mark.parametrize('cursor', ["not a cursor", "eyJwaGFzZSI6WyJ2ZXJ0ZXgiLCJOb3BlIl0sImFmdGVyIjoiIn0="])
+def test_get_graph_page_rejects_invalid_cursor(mocker, cursor):
+    # arrange
+    _patch_graph_phases(mocker)
+    connection, session = _mock_connection(mocker)
+
+    # act/assert
+    with pytest.raises(ValueError):
+        connection.get_graph_page(cursor)
+    session.run.assert_not_called()
+
+
+def test_async_get_graph_page(mocker):
+    # arrange
+    _patch_graph_phases(mocker)
+    app1, app2, compute1 = _graph_page_rows()
+    connection, _ = _mock_async_connection(mocker, [app1, app2], [compute1])
+    sync_connection, _ = _mock_connection(mocker, [app1, app2], [compute1])
+
+    # act
+    page = asyncio.run(connection.get_graph_page(page_size=100))
+
+    # assert
+    assert page == sync_connection.get_graph_page(page_size=100)
+
+
+def _mock_parts_connection(mocker, **extra_types):
+    """A Neo4jConnection answering the per label and per relationship type export queries, with the edges of
+       `extra_types` besides those of _full_graph_rows()"""
+    (app1, app2, compute1), (calls, runs) = _full_graph_rows()
+    rows = {"`Application`": [app1, app2], "`Compute`": [compute1], "`CALLS`": [calls], "`RUNS`": [runs]}
+    rows.update({f"`{name}`": part for name, part in extra_types.items()})
+    rows["db.relationshipTypes()"] = [["CALLS"], ["RUNS"]] + [[name] for name in extra_types]
+    connection, session = _mock_connection(mocker)
+    session.run.side_effect = lambda query, params=None: iter(
+        next(part for name, part in rows.items() if name in query))
+    return connection, session
+
+
+def test_get_full_graph_in_parts_matches_full_graph(mocker):
+    # arrange
+    _patch_graph_phases(mocker)
+    connection, session = _mock_parts_connection(mocker)
+    full_vertices, full_edges = _mock_connection(mocker, *_full_graph_rows())[0].get_full_graph_as_json()
+
+    # act
+    vertices, edges = connection.get_full_graph_as_json(workers=3)
+
+    # assert
+    assert session.run.call_count == 5
+    assert connection._driver.session.call_count == 5  # pylint: disable=protected-access
+    assert vertices == full_vertices
+    assert edges == full_edges
+
+
+def test_get_full_graph_in_parts_exports_undeclared_relationship_types(mocker):
+    # arrange
+    _patch_graph_phases(mocker)
+    mirrors = ["5:db:9", "4:db:1", "4:db:2", "MIRRORS", {"since": 1}]
+    connection, session = _mock_parts_connection(mocker, MIRRORS=[mirrors])
+
+    # act
+    _, edges = connection.get_full_graph_in_parts(workers=2)
+
+    # assert
+    assert {"start_node": "4:db:1", "end_node": "4:db:2", "type": "MIRRORS", "properties": {"since": 1}} in edges
+    assert len(edges) == 3
+    assert any("`MIRRORS`" in call.args[0] for call in session.run.call_args_list)
+
+
+def test_get_full_graph_in_parts_requires_a_worker(mocker):
+    # arrange
+    connection, _ = _mock_parts_connection(mocker)
+
+    # act/assert
+    with pytest.raises(ValueError):
+        connection.get_full_graph_in_parts(workers=0)
+
+
+def _graph_delta_rows():
+    (app1, app2, _), (calls, runs) = _full_graph_rows()
+    return [[1700000000.0]], [app1, app2], [calls, runs], [["4:db:9"]]
+
+
+def test_get_graph_delta(mocker):
+    # arrange
+    _patch_graph_phases(mocker)
+    connection, session = _mock_connection(mocker, *_graph_delta_rows())
+    full_vertices, full_edges = _mock_connection(mocker, *_full_graph_rows())[0].get_full_graph_as_json()
+    since = datetime.datetime(2023, 11, 1, tzinfo=datetime.timezone.utc)
+
+    # act
+    delta = connection.get_graph_delta(since)
+
+    # assert
+    assert isinstance(delta, GraphDelta)
+    assert delta.vertices == {key: full_vertices[key] for key in ("4:db:1", "4:db:2")}
+    assert delta.edges == full_edges
+    assert delta.deleted == ["4:db:9"]
+    assert delta.watermark == datetime.datetime(2023, 11, 14, 22, 12, 20, tzinfo=datetime.timezone.utc)
+    vertices_query, params = session.run.call_args_list[1].args
+    assert "MATCH (vertex:`Compute`) WHERE vertex.modified_timestamp > $since RETURN vertex" in vertices_query
+    assert params == {"since": since.timestamp()}
+
+
+def test_get_graph_delta_without_watermark(mocker):
+    # arrange
+    _patch_graph_phases(mocker)
+    watermark, vertex_rows, edge_rows, _ = _graph_delta_rows()
+    connection, session = _mock_connection(mocker, watermark, vertex_rows, edge_rows)
+
+    # act
+    delta = connection.get_graph_delta(None)
+
+    # assert
+    assert session.run.call_count == 3
+    assert "modified_timestamp" not in session.run.call_args_list[1].args[0]
+    assert len(delta.vertices) == 2 and len(delta.edges) == 2
+    assert delta.deleted == []
+
+
+def test_get_graph_delta_watermark_lag(mocker):
+    # arrange
+    _patch_graph_phases(mocker)
+    connection, session = _mock_connection(mocker, *_graph_delta_rows())
+
+    # act
+    delta = connection.get_graph_delta(delta_since := datetime.datetime(2023, 11, 1, tzinfo=datetime.timezone.utc),
+                                       lag=0)
+
+    # assert
+    assert delta.watermark == datetime.datetime(2023, 11, 14, 22, 13, 20, tzinfo=datetime.timezone.utc)
+    assert session.run.call_args_list[1].args[1] == {"since": delta_since.timestamp()}
+    with pytest.raises(ValueError):
+        connection.get_graph_delta(None, lag=-1)
+
+
+def test_async_get_graph_delta(mocker):
+    # arrange
+    _patch_graph_phases(mocker)
+    since = datetime.datetime(2023, 11, 1, tzinfo=datetime.timezone.utc)
+    connection, _ = _mock_async_connection(mocker, *_graph_delta_rows())
+    sync_connection, _ = _mock_connection(mocker, *_graph_delta_rows())
+
+    # act
+    delta = asyncio.run(connection.get_graph_delta(since))
+
+    # assert
+    assert delta == sync_connection.get_graph_delta(since)
+
+
+def _edge(start_node, end_node, edge_type="CALLS"):
+    return {"start_node": start_node, "end_node": end_node, "type": edge_type, "properties": {}}
+
+
+def _cache_deltas():
+    """a1 -> a2 -> a3, then a1 updated and a3 deleted, leaving a2 with a1 only"""
+    watermark = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    full = GraphDelta({"a1": {"name": "a1"}, "a2": {"name": "a2"}, "a3": {"name": "a3"}},
+                      [_edge("a1", "a2"), _edge("a2", "a3")], [], watermark)
+    delta = GraphDelta({"a1": {"name": "a1", "provider": "aws"}, "a2": {"name": "a2"}},
+                       [_edge("a1", "a2")], ["a3"], watermark + datetime.timedelta(seconds=1))
+    return full, delta
+
+
+def test_graph_cache_serves_from_memory(mocker):
+    # arrange
+    connection = mocker.MagicMock()
+    connection.get_graph_delta.side_effect = _cache_deltas()
+    cache = GraphCache(connection, ttl=60)
+
+    # act
+    first = cache.get()
+    second = cache.get()
+
+    # assert
+    connection.get_graph_delta.assert_called_once_with(None)
+    assert first == second == (
+        {"a1": {"name": "a1"}, "a2": {"name": "a2"}, "a3": {"name": "a3"}}, [_edge("a1", "a2"), _edge("a2", "a3")])
+
+
+def test_graph_cache_applies_delta_after_write(mocker):
+    # arrange
+    full, delta = _cache_deltas()
+    connection = mocker.MagicMock()
+    connection.get_graph_delta.side_effect = [full, delta]
+    cache = GraphCache(connection, ttl=60)
+    cache.get()
+
+    # act
+    cache.invalidate(Application, 'update')
+    vertices, edges = cache.get()
+
+    # assert
+    connection.get_graph_delta.assert_called_with(full.watermark)
+    assert vertices == delta.vertices
+    assert edges == [_edge("a1", "a2")]
+
+
+def test_graph_cache_accepts_overlapping_deltas(mocker):
+    # arrange
+    full, delta = _cache_deltas()
+    connection = mocker.MagicMock()
+    connection.get_graph_delta.side_effect = [full, delta, delta]
+    cache = GraphCache(connection, ttl=0)
+    cache.get()
+
+    # act
+    once = cache.get()
+    twice = cache.get()
+
+    # assert
+    assert once == twice == (delta.vertices, [_edge("a1", "a2")])
+
+
+def test_graph_cache_keeps_vertices_left_without_edges(mocker):
+    # arrange
+    full, _ = _cache_deltas()
+    delta = GraphDelta({"a1": {"name": "a1"}, "a3": {"name": "a3"}}, [], ["a2"], full.watermark)
+    connection = mocker.MagicMock()
+    connection.get_graph_delta.side_effect = [full, delta]
+    cache = GraphCache(connection, ttl=0)
+
+    # act
+    cache.get()
+    vertices, edges = cache.get()
+
+    # assert
+    assert (vertices, edges) == ({"a1": {"name": "a1"}, "a3": {"name": "a3"}}, [])
+
+
+def test_graph_cache_does_not_keep_large_graphs(mocker):
+    # arrange
+    full, _ = _cache_deltas()
+    connection = mocker.MagicMock()
+    connection.get_graph_delta.side_effect = [full, full]
+    cache = GraphCache(connection, ttl=60, max_items=4)
+
+    # act
+    first = cache.get()
+    second = cache.get()
+
+    # assert
+    assert first == second == (full.vertices, full.edges)
+    assert connection.get_graph_delta.call_count == 2
+
+
+def test_get_full_graph_as_json_uses_cache(mocker):
+    # arrange
+    connection, session = _mock_connection(mocker, *_full_graph_rows())
+    connection.cache = GraphCache(connection, ttl=60)
+    full, _ = _cache_deltas()
+    mocker.patch.object(connection, 'get_graph_delta', return_value=full)
+
+    # act
+    cached = connection.get_full_graph_as_json()
+    uncached = connection.get_full_graph_as_json(use_cache=False)
+
+    # assert
+    assert cached == (full.vertices, full.edges)
+    assert len(uncached[0]) == 3 and session.run.call_count == 2
+
+
+def test_get_full_graph_as_json_rejects_workers_with_cache(mocker):
+    # arrange
+    connection, session = _mock_connection(mocker)
+    connection.cache = GraphCache(connection, ttl=60)
+
+    # act/assert
+    with pytest.raises(ValueError):
+        connection.get_full_graph_as_json(workers=4)
+    assert session.run.call_count == 0
+
+
+def test_write_listeners_are_notified(mocker):
+    # arrange
+    mocker.patch.object(db, 'cypher_query', return_value=([[1, []]], None))
+    listener = mocker.MagicMock()
+    add_write_listener(listener)
+
+    # act
+    try:
+        Application.update_many([({"name": "app1"}, {"provider": "aws"})])
+        Compute.delete_by_attributes({"name": "compute1"})
+    finally:
+        remove_write_listener(listener)
+    Application.bulk_upsert([{"name": "app1"}])
+
+    # assert
+    assert [call.args for call in listener.call_args_list] == [
+        (Application, 'update_many'), (Compute, 'delete_by_attributes')]
+
+
+def test_async_bulk_upsert_runs_the_same_queries(mocker):
+    # arrange
+    records = [{"name": f"app{i}"} for i in range(3)]
+    rows = [[[f"4:db:{i}"] for i in range(2)], [["4:db:2"]]]
+    connection, session = _mock_async_connection(mocker, *rows)
+    mock_cypher_query = mocker.patch.object(db, 'cypher_query', side_effect=[(result, None) for result in rows])
+
+    # act
+    element_ids = asyncio.run(connection.bulk_upsert(Application, records, batch_size=2))
+
+    # assert
+    assert element_ids == Application.bulk_upsert(records, batch_size=2) == ["4:db:0", "4:db:1", "4:db:2"]
+    assert [call.args for call in session.run.call_args_list] == \
+        [call.args for call in mock_cypher_query.call_args_list]
+
+
+def test_async_find_by_dns_names(mocker):
+    # arrange
+    existing = Node(Graph(), "4:db:1", 1, ["Resource"], {"dns_names": ["db.example.com"]})
+    connection, session = _mock_async_connection(mocker, [[existing]])
+
+    # act
+    result = asyncio.run(connection.find_by_dns_names(Resource, ["db.example.com"]))
+
+    # assert
+    assert session.run.call_args.args[1] == {'dns_names': ["db.example.com"]}
+    assert result.element_id == "4:db:1"
+
+
+def test_async_delete_by_attributes(mocker):
+    # arrange
+    connection, _ = _mock_async_connection(mocker, [[1, []]])
+
+    # act
+    result = asyncio.run(connection.delete_by_attributes(Application, {"name": "app1"}))
+
+    # assert
+    assert result is True
+
+
+def test_async_open_passes_driver_settings(mocker):
+    # arrange
+    mock_driver = mocker.patch.object(neo4j.AsyncGraphDatabase, 'driver')
+    connection = AsyncNeo4jConnection(uri="neo4j://localhost:7687", auth=("neo4j", "neo4j"), database='platdb',
+                                      keep_alive=True, max_connection_lifetime=600.0)
+
+    # act
+    asyncio.run(connection.open())
+
+    # assert
+    mock_driver.assert_called_once_with("neo4j://localhost:7687", auth=("neo4j", "neo4j"),
+                                        keep_alive=True, max_connection_lifetime=600.0)
+
+
+def _subgraph_rows():
+    """app1 and its neighbours, as the single row of the subgraph query"""
+    vertex_rows, edge_rows = _full_graph_rows()
+    return [[[list(row) for row in vertex_rows], [list(row) for row in edge_rows]]],
+
+
+def test_get_subgraph_as_json(mocker):
+    # arrange
+    connection, session = _mock_connection(mocker, *_subgraph_rows())
+    full_vertices, full_edges = _mock_connection(mocker, *_full_graph_rows())[0].get_full_graph_as_json()
+
+    # act
+    vertices, edges = connection.get_subgraph_as_json(Application, {"name": "app1"}, max_depth=2,
+                                                      relationship_types=["RUNS", "CALLS"], direction=OUTGOING)
+
+    # assert
+    assert (vertices, edges) == (full_vertices, full_edges)
+    query, params = session.run.call_args.args
+    assert session.run.call_count == 1
+    assert "MATCH (seed:Application {name: $seed.name})" in query
+    assert "(seed)-[:`CALLS`|`RUNS`*1..2]->(other)" in query
+    assert params == {"seed": {"name": "app1"}}
+
+
+def test_get_subgraph_as_json_without_seed(mocker):
+    # arrange
+    connection, session = _mock_connection(mocker, [])
+
+    # act
+    result = connection.get_subgraph_as_json(Compute, "4:db:9", max_depth=0)
+
+    # assert
+    assert result == ({}, [])
+    query, params = session.run.call_args.args
+    assert "WHERE elementId(seed) = $seed" in query and "OPTIONAL MATCH" not in query
+    assert params == {"seed": "4:db:9"}
+
+
+@pytest.mark.parametrize("arguments", [
+    {"max_depth": -1},
+    {"max_depth": 1.5},
+    {"relationship_types": []},
+    {"relationship_types": ["CALLS]->() DETACH DELETE (n"]},
+    {"direction": 2},
+])
+def test_get_subgraph_as_json_rejects_invalid_arguments(mocker, arguments):
+    # arrange
+    connection, session = _mock_connection(mocker)
+
+    # act/assert
+    with pytest.raises(ValueError):
+        connection.get_subgraph_as_json(Application, {"name": "app1"}, **arguments)
+    session.run.assert_not_called()
+
+
+def test_async_get_subgraph_as_json(mocker):
+    # arrange
+    connection, _ = _mock_async_connection(mocker, *_subgraph_rows())
+    sync_connection, _ = _mock_connection(mocker, *_subgraph_rows())
+
+    # act
+    subgraph = asyncio.run(connection.get_subgraph_as_json(Application, {"name": "app1"}))
+
+    # assert
+    assert subgraph == sync_connection.get_subgraph_as_json(Application, {"name": "app1"})
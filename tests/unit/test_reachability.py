@@ -0,0 +1,124 @@
+import datetime
+import random
+
+from corelib.platdb import Application, Compute, GraphDelta
+from corelib.reachability import DependencyIndex
+
+WATERMARK = datetime.datetime(2023, 11, 1, tzinfo=datetime.timezone.utc)
+
+LABELS = {"a": "Application", "r": "Resource", "t": "TrafficController", "c": "Compute"}
+TYPES = {("a", "a"): "CALLS", ("a", "r"): "USES", ("a", "t"): "DEPENDS_ON", ("c", "a"): "RUNS"}
+
+
+def _vertices(*element_ids):
+    """Vertices named after their label, ie. 'a1' is an Application"""
+    return {element_id: {"type": LABELS[element_id[0]]} for element_id in element_ids}
+
+
+def _edges(*pairs):
+    return [{"start_node": start, "end_node": end, "type": TYPES[start[0], end[0]], "properties": {}}
+            for start, end in pairs]
+
+
+def _reachable(pairs, start):
+    seen, pending = set(), [start]
+    while pending:
+        node = pending.pop()
+        for pair_start, end in pairs:
+            if pair_start == node and end not in seen:
+                seen.add(end)
+                pending.append(end)
+    return seen
+
+
+def test_dependents_and_dependencies_across_a_cycle():
+    # arrange
+    vertices = _vertices("a1", "a2", "a3", "a4", "r1", "t1", "c1")
+    edges = _edges(("a1", "a2"), ("a2", "a3"), ("a3", "a1"), ("a3", "r1"), ("a4", "t1"), ("c1", "a4"))
+
+    # act
+    index = DependencyIndex.from_json(vertices, edges)
+
+    # assert
+    assert len(index) == 6
+    assert index.dependents("r1") == {"a1", "a2", "a3"}
+    assert index.dependencies("a2") == {"a1", "a2", "a3", "r1"}
+    assert index.dependencies("a4") == {"t1"} and index.dependents("a4") == set()
+    assert index.depends_on("a1", "r1") and not index.depends_on("a4", "r1")
+    assert index.dependents("c1") == set() and not index.depends_on("c1", "t1")
+
+
+def test_apply_adds_and_removes_dependencies():
+    # arrange
+    index = DependencyIndex.from_json(_vertices("a1", "a2", "a3", "r1"), _edges(("a2", "r1")))
+
+    # act
+    index.apply(GraphDelta(_vertices("a1", "a2", "a4"), _edges(("a1", "a2"), ("a2", "r1"), ("a4", "a1")), [],
+                           WATERMARK))
+    added = index.dependents("r1")
+    index.apply(GraphDelta(_vertices("a1", "a2"), _edges(("a2", "r1"), ("a4", "a1")), [], WATERMARK))
+    removed = index.dependents("r1")
+    index.apply(GraphDelta({}, [], ["a2"], WATERMARK))
+
+    # assert
+    assert added == {"a1", "a2", "a4"}
+    assert removed == {"a2"}
+    assert index.dependents("r1") == set() and index.dependencies("a4") == {"a1"}
+
+
+def test_apply_overlapping_deltas_changes_nothing():
+    # arrange
+    index = DependencyIndex.from_json(_vertices("a1", "a2", "r1"), _edges(("a1", "a2"), ("a2", "r1")))
+    delta = GraphDelta(_vertices("a2"), _edges(("a1", "a2"), ("a2", "r1")), ["a3"], WATERMARK)
+
+    # act
+    index.apply(delta)
+    once = index.dependents("r1")
+    index.apply(delta)
+
+    # assert
+    assert once == index.dependents("r1") == {"a1", "a2"}
+    assert len(index) == 3
+
+
+def test_incremental_updates_match_a_rebuild(mocker):
+    # arrange
+    rebuild = mocker.spy(DependencyIndex, '_rebuild')
+    rng = random.Random(7)
+    element_ids = [f"a{i}" for i in range(30)] + [f"r{i}" for i in range(10)] + [f"t{i}" for i in range(5)]
+    pairs = []
+    index = DependencyIndex.from_json(_vertices(*element_ids), [])
+
+    # act
+    for _ in range(120):
+        pair = (f"a{rng.randrange(30)}", rng.choice(element_ids))
+        pairs.append(pair)
+        index.apply(GraphDelta(_vertices(*pair), _edges(*[p for p in pairs if set(p) & set(pair)]), [], WATERMARK))
+
+    # assert
+    assert rebuild.call_count == 1
+    rebuilt = DependencyIndex.from_json(_vertices(*element_ids), _edges(*pairs))
+    for element_id in element_ids:
+        assert index.dependencies(element_id) == rebuilt.dependencies(element_id) == _reachable(pairs, element_id)
+        assert index.dependents(element_id) == rebuilt.dependents(element_id)
+
+
+def test_connection_index_refreshes_after_writes(mocker):
+    # arrange
+    connection = mocker.MagicMock()
+    connection.get_graph_delta.side_effect = [
+        GraphDelta(_vertices("a1", "r1"), [], [], WATERMARK),
+        GraphDelta(_vertices("a1", "r1"), _edges(("a1", "r1")), [], WATERMARK + datetime.timedelta(seconds=1)),
+    ]
+    index = DependencyIndex(connection)
+
+    # act
+    before = index.dependents("r1")
+    index.invalidate(Compute, 'bulk_upsert')
+    unchanged = index.dependents("r1")
+    index.invalidate(Application, 'bulk_connect')
+    after = index.dependents("r1")
+
+    # assert
+    assert (before, unchanged, after) == (set(), set(), {"a1"})
+    assert connection.get_graph_delta.call_args_list == [mocker.call(None), mocker.call(WATERMARK)]
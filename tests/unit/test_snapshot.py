@@ -0,0 +1,90 @@
+import datetime
+
+from array import array
+
+import pytest
+
+from corelib.columnar import ColumnarGraph
+from corelib.snapshot import MAGIC, GraphSnapshot, write_snapshot
+
+from tests.unit.test_columnar import _graph
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    vertices, edges = _graph()
+    vertices["4:db:1"]["profile_timestamp"] = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    path = str(tmp_path / "graph.snapshot")
+    write_snapshot(ColumnarGraph.from_json(vertices, edges), path)
+    return path, vertices, edges
+
+
+def test_snapshot_round_trips(snapshot_path):
+    # arrange
+    path, vertices, edges = snapshot_path
+
+    # act
+    with GraphSnapshot(path) as snapshot:
+        snapshot_vertices, snapshot_edges = snapshot.to_json()
+
+    # assert
+    assert snapshot_vertices == vertices
+    assert sorted(snapshot_edges, key=repr) == sorted(edges, key=repr)
+
+
+def test_snapshot_decodes_vertices_on_access(mocker, snapshot_path):
+    # arrange
+    path, vertices, _ = snapshot_path
+    snapshot = GraphSnapshot(path)
+    loads = mocker.spy(GraphSnapshot, '_properties')
+
+    # act
+    vertex = snapshot.vertex(snapshot.index["4:db:1"])
+    runs_to_app2 = list(snapshot.in_neighbours("RUNS", snapshot.index["4:db:2"]))
+    snapshot.close()
+
+    # assert
+    assert loads.call_count == 1
+    assert vertex == vertices["4:db:1"]
+    assert vertex["profile_timestamp"].tzinfo == datetime.timezone.utc
+    assert runs_to_app2 == [snapshot.index["4:db:3"]]
+
+
+def test_neighbours_outlive_close(snapshot_path):
+    # arrange
+    path, _, _ = snapshot_path
+
+    # act
+    with GraphSnapshot(path) as snapshot:
+        app1, app2 = snapshot.index["4:db:1"], snapshot.index["4:db:2"]
+        calls = snapshot.out_neighbours("CALLS", app1)
+        runs = snapshot.in_neighbours("RUNS", app2)
+
+    # assert
+    assert list(calls) == [app2]
+    assert list(runs) == [snapshot.index["4:db:3"]]
+    assert isinstance(calls, array) and isinstance(runs, array)
+
+
+def test_write_snapshot_replaces_file(tmp_path, snapshot_path):
+    # arrange
+    path, _, _ = snapshot_path
+
+    # act
+    write_snapshot(ColumnarGraph.from_json({}, []), path)
+
+    # assert
+    assert [file.name for file in tmp_path.iterdir()] == ["graph.snapshot"]
+    with GraphSnapshot(path) as snapshot:
+        assert snapshot.to_json() == ({}, [])
+
+
+@pytest.mark.parametrize('content', [b"not a snapshot at all, not at all", MAGIC + b"\x09\0\0\0" + b"\0" * 20])
+def test_snapshot_rejects_other_files(tmp_path, content):
+    # arrange
+    path = tmp_path / "graph.snapshot"
+    path.write_bytes(content)
+
+    # act/assert
+    with pytest.raises(ValueError):
+        GraphSnapshot(str(path))